@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# This code is licensed under the New BSD License
+# 2009, Alexander Artemenko <svetlyak.40wt@gmail.com>
+# For other contacts, visit http://aartemenko.com
+
+"""
+Microbenchmark for the nested attribute access, like `doc.meta.stats.views`.
+
+It compares cached wrappers with the wrappers, created anew on every
+access (which is what happened before wrappers were cached), and
+reports the time and number of created wrappers per evaluation.
+
+Run it from the root of the distribution:
+
+    python benchmarks/attributed.py
+"""
+
+import sys
+import timeit
+
+from common import AllocationCounter, count_allocations
+
+from mongobongo import Document
+from mongobongo.attributed import AttributedDict, AttributedList
+
+N = 100000
+
+
+class Article(Document):
+    collection = 'benchmark_articles'
+
+
+def make_article():
+    return Article(meta = dict(stats = dict(views = 10, comments = [dict(votes = 1)])))
+
+
+def access_cached(doc):
+    return doc.meta.stats.views
+
+
+def access_uncached(doc):
+    doc._children.clear()
+    return AttributedDict(doc._data['meta']).stats.views
+
+
+def access_list_cached(doc):
+    return doc.meta.stats.comments[0].votes
+
+
+def access_list_uncached(doc):
+    doc._children.clear()
+    return AttributedDict(doc._data['meta']).stats.comments[0].votes
+
+
+def measure(func):
+    doc = make_article()
+    func(doc)
+
+    seconds = min(timeit.Timer(lambda: func(doc)).repeat(3, N))
+
+    def run():
+        for i in xrange(N):
+            func(doc)
+
+    counter = AllocationCounter(AttributedDict, AttributedList)
+    return seconds, float(count_allocations(run, counter)) / N
+
+
+def main():
+    print '%-42s %16s %20s' % ('scenario', 'usec per access', 'wrappers per access')
+    for name, func in (
+            ('doc.meta.stats.views, new wrappers', access_uncached),
+            ('doc.meta.stats.views, cached', access_cached),
+            ('doc.meta.stats.comments[0].votes, new', access_list_uncached),
+            ('doc.meta.stats.comments[0].votes, cached', access_list_cached)):
+        seconds, allocations = measure(func)
+        print '%-42s %16.3f %20.2f' % (name, seconds * 1000000 / N, allocations)
+
+    d = AttributedDict({})
+    print
+    print 'AttributedDict instance size: %d bytes (no __dict__: %s)' % (
+        sys.getsizeof(d), not hasattr(d, '__dict__'))
+
+
+if __name__ == '__main__':
+    main()
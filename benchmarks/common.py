@@ -0,0 +1,63 @@
+# This code is licensed under the New BSD License
+# 2009, Alexander Artemenko <svetlyak.40wt@gmail.com>
+# For other contacts, visit http://aartemenko.com
+
+"""
+Helpers, shared by the benchmarks.
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+
+class AllocationCounter(object):
+    """Counts instances of the given classes,
+       created between `start` and `stop` calls."""
+
+    def __init__(self, *classes):
+        self.classes = classes
+        self.count = 0
+
+    def start(self):
+        self.count = 0
+        self.originals = {}
+        for cls in self.classes:
+            original = self.originals[cls] = cls.__dict__['__init__']
+            cls.__init__ = self._counting(original)
+
+    def _counting(self, original):
+        def counting_init(obj, *args, **kwargs):
+            self.count += 1
+            original(obj, *args, **kwargs)
+        return counting_init
+
+    def stop(self):
+        for cls, original in self.originals.iteritems():
+            cls.__init__ = original
+
+
+def best_time(func, repeat = 3, setup = None):
+    """Returns the best of `repeat` runs, in seconds.
+       `setup` is called before each run and is not timed."""
+    times = []
+    for i in xrange(repeat):
+        if setup is not None:
+            setup()
+        started = time.time()
+        func()
+        times.append(time.time() - started)
+    return min(times)
+
+
+def count_allocations(func, counter, setup = None):
+    if setup is not None:
+        setup()
+    counter.start()
+    try:
+        func()
+    finally:
+        counter.stop()
+    return counter.count
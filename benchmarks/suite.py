@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# This code is licensed under the New BSD License
+# 2009, Alexander Artemenko <svetlyak.40wt@gmail.com>
+# For other contacts, visit http://aartemenko.com
+
+"""
+Benchmarks for the mapping layer of mongobongo.
+
+Every scenario is measured for mongobongo and for the same work done
+with the plain driver API, so the difference is mongobongo's overhead.
+By default, it runs on the in-process MemoryDatabase and needs no
+MongoDB server. Pass --host to run it against the real server.
+
+Run it from the root of the distribution:
+
+    python benchmarks/suite.py [-n 2000] [--host localhost]
+
+For each variant it reports operations per second and the number of
+objects, created by mongobongo (documents, attribute wrappers and
+DBRefs), per operation.
+
+To catch regressions, save results of one run and compare the
+following runs with them. Variants, which became slower than the
+tolerance allows, are marked and the exit status is 1:
+
+    python benchmarks/suite.py --save baseline.json
+    python benchmarks/suite.py --compare baseline.json --tolerance 0.2
+"""
+
+import optparse
+import sys
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from common import AllocationCounter, best_time, count_allocations
+
+from pymongo.dbref import DBRef
+from mongobongo import Document
+from mongobongo.attributed import AttributedDict, AttributedList
+from mongobongo.memory import MemoryDatabase
+
+
+class Article(Document):
+    collection = 'benchmark_articles'
+
+
+class Author(Document):
+    collection = 'benchmark_authors'
+
+
+def make_article_data(i):
+    return dict(title = 'Article %d' % i,
+                tags = ['python', 'mongo'],
+                meta = dict(stats = dict(views = i, votes = i % 10)))
+
+
+
+class Scenario(object):
+    """Scenario has `setup`, and variants, which are methods
+       with names, starting from `mongobongo_` or `driver_`."""
+
+    def __init__(self, db, n):
+        self.db = db
+        self.n = n
+
+    def setup(self):
+        Article.objects.db = self.db
+        Article.objects.remove()
+        Author.objects.remove()
+
+    def variants(self):
+        return [(name, getattr(self, name)) for name in dir(self)
+                if name.startswith('driver_') or name.startswith('mongobongo_')]
+
+
+
+class ReadDocuments(Scenario):
+    """Iterates over N documents and reads one field of each."""
+    name = 'read N docs'
+
+    def setup(self):
+        Scenario.setup(self)
+        Article.objects.save_many(make_article_data(i) for i in xrange(self.n))
+
+    def driver_find(self):
+        for data in self.db[Article.objects.collection_name].find():
+            data['title']
+
+    def mongobongo_all(self):
+        for article in Article.objects.all():
+            article.title
+
+    def mongobongo_raw(self):
+        for data in Article.objects.all().raw():
+            data['title']
+
+
+
+class DeepAccess(Scenario):
+    """Reads a nested field of the document N times."""
+    name = 'deep attribute access'
+
+    def setup(self):
+        self.article = Article(**make_article_data(1))
+
+    def driver_dict(self):
+        data = self.article._data
+        for i in xrange(self.n):
+            data['meta']['stats']['views']
+
+    def mongobongo_attributes(self):
+        article = self.article
+        for i in xrange(self.n):
+            article.meta.stats.views
+
+
+
+class SaveGraph(Scenario):
+    """Saves N articles, each one with a new author inside."""
+    name = 'save nested documents'
+
+    def driver_insert(self):
+        authors = self.db[Author.objects.collection_name]
+        articles = self.db[Article.objects.collection_name]
+        for i in xrange(self.n):
+            author_id = authors.insert(dict(name = 'Author %d' % i))
+            data = make_article_data(i)
+            data['author'] = DBRef(Author.objects.collection_name, author_id)
+            articles.insert(data)
+
+    def mongobongo_save(self):
+        for i in xrange(self.n):
+            data = make_article_data(i)
+            data['author'] = Author(name = 'Author %d' % i)
+            Article(__kwargs = data).save()
+
+
+
+class DereferenceIteration(Scenario):
+    """Iterates over N articles and reads the name of each
+       article's author. There are N / 10 distinct authors."""
+    name = 'dereference-heavy iteration'
+
+    def setup(self):
+        Scenario.setup(self)
+        authors = [Author(name = 'Author %d' % i).save()
+                   for i in xrange(max(self.n / 10, 1))]
+
+        def articles():
+            for i in xrange(self.n):
+                data = make_article_data(i)
+                data['author'] = authors[i % len(authors)]
+                yield data
+        Article.objects.save_many(articles())
+
+    def driver_dereference(self):
+        for data in self.db[Article.objects.collection_name].find():
+            self.db.dereference(data['author'])['name']
+
+    def mongobongo_lazy(self):
+        for article in Article.objects.all():
+            article.author.name
+
+    def mongobongo_prefetch(self):
+        for article in Article.objects.all().prefetch('author'):
+            article.author.name
+
+
+
+SCENARIOS = (ReadDocuments, DeepAccess, SaveGraph, DereferenceIteration)
+
+
+def run(db, n, repeat):
+    counter = AllocationCounter(Document, AttributedDict, AttributedList, DBRef)
+    results = []
+
+    for scenario_class in SCENARIOS:
+        scenario = scenario_class(db, n)
+        for variant, func in scenario.variants():
+            seconds = best_time(func, repeat, scenario.setup)
+            allocations = count_allocations(func, counter, scenario.setup)
+            results.append((scenario.name, variant, n / seconds,
+                            float(allocations) / n))
+    return results
+
+
+def main():
+    parser = optparse.OptionParser(usage = '%prog [options]')
+    parser.add_option('-n', type = 'int', default = 2000,
+                      help = 'number of operations in each scenario')
+    parser.add_option('-r', '--repeat', type = 'int', default = 3,
+                      help = 'number of runs, the best one is reported')
+    parser.add_option('--host',
+                      help = 'MongoDB server to use instead of MemoryDatabase')
+    parser.add_option('--port', type = 'int', default = 27017)
+    parser.add_option('--save', metavar = 'FILE',
+                      help = 'save results as JSON')
+    parser.add_option('--compare', metavar = 'FILE',
+                      help = 'compare results with the ones, saved before')
+    parser.add_option('--tolerance', type = 'float', default = 0.2,
+                      help = 'allowed slowdown, comparing with saved results')
+    options, args = parser.parse_args()
+
+    if options.host:
+        from pymongo.connection import Connection
+        db = Connection(options.host, options.port).mongobongo_benchmark
+    else:
+        db = MemoryDatabase('mongobongo_benchmark')
+
+    baseline = {}
+    if options.compare:
+        baseline = json.load(open(options.compare))
+
+    results = run(db, options.n, options.repeat)
+    regressions = 0
+
+    print '%-30s %-22s %12s %16s %10s' % (
+        'scenario', 'variant', 'ops/sec', 'objects per op', 'change')
+    for name, variant, ops, allocations in results:
+        change = ''
+        saved = baseline.get('%s/%s' % (name, variant))
+        if saved is not None:
+            ratio = ops / saved['ops']
+            change = '%+.0f%%' % ((ratio - 1) * 100)
+            if ratio < 1 - options.tolerance:
+                change += ' !'
+                regressions += 1
+        print '%-30s %-22s %12.0f %16.2f %10s' % (
+            name, variant, ops, allocations, change)
+
+    if options.save:
+        data = dict(('%s/%s' % (name, variant),
+                     dict(ops = ops, allocations = allocations))
+                    for name, variant, ops, allocations in results)
+        json.dump(data, open(options.save, 'w'), indent = 2)
+
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1 +1,6 @@
-from mongobongo.document import Document
+from mongobongo.document import Document, PRIMARY, SECONDARY
+from mongobongo.fields import Field, Reference, Embedded
+from mongobongo.identity import identity_map
+from mongobongo.indexes import Index
+from mongobongo.unitofwork import session
+from mongobongo.context import using
@@ -0,0 +1,144 @@
+# This code is licensed under the New BSD License
+# 2009, Alexander Artemenko <svetlyak.40wt@gmail.com>
+# For other contacts, visit http://aartemenko.com
+
+"""
+Aggregation pipelines, which run on the server.
+
+Pipeline is a list of stages, as MongoDB's `aggregate` command takes
+it, or a Pipeline, built with chained calls:
+
+>>> class AuthorStats(Document):
+...     collection = 'author_stats'
+>>> for stats in Article.objects.pipeline(AuthorStats) \\
+...                     .match({'published': True}) \\
+...                     .group('$author', articles = {'$sum': 1}) \\
+...                     .sort('articles', DESCENDING) \\
+...                     .limit(10):
+...     print stats._id, stats.articles
+
+Results are plain dicts, or instances of the output Document class.
+Documents, joined with `lookup`, are turned into instances of the
+classes, registered for their collections.
+
+The `aggregate` command appeared in MongoDB 2.2, and `$lookup` in 3.2.
+MemoryDatabase runs pipelines itself, so they could be tested
+without the server.
+"""
+
+from pymongo import ASCENDING
+from pymongo.son import SON
+
+
+class Pipeline(object):
+    """Chainable builder of the pipeline. When it is made by the
+       manager's `pipeline` method, iteration runs it."""
+
+    def __init__(self, manager = None, output_class = None):
+        self.stages = []
+        self._manager = manager
+        self._output_class = output_class
+
+
+    def _add(self, operator, argument):
+        self.stages.append({operator: argument})
+        return self
+
+
+    def match(self, query):
+        return self._add('$match', query)
+
+
+    def project(self, fields = None, **kwargs):
+        """Takes dict of fields, or fields as keyword arguments:
+           `project(title = 1, author = '$author.name')`."""
+        fields = dict(fields or {}, **kwargs)
+        return self._add('$project', fields)
+
+
+    def group(self, key, accumulators = None, **kwargs):
+        """Groups by `key` expression, like '$author', and computes
+           accumulators: `group('$author', total = {'$sum': 1})`."""
+        group = dict(accumulators or {}, **kwargs)
+        group['_id'] = key
+        return self._add('$group', group)
+
+
+    def sort(self, key_or_list, direction = ASCENDING):
+        if isinstance(key_or_list, basestring):
+            key_or_list = [(key_or_list, direction)]
+        return self._add('$sort', SON(key_or_list))
+
+
+    def limit(self, limit):
+        return self._add('$limit', limit)
+
+
+    def skip(self, skip):
+        return self._add('$skip', skip)
+
+
+    def unwind(self, path):
+        if not path.startswith('$'):
+            path = '$' + path
+        return self._add('$unwind', path)
+
+
+    def lookup(self, from_collection, local_field, foreign_field, as_field):
+        """Joins documents from other collection, which `foreign_field`
+           equals to `local_field` of this one, as list in `as_field`."""
+        if hasattr(from_collection, 'objects'):
+            from_collection = from_collection.objects.collection_name
+        return self._add('$lookup', {'from': from_collection,
+                                     'localField': local_field,
+                                     'foreignField': foreign_field,
+                                     'as': as_field})
+
+
+    def __iter__(self):
+        if self._manager is None:
+            raise TypeError('pipeline is not bound to the collection, '
+                            'pass it to the aggregate method')
+        return self._manager.aggregate(self.stages, self._output_class)
+
+
+    def __repr__(self):
+        return '<Pipeline %r>' % (self.stages,)
+
+
+
+def _resolve_lookup(row, name, doc_class):
+    value = row.get(name)
+    if isinstance(value, list):
+        row[name] = [doc_class._from_db(item) for item in value
+                     if isinstance(item, dict)]
+    elif isinstance(value, dict):
+        row[name] = doc_class._from_db(value)
+
+
+def aggregate(manager, stages, output_class):
+    """Runs the `aggregate` command and yields its results."""
+    from mongobongo.document import get_doc_class_for_collection
+
+    if isinstance(stages, Pipeline):
+        stages = stages.stages
+
+    command = SON([('aggregate', manager.collection_name),
+                   ('pipeline', stages)])
+    response = manager._instrumented('aggregate', stages,
+                                     manager.db.command, command)
+
+    lookups = []
+    for stage in stages:
+        if '$lookup' in stage:
+            lookup = stage['$lookup']
+            doc_class = get_doc_class_for_collection(lookup['from'])
+            if doc_class is not None:
+                lookups.append((lookup['as'], doc_class))
+
+    for row in response['result']:
+        for name, doc_class in lookups:
+            _resolve_lookup(row, name, doc_class)
+        if output_class is not None:
+            row = output_class._from_db(row)
+        yield row
@@ -0,0 +1,287 @@
+# This code is licensed under the New BSD License
+# 2009, Alexander Artemenko <svetlyak.40wt@gmail.com>
+# For other contacts, visit http://aartemenko.com
+
+"""
+Non-blocking access to the documents, for the event loop based servers.
+
+Every Document class gets the `async_objects` manager. Its methods
+run blocking driver calls in a pool of worker threads and immediately
+return Future objects:
+
+>>> def show(future):
+...     print future.result().title
+>>> Article.async_objects.find_one({'slug': 'first'}).add_done_callback(show)
+
+Callbacks are called in the worker thread, so pass results to your
+event loop with its thread safe call, for example Twisted's
+`reactor.callFromThread` or Tornado's `IOLoop.add_callback`.
+Exceptions, raised by callbacks, are logged to the 'mongobongo' logger
+and don't stop other callbacks and the worker.
+
+Cursors are iterated with `to_list` or `each`:
+
+>>> Article.async_objects.find({'tags': 'python'}).sort('title').to_list()
+>>> Article.async_objects.find().each(lambda article: index(article))
+"""
+
+import logging
+import sys
+import threading
+from Queue import Queue
+
+from mongobongo.context import with_current_database
+
+DEFAULT_WORKERS = 4
+
+log = logging.getLogger('mongobongo')
+
+
+class Future(object):
+    """Result of the call, which runs in the background."""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._done = False
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+
+
+    def done(self):
+        return self._done
+
+
+    def _wait(self, timeout):
+        self._condition.acquire()
+        try:
+            if not self._done:
+                self._condition.wait(timeout)
+            if not self._done:
+                raise RuntimeError('result is not ready after %s seconds' % timeout)
+        finally:
+            self._condition.release()
+
+
+    def result(self, timeout = None):
+        """Waits for the call to complete and returns its result
+           or raises its exception."""
+        self._wait(timeout)
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+
+    def exception(self, timeout = None):
+        """Waits for the call to complete and returns
+           its exception or None."""
+        self._wait(timeout)
+        if self._exc_info is not None:
+            return self._exc_info[1]
+        return None
+
+
+    def add_done_callback(self, callback):
+        """Calls `callback(future)` when the call completes, or right
+           now, if it is already completed."""
+        self._condition.acquire()
+        try:
+            if not self._done:
+                self._callbacks.append(callback)
+                return
+        finally:
+            self._condition.release()
+        self._call(callback)
+
+
+    def _call(self, callback):
+        try:
+            callback(self)
+        except:
+            log.exception('exception in the callback %r', callback)
+
+
+    def _complete(self, result = None, exc_info = None):
+        self._condition.acquire()
+        try:
+            self._result = result
+            self._exc_info = exc_info
+            self._done = True
+            self._condition.notifyAll()
+            callbacks, self._callbacks = self._callbacks, []
+        finally:
+            self._condition.release()
+
+        for callback in callbacks:
+            self._call(callback)
+
+
+
+class Executor(object):
+    """Pool of daemon threads, which run submitted calls."""
+
+    def __init__(self, workers = DEFAULT_WORKERS):
+        self._tasks = Queue()
+        self._threads = []
+        for i in xrange(workers):
+            thread = threading.Thread(target = self._work)
+            thread.setDaemon(True)
+            thread.start()
+            self._threads.append(thread)
+
+
+    def _work(self):
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                # shutdown
+                return
+            future, func, args, kwargs = task
+            try:
+                result = func(*args, **kwargs)
+            except:
+                future._complete(exc_info = sys.exc_info())
+            else:
+                future._complete(result)
+
+
+    def submit(self, func, *args, **kwargs):
+        """Runs `func` with the database binding of the calling thread."""
+        future = Future()
+        self._tasks.put((future, with_current_database(func), args, kwargs))
+        return future
+
+
+    def shutdown(self, wait = True):
+        """Stops the workers, after they run calls, which were
+           already submitted. Waits for them, when `wait` is true."""
+        for thread in self._threads:
+            self._tasks.put(None)
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor():
+    """Returns the executor, shared by all async managers."""
+    global _executor
+    _executor_lock.acquire()
+    try:
+        if _executor is None:
+            _executor = Executor()
+        return _executor
+    finally:
+        _executor_lock.release()
+
+
+
+class AsyncCursor(object):
+    """Wraps CursorProxy. Methods, which configure the query,
+       like `sort`, `limit` or `only`, are called right away,
+       and results are fetched in the background."""
+
+    def __init__(self, cursor, executor):
+        self._cursor = cursor
+        self._executor = executor
+
+
+    def __getattr__(self, name):
+        method = getattr(self._cursor, name)
+        if not callable(method):
+            return method
+
+        def chain(*args, **kwargs):
+            result = method(*args, **kwargs)
+            if result is self._cursor:
+                return self
+            return result
+        return chain
+
+
+    def to_list(self, length = None):
+        """Future list of documents, at most `length` of them."""
+        def fetch():
+            result = []
+            for doc in self._cursor:
+                result.append(doc)
+                if length is not None and len(result) >= length:
+                    break
+            return result
+        return self._executor.submit(fetch)
+
+
+    def each(self, callback):
+        """Calls `callback(doc)` for every document in the worker thread.
+           Returns the Future, which completes after the last document."""
+        def iterate():
+            for doc in self._cursor:
+                callback(doc)
+        return self._executor.submit(iterate)
+
+
+    def count(self):
+        return self._executor.submit(len, self._cursor)
+
+
+
+class AsyncCollectionManager(object):
+    """Mirrors the CollectionManager, but returns Futures."""
+
+    def __init__(self, manager, executor = None):
+        self._manager = manager
+        self._executor = executor
+
+
+    def _get_executor(self):
+        return self._executor or get_executor()
+    executor = property(_get_executor)
+
+
+    def _submit(self, func, *args, **kwargs):
+        return self.executor.submit(func, *args, **kwargs)
+
+
+    def find(self, *args, **kwargs):
+        return AsyncCursor(self._manager.find(*args, **kwargs), self.executor)
+
+
+    def all(self, *args, **kwargs):
+        return AsyncCursor(self._manager.all(*args, **kwargs), self.executor)
+
+
+    def find_one(self, *args, **kwargs):
+        return self._submit(self._manager.find_one, *args, **kwargs)
+
+
+    def count(self):
+        return self._submit(self._manager.count)
+
+
+    def save(self, doc):
+        """Saves the document, future result is the document itself."""
+        return self._submit(doc.save)
+
+
+    def save_many(self, docs, *args, **kwargs):
+        return self._submit(self._manager.save_many, docs, *args, **kwargs)
+
+
+    def remove(self, doc_or_query = {}):
+        """Removes the document, or all documents, matching the query."""
+        if isinstance(doc_or_query, dict):
+            return self._submit(self._manager.remove, doc_or_query)
+        return self._submit(doc_or_query.remove)
+
+
+    def dereference(self, dbref):
+        return self._submit(self._manager.dereference, dbref)
+
+
+    def load_reference(self, doc, name):
+        """Fetches the document, referenced by `doc.<name>`, so the
+           following attribute access doesn't block."""
+        return self._submit(getattr, doc, name)
@@ -4,33 +4,74 @@
 
 
 
-def _wrap(value):
+def _join(path, name):
+    if not isinstance(name, basestring):
+        # list index
+        name = unicode(name)
+    if path:
+        return '%s.%s' % (path, name)
+    return name
+
+
+def _wrap(value, on_change = None, path = ''):
     """Wraps value in a new AttributedDict or AttributedList."""
     if isinstance(value, dict):
-        return AttributedDict(value)
+        return AttributedDict(value, on_change, path)
     elif isinstance(value, list):
-        return AttributedList(value)
+        return AttributedList(value, on_change, path)
     return value
 
 
+def _wrap_child(parent, key, value):
+    """Returns wrapper for the parent's item, creating it only
+       if the item was not wrapped before or was replaced."""
+    cached = parent._children.get(key)
+    if cached is not None and cached[0] is value:
+        return cached[1]
+
+    wrapped = _wrap(value, parent._on_change, _join(parent._path, key))
+    if wrapped is not value:
+        parent._children[key] = (value, wrapped)
+    return wrapped
+
+
 class AttributedDict(object):
-    def __init__(self, d):
-        self._data = d
+    """Proxy, which gives attribute access to the dict's items.
+
+       When `on_change` callback is given, it is called with
+       dotted path of every changed item, prefixed by `path`.
+
+       Wrappers for the inner dicts and lists are cached, so
+       repeated access returns the same object.
+    """
+    __slots__ = ('_data', '_on_change', '_path', '_children')
+
+    def __init__(self, d, on_change = None, path = ''):
+        object.__setattr__(self, '_data', d)
+        object.__setattr__(self, '_on_change', on_change)
+        object.__setattr__(self, '_path', path)
+        object.__setattr__(self, '_children', {})
 
 
     def __getattr__(self, name):
-        return _wrap(self._data[name])
+        return _wrap_child(self, name, self._data[name])
 
 
     def __setattr__(self, name, value):
-        if name == '_data':
-            self.__dict__[name] = value
+        if name in self.__slots__:
+            object.__setattr__(self, name, value)
         else:
             self._data[name] = value
+            self._children.pop(name, None)
+            if self._on_change is not None:
+                self._on_change(_join(self._path, name))
 
 
     def __delattr__(self, name):
         self._data.__delitem__(name)
+        self._children.pop(name, None)
+        if self._on_change is not None:
+            self._on_change(_join(self._path, name))
 
 
     def __eq__(self, d):
@@ -48,17 +89,47 @@ class AttributedDict(object):
 
     def iteritems(self):
         for key, value in self._data.iteritems():
-            yield (key, _wrap(value))
+            yield (key, _wrap_child(self, key, value))
 
 
 
 class AttributedList(object):
-    def __init__(self, l):
+    """Proxy, which wraps list's items, to give attribute access to them.
+       See AttributedDict for `on_change` and `path` description.
+    """
+    __slots__ = ('_data', '_on_change', '_path', '_children')
+
+    def __init__(self, l, on_change = None, path = ''):
         self._data = l
+        self._on_change = on_change
+        self._path = path
+        self._children = {}
 
 
     def __getitem__(self, index):
-        return _wrap(self._data[index])
+        if isinstance(index, slice):
+            return _wrap(self._data[index], self._on_change, self._path)
+
+        value = self._data[index]
+        index = index % len(self._data)
+        return _wrap_child(self, index, value)
+
+
+    def __setitem__(self, index, value):
+        self._data[index] = value
+        if isinstance(index, slice):
+            self._children.clear()
+            if self._on_change is not None:
+                self._on_change(self._path)
+        else:
+            index = index % len(self._data)
+            self._children.pop(index, None)
+            if self._on_change is not None:
+                self._on_change(_join(self._path, index))
+
+
+    def __len__(self):
+        return len(self._data)
 
 
     def __eq__(self, l):
@@ -70,4 +141,3 @@ class AttributedList(object):
 
     def __ne__(self, l):
         return not self.__eq__(l)
-
@@ -0,0 +1,157 @@
+# This code is licensed under the New BSD License
+# 2009, Alexander Artemenko <svetlyak.40wt@gmail.com>
+# For other contacts, visit http://aartemenko.com
+
+"""
+Query result cache.
+
+It is turned on per Document class, in its Meta:
+
+>>> class Article(Document):
+...     collection = 'articles'
+...     class Meta:
+...         cache_ttl = 60      # seconds
+...         cache_size = 500    # queries
+
+Results of `find`, `find_one` and `all` are kept for `cache_ttl`
+seconds, keyed by the database, query, projection, sort, skip and
+limit. Saves and removes, made through the collection manager of any
+class, which uses the same collection, drop all cached results of
+this collection.
+Call `Article.objects.invalidate()` after changes, made elsewhere.
+
+Every cached query keeps the whole result in memory, so use the
+cache for small results of rarely changing collections.
+"""
+
+import copy
+import threading
+import time
+
+from pymongo.errors import InvalidOperation
+from mongobongo.context import database_key
+from mongobongo.lru import LRUCache
+
+DEFAULT_CACHE_SIZE = 100
+
+_caches = {}
+
+
+def invalidate_collection(collection):
+    """Drops cached results of all queries to the `collection`."""
+    for cache in _caches.get(collection, ()):
+        cache.clear()
+
+
+def _freeze(value):
+    """Converts queries and other values into something hashable.
+       Order of keys in the dict doesn't matter."""
+    if isinstance(value, dict):
+        return ('{}', tuple(sorted((key, _freeze(item))
+                                   for key, item in value.iteritems())))
+    if isinstance(value, (list, tuple)):
+        return ('[]', tuple(_freeze(item) for item in value))
+    try:
+        hash(value)
+    except TypeError:
+        return ('repr', repr(value))
+    return value
+
+
+
+class QueryCache(object):
+    """LRU cache of query results, which expire after `ttl` seconds."""
+
+    def __init__(self, collection, ttl, size = DEFAULT_CACHE_SIZE):
+        self.ttl = ttl
+        self.__results = LRUCache(size)
+        self.__lock = threading.Lock()
+        _caches.setdefault(collection, []).append(self)
+
+
+    def _get_hits(self): return self.__results.hits
+    hits = property(_get_hits)
+
+    def _get_misses(self): return self.__results.misses
+    misses = property(_get_misses)
+
+
+    def make_key(self, db, spec, fields, sort, skip, limit, lazy = False):
+        """Key of the query. Results from different databases, like
+           ones bound with `mongobongo.using`, are kept apart, and so
+           are lazy BSON rows and decoded ones."""
+        return (database_key(db),
+                _freeze((spec, fields, sort, skip, limit, lazy)))
+
+
+    def get(self, key):
+        """Returns list of cached rows, or None."""
+        self.__lock.acquire()
+        try:
+            entry = self.__results.get(key)
+            if entry is None:
+                return None
+
+            expires, rows = entry
+            if expires < time.time():
+                self.__results.pop(key)
+                return None
+            return rows
+        finally:
+            self.__lock.release()
+
+
+    def set(self, key, rows):
+        self.__lock.acquire()
+        try:
+            self.__results.set(key, (time.time() + self.ttl, rows))
+        finally:
+            self.__lock.release()
+
+
+    def clear(self):
+        self.__lock.acquire()
+        try:
+            self.__results.clear()
+        finally:
+            self.__lock.release()
+
+
+
+class CachedCursor(object):
+    """Stands for the driver's cursor, when result is taken from the
+       cache. Returns copies of cached rows, so changes made to the
+       documents don't leak into the cache."""
+
+    def __init__(self, rows):
+        self.__rows = rows
+        self.__position = 0
+
+
+    def __iter__(self):
+        return self
+
+
+    def next(self):
+        if self.__position >= len(self.__rows):
+            raise StopIteration
+        self.__position += 1
+        return copy.deepcopy(self.__rows[self.__position - 1])
+
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            self.__rows = self.__rows[index]
+            return self
+        return copy.deepcopy(self.__rows[index])
+
+
+    def count(self, with_limit_and_skip = False):
+        """Number of cached rows. Skip and limit are already applied
+           to them, so `with_limit_and_skip` is ignored."""
+        return len(self.__rows)
+
+
+    def __cannot_change(self, *args, **kwargs):
+        raise InvalidOperation('cannot set options after executing query')
+    sort = limit = skip = __cannot_change
@@ -0,0 +1,104 @@
+# This code is licensed under the New BSD License
+# 2009, Alexander Artemenko <svetlyak.40wt@gmail.com>
+# For other contacts, visit http://aartemenko.com
+
+"""
+Per-thread state and database bindings.
+
+Document classes could be used from many threads at once, for example
+by WSGI server with a thread pool. The rules are:
+
+  * Document classes, their managers and querysets are shared. Query
+    caches, compiled lookups and lazily created databases are guarded
+    by locks.
+  * Database of the classes without their own one could be bound for
+    the current thread only, instead of the process wide default:
+
+    >>> with mongobongo.using(Database(connection, 'site_%s' % site_id)):
+    ...     article = Article.objects.find_one({'slug': slug})
+
+  * Identity maps, sessions and database bindings are active only in
+    the thread, which entered their `with` block. Async managers run
+    their calls with the database binding of the calling thread.
+  * Lazy dereference and loading of deferred fields are done once per
+    document, when threads access the same document at once: the other
+    threads wait and get the same value.
+  * Cursors and changes of the documents are not synchronized. Iterate
+    a cursor and change a document in one thread at a time, as with
+    the driver's cursors. Instrumentation listeners are process wide,
+    and are called in the thread, which sent the query.
+
+PyMongo's Connection is shared by all threads, the driver gives each
+thread its own socket.
+"""
+
+import threading
+
+
+class _ThreadState(threading.local):
+    """Stacks of the active `with` blocks of the current thread."""
+
+    def __init__(self):
+        self.databases = []
+        self.identity_maps = []
+        self.sessions = []
+
+
+thread_state = _ThreadState()
+
+
+class DatabaseBinding(object):
+    """Binds the database for the current thread, inside `with`."""
+
+    def __init__(self, db):
+        self.db = db
+
+
+    def __enter__(self):
+        thread_state.databases.append(self.db)
+        return self.db
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        thread_state.databases.pop()
+
+
+
+def using(db):
+    """Creates a DatabaseBinding, to be used in the `with` statement."""
+    return DatabaseBinding(db)
+
+
+def current_database():
+    """Returns the database, bound for the current thread, or None."""
+    databases = thread_state.databases
+    if databases:
+        return databases[-1]
+    return None
+
+
+def database_key(db):
+    """Hashable identity of the database: its server and name.
+       PyMongo makes a new Database object for every `connection[name]`,
+       so they are compared by this key instead of `is`."""
+    connection = db.connection()
+    if connection is None:
+        # MemoryDatabase, which has no server
+        return db
+    return (connection.host(), connection.port(), db.name())
+
+
+def with_current_database(func):
+    """Wraps `func`, so it runs with the database binding
+       of the current thread in any other thread."""
+    db = current_database()
+    if db is None:
+        return func
+
+    def call(*args, **kwargs):
+        thread_state.databases.append(db)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            thread_state.databases.pop()
+    return call
@@ -8,20 +8,96 @@ This is a helper to work with MongoDB's documents.
 Author: Alexander Artemenko <svetlyak.40wt@gmail.com>
 """
 
+import functools
+import threading
 import types
+import weakref
+from collections import deque
 from pymongo.dbref import DBRef
-from mongobongo.attributed import AttributedDict
+from pymongo.errors import InvalidOperation
+from pymongo.objectid import ObjectId
+from mongobongo.attributed import _wrap_child
+from mongobongo.fields import Field
+from mongobongo.asynchronous import AsyncCollectionManager
+from mongobongo.instrumentation import listeners, instrumented, \
+                                       QueryEvent, InstrumentedCursor
+from mongobongo.context import current_database, database_key
+from mongobongo.identity import get_identity_map
+from mongobongo.unitofwork import get_session
+from mongobongo import aggregation, pagination, parallel, transfer
+from mongobongo.lazybson import LazyBSON, LazyCursor
+from mongobongo.indexes import Index, ensure_indexes
+from mongobongo.queryset import QuerySet
+from mongobongo.cache import QueryCache, CachedCursor, invalidate_collection, \
+                             DEFAULT_CACHE_SIZE
+
+# Read preferences. Secondary reads go to the `read_database` of the
+# class, when it has one, and are allowed to be served by a slave.
+PRIMARY = 'primary'
+SECONDARY = 'secondary'
 
 _DEFAULT_OPTIONS = dict(
     ordering = None,
+    # field names, lists of (key, direction) pairs or Index objects,
+    # see mongobongo.indexes
+    indexes = (),
+    # query result cache, see mongobongo.cache
+    cache_ttl = None,
+    cache_size = DEFAULT_CACHE_SIZE,
+    # len() of unfiltered cursors uses collection statistics
+    estimated_count = False,
+    # database of the class, instead of the default one,
+    # and database for secondary reads. Both could be
+    # given as functions, which are called on the first use.
+    database = None,
+    read_database = None,
+    read_preference = PRIMARY,
 )
 
+# Top level documents could be kept as LazyBSON, see lazy cursors
+_MAPPING_TYPES = (types.DictType, LazyBSON)
+
+# How many documents are read ahead by CursorProxy, when it has
+# to resolve references for the whole batch, or written at once
+# by CollectionManager.save_many.
+DEFAULT_BATCH_SIZE = 100
+
+
+# Guards functions, given instead of the databases,
+# so they are called once, when threads use them at once.
+_resolve_lock = threading.Lock()
+
+
+def _is_factory(db):
+    """Databases can't be checked with `callable`,
+       because PyMongo's ones define `__call__`."""
+    return isinstance(db, (types.FunctionType, types.MethodType))
+
+
+def _resolve_db(db):
+    """Calls functions, given instead of the database."""
+    if _is_factory(db):
+        return db()
+    return db
+
+
+def _read_options(slave_okay):
+    """Keyword arguments for the driver's `find`. `slave_okay` is
+       passed only for secondary reads, so primary ones keep the
+       setting of the connection."""
+    if slave_okay:
+        return {'slave_okay': True}
+    return {}
+
+
 
 class Options(object):
     """ Document's options.
     """
     def __init__(self, meta):
         self.meta = meta
+        # declared fields, see mongobongo.fields
+        self.fields = {}
         for attr_name, value in _DEFAULT_OPTIONS.iteritems():
             setattr(self, attr_name, value)
 
@@ -37,13 +113,21 @@ class Options(object):
             for attr_name, value in _DEFAULT_OPTIONS.iteritems():
                 setattr(self, attr_name, meta_attrs.pop(attr_name, value))
 
+        self.indexes = [Index.parse(spec) for spec in self.indexes]
+
         del self.meta
 
 
 
 class CollectionManager(object):
     """This class redefines some methods from pymongo.Collection
-       to wrap results with user's class."""
+       to wrap results with user's class.
+
+       Classes without their own database, bound with `bind` or
+       given in `Meta.database`, use the one, bound for the current
+       thread with `mongobongo.using`, or the default one, which is
+       set through the `db` attribute of any manager.
+    """
 
     __db = None
 
@@ -52,64 +136,413 @@ class CollectionManager(object):
         self._cursor_class = cursor_class
         self._document_class = document_class
 
+        meta = document_class._meta
+        self.__own_db = meta.database
+        self.__read_db = meta.read_database
+        # keys of databases, where declared indexes were ensured,
+        # see mongobongo.context.database_key
+        self.__indexed_dbs = set()
+        self.__indexed_lock = threading.Lock()
+        if meta.cache_ttl is not None:
+            self.cache = QueryCache(name, meta.cache_ttl, meta.cache_size)
+        else:
+            self.cache = None
+
     @property
     def _collection(self):
-        return self.__db[self._collection_name]
+        db = self.db
+        collection = db[self._collection_name]
+        indexes = self._document_class._meta.indexes
+        if indexes:
+            key = database_key(db)
+            if key not in self.__indexed_dbs:
+                self.__indexed_lock.acquire()
+                try:
+                    if key not in self.__indexed_dbs:
+                        ensure_indexes(collection, indexes)
+                        self.__indexed_dbs.add(key)
+                finally:
+                    self.__indexed_lock.release()
+        return collection
+
+    def ensure_indexes(self):
+        """Ensures indexes, declared in the Meta. It is done
+           automatically, when the collection is used first time."""
+        ensure_indexes(self._collection, self._document_class._meta.indexes)
 
     @property
     def collection_name(self):
         return self._collection_name
 
-    def _get_db(self): return CollectionManager.__db
+    def _get_db(self):
+        if self.__own_db is None:
+            db = current_database()
+            if db is None:
+                db = CollectionManager.__db
+            return db
+
+        if _is_factory(self.__own_db):
+            _resolve_lock.acquire()
+            try:
+                self.__own_db = _resolve_db(self.__own_db)
+            finally:
+                _resolve_lock.release()
+        return self.__own_db
     def _set_db(self, db): CollectionManager.__db = db
     db = property(_get_db, _set_db)
 
+    def _get_read_db(self):
+        """Database for secondary reads, or None."""
+        if _is_factory(self.__read_db):
+            _resolve_lock.acquire()
+            try:
+                self.__read_db = _resolve_db(self.__read_db)
+            finally:
+                _resolve_lock.release()
+        return self.__read_db
+    read_db = property(_get_read_db)
+
+    def bind(self, db, read_db = None):
+        """Binds the class to its own database, so it doesn't
+           change with the default one. Secondary reads go to
+           `read_db`, if it is given."""
+        self.__own_db = db
+        self.__read_db = read_db
+
+    def _read_target(self, read_preference = None, collection_name = None):
+        """Returns collection to read from and `slave_okay` flag.
+           `collection_name` is read from the databases of the class,
+           instead of its own collection."""
+        if read_preference is None:
+            read_preference = self._document_class._meta.read_preference
+
+        if read_preference == SECONDARY:
+            read_db = self.read_db
+            if read_db is not None:
+                return read_db[collection_name or self._collection_name], True
+            if collection_name is not None:
+                return self.db[collection_name], True
+            return self._collection, True
+        if collection_name is not None:
+            return self.db[collection_name], False
+        return self._collection, False
+
+    def _instrumented(self, operation, query, func, *args, **kwargs):
+        """Calls `func`, notifying instrumentation listeners."""
+        if not listeners:
+            return func(*args, **kwargs)
+
+        event = QueryEvent(operation, self._document_class,
+                           self._collection_name, query)
+        return instrumented(event, func, *args, **kwargs)
+
+    def invalidate(self):
+        """Drops cached query results for the collection. Call it
+           after changes, which were not made through the manager."""
+        invalidate_collection(self._collection_name)
+
     def remove(self, query = {}):
         """Removed objects from collection.
            WARNING, by default, all objects are removed!
         """
-        self._collection.remove(query)
-
-    def all(self):
-        return self._cursor_class(self._collection.find())
-
-    def find(self, query = {}):
-        return self._cursor_class(self._collection.find(query))
-
-    def find_one(self, query = {}):
-        data = list(self.find(query).limit(1))
-
-        if data:
-            return self._document_class(__kwargs = data[0])
+        self._instrumented('remove', query, self._collection.remove, query)
+        self.invalidate()
+
+    def update(self, spec, document, *args, **kwargs):
+        """Updates documents of the collection, like the driver does,
+           and drops cached query results."""
+        result = self._instrumented('update', spec, self._collection.update,
+                                    spec, document, *args, **kwargs)
+        self.invalidate()
+        return result
+
+    def insert(self, doc_or_docs, *args, **kwargs):
+        """Inserts dicts into the collection, like the driver does,
+           and drops cached query results."""
+        result = self._instrumented('insert', None, self._collection.insert,
+                                    doc_or_docs, *args, **kwargs)
+        self.invalidate()
+        return result
+
+    def all(self, read_preference = None):
+        return self.find(read_preference = read_preference)
+
+    def find(self, query = {}, as_dict = False, read_preference = None):
+        cursor = self._cursor_class(self._collection, query)
+        if as_dict:
+            cursor.raw()
+        if read_preference is not None or \
+                self._document_class._meta.read_preference != PRIMARY:
+            cursor.read_preference(read_preference)
+        return cursor
+
+    def filter(self, **lookups):
+        """Returns lazy QuerySet: `filter(author = 'bob', votes__gte = 10)`."""
+        return QuerySet(self).filter(**lookups)
+
+    def exclude(self, **lookups):
+        return QuerySet(self).exclude(**lookups)
+
+    def order_by(self, *names):
+        return QuerySet(self).order_by(*names)
+
+    def exists(self, query = {}):
+        """Checks if any document matches the query."""
+        return self.find(query).exists()
+
+    def estimated_count(self):
+        """Number of documents in the collection, taken from the
+           collection statistics, instead of counting them."""
+        query = {'collstats': self._collection_name}
+        stats = self._instrumented('count', query, self.db.command, query)
+        return int(stats['count'])
+
+    def only(self, *names):
+        """Returns all documents, with only given fields fetched."""
+        return self.all().only(*names)
+
+    def defer(self, *names):
+        """Returns all documents, without given fields fetched."""
+        return self.all().defer(*names)
+
+    def find_one(self, query = {}, only = None, defer = None, as_dict = False,
+                 read_preference = None):
+        session = get_session()
+        if session is not None and _is_id_query(query):
+            found, doc = session.get(self, query['_id'])
+            if found:
+                if doc is not None and as_dict:
+                    return dict(doc._data)
+                return doc
+
+        cursor = self.find(query, as_dict, read_preference)
+        cursor._operation = 'find_one'
+        if only is not None:
+            cursor.only(*only)
+        if defer is not None:
+            cursor.defer(*defer)
+
+        # not list(), because it asks the cursor for its length,
+        # which costs an additional count query
+        for doc in cursor.limit(1):
+            return doc
         return None
 
-    def dereference(self, dbref):
+    def dereference(self, dbref, field = None, read_preference = None):
+        """Fetches the referenced document. `field` is the name
+           of the attribute, when it is dereferenced lazily.
+           Query goes to the database of the referenced class."""
+        identity_map = get_identity_map()
+        if identity_map is not None:
+            doc = identity_map.get(dbref.collection, dbref.id)
+            if doc is not None:
+                return doc
+
         doc_cls = get_doc_class_for_collection(dbref.collection)
-        value = self.__db.dereference(dbref)
-        return doc_cls(__kwargs = value)
+        if doc_cls is None:
+            # no class for the collection, the raw dict
+            # is read from the database of this one
+            collection, slave_okay = self._read_target(read_preference,
+                                                       dbref.collection)
+        else:
+            collection, slave_okay = doc_cls.objects \
+                                            ._read_target(read_preference)
+        query = {'_id': dbref.id}
+        if listeners:
+            event = QueryEvent('dereference', self._document_class,
+                               dbref.collection, query,
+                               lazy = field is not None, field = field)
+            value = instrumented(event, collection.find_one, query,
+                                 **_read_options(slave_okay))
+        else:
+            value = collection.find_one(query, **_read_options(slave_okay))
+        if doc_cls is None:
+            return value
+        doc = doc_cls._from_db(value)
+
+        if identity_map is not None and value is not None:
+            identity_map.add(dbref.collection, doc)
+        return doc
+
+    def dereference_many(self, dbrefs, read_preference = None):
+        """Fetches documents for a list of DBRefs, using one `$in` query
+           per referenced collection.
+           Returns a dict, keyed by (collection, id) pairs.
+        """
+        identity_map = get_identity_map()
+        result = {}
+        ids_by_collection = {}
+
+        for dbref in dbrefs:
+            if identity_map is not None:
+                doc = identity_map.get(dbref.collection, dbref.id)
+                if doc is not None:
+                    result[(dbref.collection, dbref.id)] = doc
+                    continue
+            ids_by_collection.setdefault(dbref.collection, set()).add(dbref.id)
+
+        for collection, ids in ids_by_collection.iteritems():
+            doc_cls = get_doc_class_for_collection(collection)
+            if doc_cls is None:
+                continue
+
+            query = {'_id': {'$in': list(ids)}}
+            target, slave_okay = doc_cls.objects._read_target(read_preference)
+            cursor = target.find(query, **_read_options(slave_okay))
+            if listeners:
+                event = QueryEvent('dereference', self._document_class,
+                                   collection, query)
+                values = instrumented(event, list, cursor)
+            else:
+                values = cursor
+
+            for value in values:
+                doc = doc_cls._from_db(value)
+                result[(collection, value['_id'])] = doc
+                if identity_map is not None:
+                    identity_map.add(collection, doc)
+        return result
 
     def save(self, obj):
-        def transform_docs_to_dbrefs(data):
-            def transform_value(value):
-                if isinstance(value, Document):
-                    if value._id is None:
-                        value.save()
-                    return DBRef(value.objects.collection_name, transform_value(value._id))
-                elif isinstance(value, types.DictType):
-                    return transform_dict(value)
-                elif isinstance(value, types.ListType):
-                    return [transform_value(v) for v in value]
-                return value
-
-            def transform_dict(object):
-                for (key, value) in object.iteritems():
-                    object[key] = transform_value(value)
-                return object
-
-            return transform_dict(data)
-
-        return self._collection.save(transform_docs_to_dbrefs(obj))
-
+        """Saves the dict, with unsaved Documents, which it references,
+           see `transform_docs_to_dbrefs`. Generated `_id` is written
+           into the dict, other values are not changed."""
+        if obj.get('_id') is None:
+            # id goes first, so documents, referencing this one
+            # through a cycle, don't save it again
+            obj['_id'] = ObjectId()
+            method = self._collection.insert
+        else:
+            method = self._collection.save
+
+        result = self._instrumented('save', None, method,
+                                    transform_docs_to_dbrefs(obj))
+        self.invalidate()
+        return result
+
+    def load_deferred(self, docs, name):
+        """Loads field `name` for all documents, which were fetched
+           without it, using one query."""
+        # fields, which were set or deleted after the fetch,
+        # keep their new values
+        docs = dict((doc._data['_id'], doc) for doc in docs
+                    if doc._is_deferred(name) and name not in doc._data)
+        if not docs:
+            return
+
+        query = {'_id': {'$in': docs.keys()}}
+        values = self._instrumented('find', query, list,
+                                    self._collection.find(query, fields = [name]))
+        for value in values:
+            if name in value:
+                docs[value['_id']]._data[name] = value[name]
+
+        for doc in docs.itervalues():
+            doc._mark_loaded(name)
+
+    def save_changes(self, obj, paths):
+        """Sends only changed `paths` of the already saved object,
+           using `$set` and `$unset` modifiers."""
+        modifier = {}
+        for path in _collapse_paths(paths):
+            if path == '_id':
+                continue
+
+            found, value = _get_path(obj, path)
+            if found:
+                modifier.setdefault('$set', {})[path] = value
+            else:
+                modifier.setdefault('$unset', {})[path] = 1
+
+        if '$set' in modifier:
+            modifier['$set'] = transform_docs_to_dbrefs(modifier['$set'])
+        if modifier:
+            query = {'_id': obj['_id']}
+            self._instrumented('update', query, self._collection.update,
+                               query, modifier)
+            self.invalidate()
+
+    def save_many(self, docs, batch_size = DEFAULT_BATCH_SIZE):
+        """Saves many Documents or dicts, with one network round trip
+           per `batch_size` new documents. Documents which already have
+           an `_id` are upserted one by one. Inside the session they
+           are queued instead, and dicts are queued as documents
+           of the class.
+           Generated ids are written back into the documents.
+           Returns the list of ids, in the same order as `docs`.
+        """
+        session = get_session()
+        ids = []
+        batch = []
+        # Documents of the batch, marked as saved after the insert
+        inserted = []
+
+        def flush():
+            self._instrumented('insert', None, self._collection.insert, batch)
+            del batch[:]
+            for doc in inserted:
+                doc._mark_saved()
+            del inserted[:]
+
+        for doc in docs:
+            if isinstance(doc, Document):
+                if doc._partial:
+                    # documents are written as a whole
+                    doc._check_partial(doc._data)
+                data = doc._data
+            else:
+                data, doc = doc, None
+
+            if session is not None:
+                if doc is None:
+                    doc = self._document_class(__kwargs = data)
+                session.save(doc)
+                doc._mark_saved()
+            elif data.get('_id') is None:
+                data['_id'] = ObjectId()
+                batch.append(transform_docs_to_dbrefs(data))
+                if doc is not None:
+                    inserted.append(doc)
+                if len(batch) >= batch_size:
+                    flush()
+            else:
+                query = {'_id': data['_id']}
+                self._instrumented('update', query, self._collection.update,
+                                   query, transform_docs_to_dbrefs(data),
+                                   upsert = True)
+                if doc is not None:
+                    doc._mark_saved()
+            ids.append(data['_id'])
+
+        if batch:
+            flush()
+        self.invalidate()
+        return ids
+
+
+    def aggregate(self, pipeline, output_class = None):
+        """Runs aggregation pipeline, a list of stages or a Pipeline,
+           on the server. Yields dicts or `output_class` instances.
+           See mongobongo.aggregation for details."""
+        return aggregation.aggregate(self, pipeline, output_class)
+
+    def pipeline(self, output_class = None):
+        """Returns Pipeline builder, which runs on iteration."""
+        return aggregation.Pipeline(self, output_class)
+
+    def export(self, path, query = {}, format = None, compress = None,
+               progress = None, batch_size = DEFAULT_BATCH_SIZE):
+        """Writes documents, matching the `query`, into the file,
+           in 'jsonl' or 'bson' format, optionally gzipped.
+           See mongobongo.transfer for details."""
+        return transfer.export(self, path, query, format, compress,
+                               progress, batch_size)
+
+    def import_(self, path, format = None, compress = None,
+                progress = None, batch_size = DEFAULT_BATCH_SIZE):
+        """Inserts documents from the file, written by `export`."""
+        return transfer.import_(self, path, format, compress,
+                                progress, batch_size)
 
     def __getattr__(self, name):
         return getattr(self._collection, name)
@@ -139,21 +572,305 @@ class DocumentBase(type):
 
         collection = attrs.pop('collection')
 
+        for field in attrs.pop('fields', ()):
+            if isinstance(field, basestring):
+                field = Field(field)
+            new_class.add_to_class(field.name, field)
+
         class CursorProxy(object):
             _doctype = new_class
-
-            def __init__(self, real_cursor):
-                self.__cursor = real_cursor
+            _operation = 'find'
+
+            def __init__(self, collection, spec = None):
+                self.__collection = collection
+                self.__spec = spec or {}
+                self.__only = None
+                self.__defer = ()
+                self.__sort = None
+                self.__skip = 0
+                self.__limit = 0
+                self.__batch_size = 0
+                self.__raw = False
+                self.__prefetch = ()
+                self.__buffer = deque()
+                self.__real_cursor = None
+                self.__count = None
+                self.__slave_okay = False
+                self.__lazy = False
 
                 if self._doctype._meta.ordering:
                     self.sort(self._doctype._meta.ordering)
 
+            @property
+            def __cursor(self):
+                """Driver's cursor, created on the first use."""
+                if self.__real_cursor is None:
+                    if self.__lazy:
+                        find = functools.partial(LazyCursor, self.__collection)
+                    else:
+                        find = self.__collection.find
+                    cursor = find(self.__spec,
+                                  fields = self.__fields(),
+                                  skip = self.__skip,
+                                  limit = self.__limit,
+                                  **_read_options(self.__slave_okay))
+                    if self.__sort is not None:
+                        cursor.sort(*self.__sort[0], **self.__sort[1])
+                    if self.__batch_size and hasattr(cursor, 'batch_size'):
+                        cursor.batch_size(self.__batch_size)
+                    if listeners:
+                        cursor = InstrumentedCursor(
+                            cursor, self._operation, self._doctype,
+                            self._doctype.objects.collection_name, self.__spec,
+                            self.__sort)
+                    cache = self._doctype.objects.cache
+                    if cache is not None:
+                        cursor = self.__cached(cache, cursor)
+                    self.__real_cursor = cursor
+                return self.__real_cursor
+
+            def __cached(self, cache, cursor):
+                """Returns cursor over cached result of the query,
+                   fetching it with the driver's `cursor` if needed."""
+                key = cache.make_key(self.__collection.database(),
+                                     self.__spec, self.__fields(),
+                                     self.__sort, self.__skip, self.__limit,
+                                     self.__lazy)
+                rows = cache.get(key)
+                if rows is None:
+                    rows = list(cursor)
+                    cache.set(key, rows)
+                return CachedCursor(rows)
+
+            def __fetched(self):
+                """Fields to fetch, or None for all of them. The driver
+                   takes only the list of fields to fetch, so `defer`
+                   without `only` fetches declared fields of the class,
+                   and other ones are loaded on access."""
+                if self.__only is None and self.__defer:
+                    declared = self._doctype._meta.fields
+                    if not declared:
+                        raise InvalidOperation(
+                            'defer requires declared fields of %s, '
+                            'use only instead' % self._doctype.__name__)
+                    return set(declared)
+                return self.__only
+
+            def __fields(self):
+                """Projection, to pass to the driver."""
+                only = self.__fetched()
+                if only is not None:
+                    return [name for name in only
+                            if name not in self.__defer]
+                return None
+
+            def __make_doc(self, data):
+                if self.__raw:
+                    return data
+                return self._doctype._from_db(data, self.__fetched(),
+                                              self.__defer)
+
             def next(self):
                 """Wraps result into the custom class"""
-                return self._doctype(__kwargs = self.__cursor.next())
+                if not self.__prefetch:
+                    if self.__raw:
+                        return self.__cursor.next()
+                    if self.__fields() is None:
+                        return self._doctype._from_db(self.__cursor.next())
+
+                if not self.__buffer:
+                    self.__fill_buffer()
+                return self.__buffer.popleft()
+
+            def __fill_buffer(self):
+                docs = self.__read_batch(self.__batch_size or DEFAULT_BATCH_SIZE)
+                if not docs:
+                    raise StopIteration
+                self.__buffer.extend(docs)
+
+            def __read_batch(self, size):
+                """Reads next batch from the cursor, resolves references
+                   for all documents in it at once and links documents
+                   of the batch together, to load deferred fields for
+                   all of them at once."""
+                batch = []
+                for value in self.__cursor:
+                    batch.append(value)
+                    if len(batch) >= size:
+                        break
+
+                if not batch:
+                    return batch
+
+                if self.__prefetch:
+                    prefetch_references(self._doctype.objects,
+                                        batch,
+                                        self.__prefetch)
+
+                docs = [self.__make_doc(value) for value in batch]
+                if self.__fields() is not None and not self.__raw:
+                    refs = [weakref.ref(doc) for doc in docs]
+                    lock = threading.RLock()
+                    for doc in docs:
+                        doc.__dict__['_batch'] = refs
+                        doc.__dict__['_loading_lock'] = lock
+                return docs
+
+            def batch_size(self, batch_size):
+                """Sets how many documents are fetched at once. It is
+                   passed to the driver, when it supports batch size,
+                   and is used as default size of `iter_batches`."""
+                self.__batch_size = batch_size
+                cursor = self.__real_cursor
+                if cursor is not None and hasattr(cursor, 'batch_size'):
+                    cursor.batch_size(batch_size)
+                return self
+
+            def iter_batches(self, size = None):
+                """Yields lists of at most `size` documents. References,
+                   given to `prefetch`, are resolved once per batch."""
+                size = size or self.__batch_size or DEFAULT_BATCH_SIZE
+
+                if self.__buffer:
+                    docs = list(self.__buffer)
+                    self.__buffer.clear()
+                    yield docs
+
+                while True:
+                    docs = self.__read_batch(size)
+                    if not docs:
+                        break
+                    yield docs
+
+            def parallel_map(self, func, workers = parallel.DEFAULT_WORKERS,
+                             ordered = True, connect = None, auth = None):
+                """Yields `func(doc)` for every document, splitting the
+                   query by `_id` between `workers` processes.
+                   See mongobongo.parallel for details."""
+                if self.__skip or self.__limit:
+                    raise InvalidOperation('parallel_map cannot be used '
+                                           'with skip or limit')
+                # default ordering is replaced by the order of `_id`
+                ordering = self._doctype._meta.ordering
+                if self.__sort not in (None, ((ordering,), {})) \
+                   or self.__only is not None or self.__defer \
+                   or self.__raw or self.__lazy or self.__prefetch:
+                    raise InvalidOperation('parallel_map cannot be used '
+                                           'with sort, only, defer, raw, '
+                                           'lazy or prefetch')
+                return parallel.parallel_map(self._doctype, self.__spec, func,
+                                             workers, ordered, connect, auth)
+
+            def paginate(self, after = None, per_page = 20):
+                """Returns the Page of `per_page` documents, which follow
+                   the `after` token in the sort order, or the first page.
+                   See mongobongo.pagination for details."""
+                self.__check_not_executed()
+                if self.__skip or self.__limit:
+                    raise InvalidOperation('paginate cannot be used '
+                                           'with skip or limit')
+
+                keys = pagination.ordering(self.__sort)
+                if after is not None:
+                    values = pagination.decode_token(after, keys)
+                    self.__spec = pagination.seek(self.__spec, keys, values)
+
+                # sort keys are needed for the token
+                names = [key.split('.')[0] for key, direction in keys]
+                self.__defer = tuple(name for name in self.__defer
+                                     if name not in names)
+                only = self.__fetched()
+                if only is not None:
+                    self.__only = only.union(names)
+
+                self.sort(keys)
+                self.limit(per_page + 1)
+                docs = [doc for doc in self]
+                if len(docs) <= per_page:
+                    return pagination.Page(docs, None)
+
+                docs = docs[:per_page]
+                last = docs[-1]
+                if not self.__raw:
+                    last = last._data
+                values = [_get_path(last, key)[1] for key, direction in keys]
+                return pagination.Page(docs, pagination.encode_token(keys, values))
+
+            def lazy(self):
+                """Keeps documents as BSON and decodes fields on the
+                   first access. See mongobongo.lazybson."""
+                self.__check_not_executed()
+                self.__lazy = True
+                return self
+
+            def raw(self):
+                """Returns plain dicts from the driver, instead of
+                   documents. Ordering and other options still apply."""
+                self.__raw = True
+                return self
+
+            def prefetch(self, *paths):
+                """Resolves DBRefs at given dotted paths, like 'author'
+                   or 'comments.user', for a batch of documents at once,
+                   instead of one query per document on attribute access."""
+                self.__prefetch += paths
+                return self
+
+            def read_preference(self, read_preference):
+                """Sends the query to the primary, or to the secondary,
+                   see PRIMARY and SECONDARY. When it is None,
+                   `Meta.read_preference` of the class is used."""
+                self.__check_not_executed()
+                self.__collection, self.__slave_okay = \
+                    self._doctype.objects._read_target(read_preference)
+                return self
+
+            def only(self, *names):
+                """Fetches only given fields. Other fields are loaded
+                   on the first access, for the whole batch at once.
+                   Fields, given by dotted paths, are fetched partially,
+                   so they are not loaded, and saving them as a whole
+                   raises InvalidOperation."""
+                self.__check_not_executed()
+                self.__only = set(self.__only or ()).union(names)
+                return self
+
+            def defer(self, *names):
+                """Doesn't fetch given top level fields, until they are
+                   accessed. Without `only`, declared fields of the class
+                   are fetched, and the undeclared ones are loaded on
+                   access too, because the driver can't exclude fields."""
+                self.__check_not_executed()
+                for name in names:
+                    if '.' in name:
+                        raise InvalidOperation('defer takes top level '
+                                               'fields, not %r' % name)
+                self.__defer += names
+                return self
+
+            def __check_not_executed(self):
+                if self.__real_cursor is not None:
+                    raise InvalidOperation('cannot set options '
+                                           'after executing query')
 
             def sort(self, *args, **kwargs):
-                self.__cursor.sort(*args, **kwargs)
+                self.__sort = (args, kwargs)
+                if self.__real_cursor is not None:
+                    self.__real_cursor.sort(*args, **kwargs)
+                return self
+
+            def limit(self, limit):
+                self.__limit = limit
+                self.__count = None
+                if self.__real_cursor is not None:
+                    self.__real_cursor.limit(limit)
+                return self
+
+            def skip(self, skip):
+                self.__skip = skip
+                self.__count = None
+                if self.__real_cursor is not None:
+                    self.__real_cursor.skip(skip)
                 return self
 
             def __getattr__(self, name):
@@ -161,16 +878,57 @@ class DocumentBase(type):
 
             def __getitem__(self, index):
                 """Wraps result into the custom class
-                   if it is one item"""
-                result = self.__cursor.__getitem__(index)
-
+                   if it is one item. Slice overrides skip and limit
+                   of the cursor, like the driver does."""
                 if isinstance(index, slice):
+                    skip, limit = _slice_bounds(index)
+                    if self.__real_cursor is None:
+                        self.skip(skip)
+                        self.limit(limit)
+                    else:
+                        # the driver's cursor overrides its skip and
+                        # limit, and the cached one slices its rows
+                        self.__real_cursor.__getitem__(index)
+                        self.__skip, self.__limit = skip, limit
+                        self.__count = None
                     return self
                 else:
-                    return self._doctype(__kwargs = result)
+                    result = self.__cursor.__getitem__(index)
+                    if self.__prefetch:
+                        prefetch_references(self._doctype.objects,
+                                            [result],
+                                            self.__prefetch)
+                    return self.__make_doc(result)
 
             def __len__(self):
-                return self.__cursor.count(with_limit_and_skip=True)
+                """Number of documents, which the cursor returns. It is
+                   counted once. With Meta.estimated_count, unfiltered
+                   cursors take it from the collection statistics."""
+                if self.__count is None:
+                    if self._doctype._meta.estimated_count and \
+                            not (self.__spec or self.__skip or self.__limit):
+                        self.__count = self._doctype.objects.estimated_count()
+                    else:
+                        self.__count = self.__cursor.count(with_limit_and_skip = True)
+                return self.__count
+
+            def exists(self):
+                """Checks if the cursor returns any document, fetching
+                   only one `_id`, instead of counting all of them."""
+                if self.__count is not None:
+                    return self.__count > 0
+                if self.__buffer:
+                    return True
+
+                options = _read_options(self.__slave_okay)
+                cursor = self.__collection.find(self.__spec,
+                                                fields = ['_id'],
+                                                skip = self.__skip,
+                                                limit = -1,
+                                                **options)
+                first = self._doctype.objects._instrumented(
+                    'find_one', self.__spec, list, cursor)
+                return len(first) > 0
 
             def __iter__(self):
                 return self
@@ -184,6 +942,9 @@ class DocumentBase(type):
             CursorProxy,
             new_class,
         ))
+        setattr(new_class, 'async_objects', AsyncCollectionManager(
+            new_class.objects,
+        ))
 
         register_doc_class(new_class)
         return new_class
@@ -238,38 +999,430 @@ class Document(object):
         except KeyError:
             self.__dict__['_data'] = kwargs
 
+        # Dotted paths, changed since the document was loaded or saved.
+        # Documents, which were never saved, are written as a whole.
+        self.__dict__['_changed'] = set()
+        self.__dict__['_persisted'] = False
+
+        # AttributedDict wrappers for the top level dicts,
+        # see `mongobongo.attributed._wrap_child`.
+        self.__dict__['_children'] = {}
+        self.__dict__['_on_change'] = self._changed.add
+        self.__dict__['_path'] = ''
+
+        # Top level fields, which were fetched, when the document was
+        # loaded with `only`, and fields which were not fetched because
+        # of `defer`. Documents from the same cursor batch are linked
+        # through `_batch`, to load their deferred fields at once.
+        self.__dict__['_only'] = None
+        self.__dict__['_deferred'] = set()
+        self.__dict__['_batch'] = None
+        # dotted paths, given to `only`, which fields were fetched
+        # partially and could not be saved as a whole
+        self.__dict__['_partial'] = ()
+
+
+    @classmethod
+    def _from_db(cls, data, only = None, defer = ()):
+        """Creates a document from the data, fetched from the database."""
+        doc = cls(__kwargs = data)
+        doc.__dict__['_persisted'] = True
+
+        if only is not None:
+            top = set(name.split('.')[0] for name in only)
+            top.add('_id')
+            doc.__dict__['_only'] = top.difference(defer)
+            partial = set(name for name in only
+                          if '.' in name and name.split('.')[0] not in only)
+            if partial:
+                doc.__dict__['_partial'] = partial
+        if defer:
+            doc.__dict__['_deferred'] = set(defer)
+        return doc
+
+
+    def _is_deferred(self, name):
+        if name in self._deferred:
+            return True
+        return self._only is not None and name not in self._only \
+               and not name.startswith('__')
+
+
+    def _mark_loaded(self, name):
+        self._deferred.discard(name)
+        if self._only is not None:
+            self._only.add(name)
+        if self._partial:
+            prefix = name + '.'
+            self.__dict__['_partial'] = set(path for path in self._partial
+                                            if not path.startswith(prefix))
+
+
+    def _check_partial(self, paths):
+        """Raises InvalidOperation, when saving of `paths` would
+           overwrite partially fetched fields."""
+        for path in paths:
+            prefix = path + '.'
+            for partial in self._partial:
+                if partial.startswith(prefix):
+                    raise InvalidOperation('%s was fetched partially with '
+                                           '%r and cannot be saved'
+                                           % (path, partial))
+
+
+    def _get_loading_lock(self):
+        """Lock, which makes threads load references and deferred
+           fields once. Documents of one batch share it."""
+        lock = self.__dict__.get('_loading_lock')
+        if lock is None:
+            # setdefault is atomic, so only one lock is kept
+            lock = self.__dict__.setdefault('_loading_lock', threading.RLock())
+        return lock
+    _loading_lock = property(_get_loading_lock)
+
+
+    def _load_deferred(self, name):
+        lock = self._loading_lock
+        lock.acquire()
+        try:
+            if not self._is_deferred(name):
+                # loaded by another thread
+                return
+
+            docs = [self]
+            if self._batch is not None:
+                docs.extend(doc for doc in (ref() for ref in self._batch)
+                            if doc is not None and doc is not self)
+            self.objects.load_deferred(docs, name)
+        finally:
+            lock.release()
+
+
+    def _dereference(self, name):
+        """Replaces the DBRef in the field with the referenced
+           document, and returns the field's value."""
+        lock = self._loading_lock
+        lock.acquire()
+        try:
+            value = self._data.get(name)
+            if isinstance(value, DBRef):
+                value = self._data[name] = self.objects.dereference(value, name)
+            return value
+        finally:
+            lock.release()
+
+
+    def _mark_saved(self):
+        self.__dict__['_persisted'] = True
+        self._changed.clear()
+
 
     def __getattr__(self, name):
-        value = self._data.get(name, None)
+        try:
+            value = self._data[name]
+        except KeyError:
+            if not self._is_deferred(name):
+                return None
+            self._load_deferred(name)
+            value = self._data.get(name, None)
 
         if isinstance(value, dict):
-            return AttributedDict(value)
+            return _wrap_child(self, name, value)
+
+        if isinstance(value, list):
+            # raw list could be changed in place
+            self._changed.add(name)
 
-        if isinstance(value, DBRef):
-            value = self.objects.dereference(value)
-            self._data[name] = value
+        elif isinstance(value, DBRef):
+            value = self._dereference(name)
 
         return value
 
 
     def __setattr__(self, name, value):
         self._data[name] = value
+        self._children.pop(name, None)
+        self._changed.add(name)
+        # new value should not be replaced by the deferred one
+        self._mark_loaded(name)
+
+
+    def __delattr__(self, name):
+        if name in self._data:
+            del self._data[name]
+        elif not self._is_deferred(name):
+            raise AttributeError(name)
+        self._children.pop(name, None)
+        self._changed.add(name)
+        self._mark_loaded(name)
 
 
     def __getitem__(self, name):
-        return self._data[name]
+        if name not in self._data and self._is_deferred(name):
+            self._load_deferred(name)
+
+        value = self._data[name]
+        if isinstance(value, (dict, list)):
+            # raw value could be changed in place
+            self._changed.add(name)
+        return value
 
 
     def save(self):
-        self.objects.save(self._data)
+        """Saves the document. For the document, which was already
+           saved or loaded from the database, only changed fields
+           are sent, and nothing is sent when there are no changes.
+
+           Changes are tracked through attribute assignment and
+           deletion, `update` and nested AttributedDict/AttributedList
+           assignment. Lists and dicts, which were taken as raw
+           values, are considered as changed.
+        """
+        if self._partial:
+            if self._persisted:
+                self._check_partial(self._changed)
+            else:
+                self._check_partial(self._data)
+
+        session = get_session()
+        if session is not None:
+            session.save(self)
+        elif self._persisted and '_id' in self._data:
+            if self._changed:
+                self.objects.save_changes(self._data, self._changed)
+        else:
+            self.objects.save(self._data)
+
+        self._mark_saved()
         return self
 
     def remove(self):
-        self.objects.remove(self._data)
+        session = get_session()
+        if session is not None and '_id' in self._data:
+            session.remove(self)
+        elif '_id' in self._data:
+            self.objects.remove({'_id': self._data['_id']})
+        else:
+            self.objects.remove(self._data)
+
+        identity_map = get_identity_map()
+        if identity_map is not None and self._id is not None:
+            identity_map.remove(self.objects.collection_name, self._id)
         return self
 
     def update(self, data):
         self._data.update(data)
+        self._changed.update(data)
+        for name in data:
+            self._mark_loaded(name)
+
+
+
+def transform_docs_to_dbrefs(data):
+    """Saves Documents, which have no `_id`, reachable from `data`,
+       and returns a copy of it, where Documents are replaced with
+       DBRefs. `data` itself is not changed.
+
+       Documents are found through the whole graph once, even when
+       they are shared or reference each other. Ids are generated
+       before the inserts, which are made in the order of
+       dependencies: referenced documents go before the ones, which
+       reference them. Documents, which don't depend on each other,
+       are inserted with one batched insert per collection.
+    """
+    unsaved = _find_unsaved(data)
+    if unsaved:
+        _insert_documents(unsaved)
+    return _replace_documents(data)
+
+
+def _find_unsaved(data):
+    """Returns Documents without `_id`, reachable from `data`,
+       the referenced ones before those, which reference them.
+       Cycles are cut at the document, which was visited first."""
+    found = []
+    visited = set()
+
+    def visit(value):
+        if isinstance(value, Document):
+            if id(value) in visited or value._data.get('_id') is not None:
+                return
+            visited.add(id(value))
+            visit(value._data)
+            found.append(value)
+        elif isinstance(value, _MAPPING_TYPES):
+            for item in value.itervalues():
+                visit(item)
+        elif isinstance(value, types.ListType):
+            for item in value:
+                visit(item)
+
+    visit(data)
+    return found
+
+
+def _insert_documents(docs):
+    """Inserts new Documents, given in the order of dependencies,
+       with one batched insert per collection for each round of
+       independent documents. Inside the session they are queued
+       instead."""
+    session = get_session()
+    if session is not None:
+        for doc in docs:
+            session.save(doc)
+            doc._mark_saved()
+        return
+
+    for doc in docs:
+        doc._data['_id'] = ObjectId()
+
+    # every document goes in the round after the documents of other
+    # collections, which it references, and in the same round with
+    # the referenced documents of its collection, because batched
+    # insert keeps the order; back references of cycles are skipped
+    rounds = []
+    levels = {}
+    for doc in docs:
+        level = 0
+        for referenced in _referenced_documents(doc._data):
+            if id(referenced) in levels:
+                referenced_level = levels[id(referenced)]
+                if referenced.objects is not doc.objects:
+                    referenced_level += 1
+                level = max(level, referenced_level)
+        levels[id(doc)] = level
+        if level == len(rounds):
+            rounds.append(([], {}))
+
+        collections, batches = rounds[level]
+        manager = doc.objects
+        if manager not in batches:
+            collections.append(manager)
+            batches[manager] = []
+        batches[manager].append(_replace_documents(doc._data))
+
+    for collections, batches in rounds:
+        for manager in collections:
+            manager._instrumented('insert', None,
+                                  manager._collection.insert, batches[manager])
+            manager.invalidate()
+
+    for doc in docs:
+        doc._mark_saved()
+
+
+def _referenced_documents(value):
+    """Yields Documents, referenced by the value, without
+       going into them."""
+    if isinstance(value, Document):
+        yield value
+    elif isinstance(value, _MAPPING_TYPES):
+        for item in value.itervalues():
+            for doc in _referenced_documents(item):
+                yield doc
+    elif isinstance(value, types.ListType):
+        for item in value:
+            for doc in _referenced_documents(item):
+                yield doc
+
+
+def _replace_documents(value):
+    """Copies the value, replacing Documents with DBRefs."""
+    if isinstance(value, Document):
+        return DBRef(value.objects.collection_name, value._data['_id'])
+    elif isinstance(value, _MAPPING_TYPES):
+        if isinstance(value, types.DictType):
+            # keeps SON and other ordered dicts
+            result = value.__class__()
+        else:
+            result = {}
+        for key, item in value.iteritems():
+            result[key] = _replace_documents(item)
+        return result
+    elif isinstance(value, types.ListType):
+        return [_replace_documents(item) for item in value]
+    return value
+
+
+def _slice_bounds(index):
+    """Returns (skip, limit) for the slice of a cursor."""
+    if index.step is not None:
+        raise IndexError('cursors do not support slice steps')
+    skip = index.start or 0
+    if skip < 0:
+        raise IndexError('cursors do not support negative indices')
+    if index.stop is None:
+        return skip, 0
+    if index.stop <= skip:
+        raise IndexError('stop index must be greater than start index '
+                         'for slice %r' % index)
+    return skip, index.stop - skip
+
+
+def _is_id_query(query):
+    """Checks if the query matches one document by its `_id`."""
+    return isinstance(query, types.DictType) and query.keys() == ['_id'] \
+           and not isinstance(query['_id'], types.DictType)
+
+
+def _collapse_paths(paths):
+    """Drops paths, which are inside other changed paths."""
+    paths = set(paths)
+    result = []
+    for path in sorted(paths):
+        parts = path.split('.')
+        for i in xrange(1, len(parts)):
+            if '.'.join(parts[:i]) in paths:
+                break
+        else:
+            result.append(path)
+    return result
+
+
+def _get_path(data, path):
+    """Returns (found, value) for the dotted path inside the data."""
+    for part in path.split('.'):
+        if isinstance(data, _MAPPING_TYPES) and part in data:
+            data = data[part]
+        elif isinstance(data, types.ListType) and part.isdigit() \
+                and int(part) < len(data):
+            data = data[int(part)]
+        else:
+            return False, None
+    return True, data
+
+
+def prefetch_references(manager, records, paths):
+    """Replaces DBRefs, found at dotted `paths` inside the raw `records`,
+       with Document instances. Each level of each path is resolved
+       with one query per referenced collection.
+    """
+    for path in paths:
+        containers = list(records)
+
+        for part in path.split('.'):
+            slots = []
+            for container in containers:
+                if isinstance(container, Document):
+                    container = container._data
+
+                if isinstance(container, _MAPPING_TYPES) and part in container:
+                    value = container[part]
+                    if isinstance(value, types.ListType):
+                        slots.extend((value, i) for i in xrange(len(value)))
+                    else:
+                        slots.append((container, part))
+
+            dbrefs = [c[key] for c, key in slots if isinstance(c[key], DBRef)]
+            resolved = dbrefs and manager.dereference_many(dbrefs) or {}
+
+            containers = []
+            for container, key in slots:
+                value = container[key]
+                if isinstance(value, DBRef):
+                    value = resolved.get((value.collection, value.id), value)
+                    container[key] = value
+                containers.append(value)
 
 
 
@@ -0,0 +1,97 @@
+# This code is licensed under the New BSD License
+# 2009, Alexander Artemenko <svetlyak.40wt@gmail.com>
+# For other contacts, visit http://aartemenko.com
+
+"""
+Declared document fields.
+
+Fields, listed in the `fields` attribute of the Document class, are
+compiled into properties, which read values right from the document's
+data, instead of going through `Document.__getattr__`:
+
+>>> class Article(Document):
+...     collection = 'articles'
+...     fields = ('title', 'slug', Reference('author'), Embedded('meta'))
+
+Plain fields are returned as is. Only `Reference` fields are
+dereferenced and only `Embedded` fields are wrapped into
+AttributedDict. Lists and dicts, taken from plain fields, could be
+changed in place, so the field is considered changed and `save`
+writes it as a whole.
+Fields, which are not declared, still work through `__getattr__`.
+"""
+
+from pymongo.dbref import DBRef
+from mongobongo.attributed import _wrap_child
+
+
+class Field(object):
+    """Plain field, which value is returned as is. Lists and dicts
+       are considered changed, because they could be changed in place."""
+
+    def __init__(self, name):
+        self.name = name
+
+
+    def contribute_to_class(self, cls, name):
+        cls._meta.fields[self.name] = self
+        setattr(cls, self.name, property(self.make_getter()))
+
+
+    def make_getter(self):
+        name = self.name
+
+        def get(doc):
+            try:
+                value = doc._data[name]
+            except KeyError:
+                # missing or deferred field
+                return doc.__getattr__(name)
+
+            if isinstance(value, (list, dict)):
+                doc._changed.add(name)
+            return value
+        return get
+
+
+
+class Reference(Field):
+    """Field, which holds a DBRef. Referenced document is fetched
+       on the first access."""
+
+    def make_getter(self):
+        name = self.name
+
+        def get(doc):
+            try:
+                value = doc._data[name]
+            except KeyError:
+                return doc.__getattr__(name)
+
+            if isinstance(value, DBRef):
+                value = doc._dereference(name)
+            return value
+        return get
+
+
+
+class Embedded(Field):
+    """Field, which holds a dict or a list. Dicts are wrapped into
+       AttributedDict, and lists are considered changed, because
+       they could be changed in place."""
+
+    def make_getter(self):
+        name = self.name
+
+        def get(doc):
+            try:
+                value = doc._data[name]
+            except KeyError:
+                return doc.__getattr__(name)
+
+            if isinstance(value, dict):
+                return _wrap_child(doc, name, value)
+            if isinstance(value, list):
+                doc._changed.add(name)
+            return value
+        return get
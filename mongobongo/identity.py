@@ -0,0 +1,82 @@
+# This code is licensed under the New BSD License
+# 2009, Alexander Artemenko <svetlyak.40wt@gmail.com>
+# For other contacts, visit http://aartemenko.com
+
+"""
+Identity map for dereferenced documents.
+
+Inside the `identity_map` block, every DBRef is fetched from the
+database only once, and all references to the same document
+return the same Document instance:
+
+>>> from mongobongo import identity_map
+>>> with identity_map(size = 1000) as imap:
+...     authors = [a.author for a in Article.objects.all()]
+>>> imap.hits, imap.misses
+(4990, 10)
+"""
+
+from mongobongo.context import thread_state
+from mongobongo.lru import LRUCache
+
+DEFAULT_SIZE = 1000
+
+
+class IdentityMap(object):
+    """Keeps documents keyed by (collection, _id). Only the `size`
+       recently used documents are kept.
+    """
+
+    def __init__(self, size = DEFAULT_SIZE):
+        self._documents = LRUCache(size)
+
+
+    def _get_hits(self): return self._documents.hits
+    hits = property(_get_hits)
+
+    def _get_misses(self): return self._documents.misses
+    misses = property(_get_misses)
+
+
+    def __len__(self):
+        return len(self._documents)
+
+
+    def get(self, collection, id):
+        return self._documents.get((collection, id))
+
+
+    def add(self, collection, doc):
+        self._documents.set((collection, doc._id), doc)
+
+
+    def remove(self, collection, id):
+        self._documents.pop((collection, id))
+
+
+    def clear(self):
+        self._documents.clear()
+
+
+    def __enter__(self):
+        thread_state.identity_maps.append(self)
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        thread_state.identity_maps.remove(self)
+
+
+
+def identity_map(size = DEFAULT_SIZE):
+    """Creates a new IdentityMap, to be used in the `with` statement."""
+    return IdentityMap(size)
+
+
+def get_identity_map():
+    """Returns the innermost IdentityMap, active in the current
+       thread, or None."""
+    maps = thread_state.identity_maps
+    if maps:
+        return maps[-1]
+    return None
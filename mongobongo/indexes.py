@@ -0,0 +1,201 @@
+# This code is licensed under the New BSD License
+# 2009, Alexander Artemenko <svetlyak.40wt@gmail.com>
+# For other contacts, visit http://aartemenko.com
+
+"""
+Declared indexes and the index advisor.
+
+Indexes are listed in the Meta of the Document class, as field names,
+lists of (key, direction) pairs or Index objects:
+
+>>> class Article(Document):
+...     collection = 'articles'
+...     class Meta:
+...         ordering = [('created', DESCENDING)]
+...         indexes = ('slug',
+...                    [('author', ASCENDING), ('created', DESCENDING)],
+...                    Index('slug', unique = True),
+...                    Index('expires', ttl = 3600))
+
+They are ensured the first time the class uses its collection
+in the database, or explicitly with `Article.objects.ensure_indexes()`.
+Sparse and TTL indexes need a driver, which passes other options of
+`ensure_index` to the server, and a server, which supports them.
+With older drivers, Index raises ConfigurationError for them, when
+the class is defined.
+
+The advisor watches queries, which go through the collection managers,
+and reports the ones which no index supports:
+
+>>> with advise_indexes() as advisor:
+...     run_test_suite()
+>>> print advisor.report()
+"""
+
+import inspect
+import types
+
+from pymongo import ASCENDING
+from pymongo.collection import Collection
+from pymongo.errors import ConfigurationError
+from mongobongo.instrumentation import add_listener, remove_listener
+
+# older drivers' ensure_index takes only `unique` and `ttl`
+_INDEX_OPTIONS_SUPPORTED = \
+    inspect.getargspec(Collection.ensure_index)[2] is not None
+
+
+class Index(object):
+    """Index on one or several keys. `ttl` is the number of seconds,
+       after which documents are removed by the server."""
+
+    def __init__(self, keys, unique = False, sparse = False, ttl = None):
+        if (sparse or ttl is not None) and not _INDEX_OPTIONS_SUPPORTED:
+            raise ConfigurationError('sparse and ttl indexes are not '
+                                     'supported by the driver')
+        if isinstance(keys, types.StringTypes):
+            keys = [(keys, ASCENDING)]
+        self.keys = list(keys)
+        self.unique = unique
+        self.sparse = sparse
+        self.ttl = ttl
+
+
+    def parse(cls, spec):
+        """Makes Index from the field name, list of (key, direction)
+           pairs or another Index."""
+        if isinstance(spec, Index):
+            return spec
+        return cls(spec)
+    parse = classmethod(parse)
+
+
+    def options(self):
+        """Options for the driver's `ensure_index`."""
+        options = dict(unique = self.unique)
+        if self.sparse:
+            options['sparse'] = True
+        if self.ttl is not None:
+            # not `ttl`, which means time of index caching for the driver
+            options['expireAfterSeconds'] = self.ttl
+        return options
+
+
+    def field_names(self):
+        return [key for key, direction in self.keys]
+
+
+    def __repr__(self):
+        return '<Index %r>' % (self.keys,)
+
+
+
+def ensure_indexes(collection, indexes):
+    for index in indexes:
+        collection.ensure_index(index.keys, **index.options())
+
+
+
+def query_shape(query, sort = None):
+    """Returns (equality fields, range fields, sort fields) of the query.
+       Conditions inside `$or` and other top level operators are
+       not taken into account."""
+    equality = []
+    ranges = []
+    for name, value in (query or {}).iteritems():
+        if name.startswith('$'):
+            continue
+        if isinstance(value, dict) and [key for key in value if key.startswith('$')]:
+            if '$in' in value or '$all' in value:
+                equality.append(name)
+            else:
+                ranges.append(name)
+        else:
+            equality.append(name)
+
+    sort_fields = []
+    if sort:
+        args, kwargs = sort
+        key_or_list = args and args[0] or kwargs.get('key_or_list')
+        if isinstance(key_or_list, types.StringTypes):
+            sort_fields = [key_or_list]
+        elif key_or_list:
+            sort_fields = [key for key, direction in key_or_list]
+
+    return (tuple(sorted(equality)), tuple(sorted(ranges)), tuple(sort_fields))
+
+
+def is_supported(shape, index_fields):
+    """Checks if the index with `index_fields` could be used for the
+       query of the `shape`: its first key should be a field, which
+       the query matches on, or which it is sorted by, when the query
+       has no conditions."""
+    equality, ranges, sort = shape
+    first = index_fields[0]
+    if first in equality or first in ranges:
+        return True
+    return not equality and not ranges and bool(sort) and first == sort[0]
+
+
+
+class IndexAdvisor(object):
+    """Listener, which records shapes of the queries, and finds
+       the ones without supporting indexes."""
+
+    def __init__(self):
+        # (Document class, shape) -> number of queries
+        self.shapes = {}
+
+
+    def __call__(self, event):
+        if event.operation not in ('find', 'find_one', 'count'):
+            return
+        key = (event.doc_class, query_shape(event.query, event.sort))
+        self.shapes[key] = self.shapes.get(key, 0) + 1
+
+
+    def missing(self):
+        """Returns list of (Document class, shape, number of queries)
+           for the queries, which no existing index supports."""
+        indexes = {}
+        result = []
+        for (doc_class, shape), count in sorted(self.shapes.iteritems()):
+            equality, ranges, sort = shape
+            if not (equality or ranges or sort):
+                continue
+
+            if doc_class not in indexes:
+                indexes[doc_class] = [
+                    [key for key, direction in keys]
+                    for keys in doc_class.objects.index_information().itervalues()]
+
+            if not [fields for fields in indexes[doc_class]
+                    if is_supported(shape, fields)]:
+                result.append((doc_class, shape, count))
+        return result
+
+
+    def report(self):
+        lines = []
+        for doc_class, (equality, ranges, sort), count in self.missing():
+            lines.append('%s: %d queries without index, fields %s, '
+                         'ranges %s, sorted by %s' % (
+                             doc_class.__name__, count,
+                             ', '.join(equality) or '-',
+                             ', '.join(ranges) or '-',
+                             ', '.join(sort) or '-'))
+        return '\n'.join(lines)
+
+
+    def __enter__(self):
+        add_listener(self)
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        remove_listener(self)
+
+
+
+def advise_indexes():
+    return IndexAdvisor()
@@ -0,0 +1,240 @@
+# This code is licensed under the New BSD License
+# 2009, Alexander Artemenko <svetlyak.40wt@gmail.com>
+# For other contacts, visit http://aartemenko.com
+
+"""
+Query instrumentation.
+
+Listeners are called with a QueryEvent after every query, which
+goes through the collection manager: `find`, `find_one`, `save`,
+`update`, `insert`, `remove`, `count` and `dereference`.
+
+>>> from mongobongo.instrumentation import QueryStats, add_listener
+>>> stats = QueryStats()
+>>> add_listener(stats)
+>>> ...
+>>> print stats.report()
+
+`track_dereferences` counts lazy dereferences, made by attribute
+access, and warns about N+1 query patterns:
+
+>>> with track_dereferences(threshold = 10) as tracker:
+...     titles = [a.author.name for a in Article.objects.all()]
+NPlusOneWarning: Article.author was dereferenced lazily 11 times...
+>>> tracker.count
+500
+
+The tracker counts dereferences of the thread, which entered the
+block, and the warning points to the line, which accessed the field.
+"""
+
+import sys
+import threading
+import time
+import warnings
+
+listeners = []
+
+
+def add_listener(listener):
+    """Adds callable, which will be called with every QueryEvent."""
+    listeners.append(listener)
+
+
+def remove_listener(listener):
+    listeners.remove(listener)
+
+
+def notify(event):
+    for listener in list(listeners):
+        listener(event)
+
+
+
+class QueryEvent(object):
+    """Describes one query.
+
+       `doc_class` is the Document class, which manager sent the
+       query, and `duration` is in seconds. For dereferences,
+       `lazy` is True when the reference was resolved on attribute
+       access, and `field` is the name of that attribute. Queries,
+       sent by cursors, have `sort` in the form of cursor's
+       `sort` arguments: (args, kwargs).
+    """
+
+    def __init__(self, operation, doc_class, collection, query = None,
+                 duration = 0.0, lazy = False, field = None, sort = None):
+        self.operation = operation
+        self.doc_class = doc_class
+        self.collection = collection
+        self.query = query
+        self.duration = duration
+        self.lazy = lazy
+        self.field = field
+        self.sort = sort
+
+
+    def __repr__(self):
+        return '<QueryEvent %s %s.%s %r %.6fs>' % (
+            self.operation, self.doc_class.__name__,
+            self.collection, self.query, self.duration)
+
+
+
+def instrumented(event, func, *args, **kwargs):
+    """Calls `func` and notifies listeners about it with the
+       `event`, which duration is set to the time of the call."""
+    started = time.time()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        event.duration = time.time() - started
+        notify(event)
+
+
+
+class QueryStats(object):
+    """Listener, which counts queries and their time per
+       Document class and operation."""
+
+    def __init__(self):
+        self.counts = {}
+        self.durations = {}
+
+
+    def __call__(self, event):
+        key = (event.doc_class.__name__, event.operation)
+        self.counts[key] = self.counts.get(key, 0) + 1
+        self.durations[key] = self.durations.get(key, 0.0) + event.duration
+
+
+    def reset(self):
+        self.counts.clear()
+        self.durations.clear()
+
+
+    def report(self):
+        lines = ['%-20s %-12s %8s %12s' % ('class', 'operation', 'count', 'seconds')]
+        for key in sorted(self.counts):
+            lines.append('%-20s %-12s %8d %12.6f' % (
+                key[0], key[1], self.counts[key], self.durations[key]))
+        return '\n'.join(lines)
+
+
+
+class NPlusOneWarning(UserWarning):
+    """Same reference field is dereferenced lazily again and again,
+       which means one query per document. Use cursor's `prefetch`."""
+
+
+
+def _user_stacklevel():
+    """Returns `stacklevel` for `warnings.warn`, called by the caller
+       of this function, which points to the first frame outside
+       of mongobongo."""
+    frame = sys._getframe(1)
+    level = 1
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        if module != 'mongobongo' and not module.startswith('mongobongo.'):
+            break
+        frame = frame.f_back
+        level += 1
+    return level
+
+
+
+class DereferenceTracker(object):
+    """Counts lazy dereferences inside the `with` block, made
+       by the thread, which entered it, and warns when one field
+       is dereferenced more than `threshold` times."""
+
+    def __init__(self, threshold = 10):
+        self.threshold = threshold
+        self.count = 0
+        self.by_field = {}
+        self.thread = None
+
+
+    def __call__(self, event):
+        if event.operation != 'dereference' or not event.lazy:
+            return
+        if threading.currentThread() is not self.thread:
+            return
+
+        self.count += 1
+        key = (event.doc_class.__name__, event.field)
+        count = self.by_field[key] = self.by_field.get(key, 0) + 1
+
+        if count == self.threshold + 1:
+            warnings.warn('%s.%s was dereferenced lazily %d times, '
+                          'which is an N+1 query pattern. Use '
+                          'prefetch(%r) on the cursor.' % (
+                              key[0], key[1], count, key[1]),
+                          NPlusOneWarning, stacklevel = _user_stacklevel())
+
+
+    def __enter__(self):
+        self.thread = threading.currentThread()
+        add_listener(self)
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        remove_listener(self)
+
+
+
+def track_dereferences(threshold = 10):
+    return DereferenceTracker(threshold)
+
+
+
+class InstrumentedCursor(object):
+    """Wraps driver's cursor, to notify listeners about the
+       query, when the first result is fetched, and about
+       `count` and single item queries."""
+
+    def __init__(self, cursor, operation, doc_class, collection, query,
+                 sort = None):
+        self._cursor = cursor
+        self._operation = operation
+        self._doc_class = doc_class
+        self._collection = collection
+        self._query = query
+        self._sort = sort
+        self._executed = False
+
+
+    def _event(self, operation):
+        return QueryEvent(operation, self._doc_class, self._collection,
+                          self._query, sort = self._sort)
+
+
+    def __iter__(self):
+        return self
+
+
+    def next(self):
+        if self._executed:
+            return self._cursor.next()
+
+        self._executed = True
+        return instrumented(self._event(self._operation), self._cursor.next)
+
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            self._cursor[index]
+            return self
+        return instrumented(self._event(self._operation),
+                            self._cursor.__getitem__, index)
+
+
+    def count(self, *args, **kwargs):
+        return instrumented(self._event('count'),
+                            self._cursor.count, *args, **kwargs)
+
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
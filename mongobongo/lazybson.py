@@ -0,0 +1,432 @@
+# This code is licensed under the New BSD License
+# 2009, Alexander Artemenko <svetlyak.40wt@gmail.com>
+# For other contacts, visit http://aartemenko.com
+
+"""
+Lazy decoding of BSON documents.
+
+PyMongo's cursor decodes every field of every document it receives.
+For wide documents, when only a few fields are read, most of this work
+and memory is wasted. Lazy cursors keep each document as BSON bytes
+and decode a field on the first access:
+
+>>> for article in Article.objects.all().lazy():
+...     print article.title
+
+LazyBSON finds fields by skipping over the encoded values, without
+decoding them, and remembers where it stopped, so fields are found
+in one pass over the document. Nested documents are decoded as a
+whole, when their top level field is accessed.
+
+Skipping is done in Python, so it saves CPU time when skipped values
+are big (nested documents, arrays, long strings and binaries), or when
+the driver has no C extension. For documents with many small fields,
+the C extension decodes the whole document faster than LazyBSON skips
+over it, and the lazy mode only saves memory.
+
+PyMongo has no API to receive raw BSON, so LazyCursor sends queries
+with MongoDB's wire protocol through the driver's connection.
+Collections, which have the `find_bson` method, like MemoryCollection,
+are used through it instead.
+"""
+
+import struct
+import types
+from collections import deque
+from UserDict import DictMixin
+
+from pymongo import ASCENDING
+from pymongo.bson import BSON
+from pymongo.errors import InvalidOperation, OperationFailure
+from pymongo.son import SON
+
+_OP_QUERY = 2004
+_OP_GET_MORE = 2005
+_SLAVE_OKAY = 4
+
+_FIXED_SIZES = {
+    '\x01': 8,  # double
+    '\x06': 0,  # undefined
+    '\x07': 12, # ObjectId
+    '\x08': 1,  # boolean
+    '\x09': 8,  # datetime
+    '\x0A': 0,  # null
+    '\x10': 4,  # int32
+    '\x11': 8,  # timestamp
+    '\x12': 8,  # int64
+    '\x7F': 0,  # max key
+    '\xFF': 0,  # min key
+}
+_STRING_TYPES = ('\x02', '\x0D', '\x0E')          # string, code, symbol
+_DOCUMENT_TYPES = ('\x03', '\x04', '\x0F')        # document, array, code with scope
+
+
+def _int32(data, position):
+    return struct.unpack('<i', data[position:position + 4])[0]
+
+
+def _value_end(data, element_type, position):
+    """Returns position after the value, which starts at `position`."""
+    size = _FIXED_SIZES.get(element_type)
+    if size is not None:
+        return position + size
+    if element_type in _STRING_TYPES:
+        return position + 4 + _int32(data, position)
+    if element_type in _DOCUMENT_TYPES:
+        return position + _int32(data, position)
+    if element_type == '\x05':  # binary
+        return position + 5 + _int32(data, position)
+    if element_type == '\x0B':  # regex
+        position = data.index('\x00', position) + 1
+        return data.index('\x00', position) + 1
+    if element_type == '\x0C':  # DBPointer
+        return position + 4 + _int32(data, position) + 12
+    raise ValueError('unknown BSON type %r' % element_type)
+
+
+def _decode_element(element):
+    """Decodes one element, wrapping it into the document."""
+    document = struct.pack('<i', len(element) + 5) + element + '\x00'
+    return BSON(document).to_dict().popitem()[1]
+
+
+
+class LazyBSON(DictMixin, object):
+    """Mapping over the BSON document. Fields are decoded on
+       the first access, changed and new fields are kept decoded."""
+
+    def __init__(self, data):
+        self.__bson = data
+        # where unscanned fields start, None when all are scanned
+        self.__position = 4
+        # (start, end) of the elements, which were scanned
+        self.__elements = {}
+        self.__order = []
+        self.__decoded = {}
+        self.__deleted = set()
+
+
+    def __scan(self, name = None):
+        """Scans elements until the `name` is found, or to the end.
+           Names are kept encoded, to not decode every one of them."""
+        if isinstance(name, unicode):
+            name = name.encode('utf-8')
+
+        data = self.__bson
+        elements = self.__elements
+        order = self.__order
+        fixed_sizes = _FIXED_SIZES
+        string_types = _STRING_TYPES
+        unpack = struct.unpack
+
+        position = self.__position
+        end = len(data) - 1
+        while position < end:
+            element_type = data[position]
+            name_end = data.index('\x00', position + 1)
+            element_name = data[position + 1:name_end]
+
+            value_start = name_end + 1
+            size = fixed_sizes.get(element_type)
+            if size is not None:
+                value_end = value_start + size
+            elif element_type in string_types:
+                value_end = value_start + 4 + \
+                            unpack('<i', data[value_start:value_start + 4])[0]
+            else:
+                value_end = _value_end(data, element_type, value_start)
+
+            elements[element_name] = (position, value_end)
+            order.append(element_name)
+            position = value_end
+            if element_name == name:
+                self.__position = position
+                return
+
+        self.__position = None
+
+
+    def __getitem__(self, name):
+        try:
+            return self.__decoded[name]
+        except KeyError:
+            pass
+
+        if name in self.__deleted:
+            raise KeyError(name)
+
+        key = name
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+
+        element = self.__elements.get(key)
+        if element is None and self.__position is not None:
+            self.__scan(key)
+            element = self.__elements.get(key)
+        if element is None:
+            raise KeyError(name)
+
+        value = self.__decoded[name] = _decode_element(
+            self.__bson[element[0]:element[1]])
+        return value
+
+
+    def __setitem__(self, name, value):
+        self.__decoded[name] = value
+        self.__deleted.discard(name)
+
+
+    def __delitem__(self, name):
+        if name not in self:
+            raise KeyError(name)
+        self.__decoded.pop(name, None)
+        self.__deleted.add(name)
+
+
+    def __contains__(self, name):
+        try:
+            self[name]
+        except KeyError:
+            return False
+        return True
+
+
+    def keys(self):
+        if self.__position is not None:
+            self.__scan()
+        keys = [name.decode('utf-8') for name in self.__order]
+        keys = [name for name in keys if name not in self.__deleted]
+        keys.extend(name for name in self.__decoded if name not in keys)
+        return keys
+
+
+    def __iter__(self):
+        return iter(self.keys())
+
+
+    def __len__(self):
+        return len(self.keys())
+
+
+    def copy(self):
+        return self.to_dict()
+
+
+    def to_dict(self):
+        """Decodes the whole document into a dict."""
+        result = BSON(self.__bson).to_dict()
+        for name in self.__deleted:
+            result.pop(name, None)
+        result.update(self.__decoded)
+        return result
+
+
+    def __repr__(self):
+        return '<LazyBSON %s>' % ', '.join(self.keys())
+
+
+
+class LazyCursor(object):
+    """Cursor, which returns LazyBSON documents.
+
+       Arguments are the same as of the driver's `find`, and `sort`
+       is a list of (key, direction) pairs.
+    """
+
+    def __init__(self, collection, spec, fields = None, skip = 0, limit = 0,
+                 sort = None, batch_size = 0, slave_okay = False):
+        self.__collection = collection
+        self.__spec = spec
+        self.__fields = fields
+        self.__skip = skip
+        self.__limit = limit
+        self.__sort = sort
+        self.__batch_size = batch_size
+        self.__slave_okay = slave_okay
+
+        self.__batch = deque()
+        self.__id = None
+        # connection of the master-slave setup, which has the cursor
+        self.__connection_id = None
+        self.__retrieved = 0
+        self.__executed = False
+        self.__exhausted = False
+
+
+    def __check_not_executed(self):
+        if self.__executed:
+            raise InvalidOperation('cannot set options after executing query')
+
+
+    def sort(self, key_or_list, direction = None):
+        self.__check_not_executed()
+        if isinstance(key_or_list, types.StringTypes):
+            key_or_list = [(key_or_list, direction or ASCENDING)]
+        self.__sort = list(key_or_list)
+        return self
+
+
+    def limit(self, limit):
+        self.__check_not_executed()
+        self.__limit = limit
+        return self
+
+
+    def skip(self, skip):
+        self.__check_not_executed()
+        self.__skip = skip
+        return self
+
+
+    def batch_size(self, batch_size):
+        self.__batch_size = batch_size
+        return self
+
+
+    def count(self, with_limit_and_skip = False):
+        cursor = self.__collection.find(self.__spec, skip = self.__skip,
+                                        limit = self.__limit)
+        return cursor.count(with_limit_and_skip = with_limit_and_skip)
+
+
+    def clone(self):
+        return LazyCursor(self.__collection, self.__spec, self.__fields,
+                          self.__skip, self.__limit, self.__sort,
+                          self.__batch_size, self.__slave_okay)
+
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            self.__check_not_executed()
+            self.__skip = index.start or 0
+            if index.stop is not None:
+                self.__limit = index.stop - self.__skip
+            return self
+
+        cursor = self.clone()
+        cursor.__skip = self.__skip + index
+        cursor.__limit = -1
+        for doc in cursor:
+            return doc
+        raise IndexError('no such item for Cursor instance')
+
+
+    def __iter__(self):
+        return self
+
+
+    def next(self):
+        while not self.__batch:
+            if self.__exhausted:
+                raise StopIteration
+            self.__fetch()
+        doc = LazyBSON(self.__batch.popleft())
+
+        # outgoing manipulators of the database, as the driver's cursor
+        # applies them; without manipulators the document stays lazy
+        db = self.__collection.database()
+        fix_outgoing = getattr(db, '_fix_outgoing', None)
+        if fix_outgoing is not None:
+            doc = fix_outgoing(doc, self.__collection)
+        return doc
+
+
+    def __fetch(self):
+        self.__executed = True
+        fields = self.__fields
+        if isinstance(fields, list):
+            fields = dict((name, 1) for name in fields)
+
+        find_bson = getattr(type(self.__collection), 'find_bson', None)
+        if find_bson is not None:
+            self.__batch.extend(self.__collection.find_bson(
+                self.__spec, fields, self.__skip, self.__limit, self.__sort))
+            self.__exhausted = True
+            return
+
+        if self.__id is None:
+            self.__query(fields)
+        else:
+            self.__get_more()
+
+
+    def __number_to_return(self):
+        if self.__limit < 0:
+            return self.__limit
+        if self.__limit:
+            left = self.__limit - self.__retrieved
+            if self.__batch_size:
+                return min(left, self.__batch_size)
+            return left
+        return self.__batch_size
+
+
+    def __query(self, fields):
+        spec = self.__spec
+        if self.__sort:
+            spec = SON([('query', spec), ('orderby', SON(self.__sort))])
+
+        options = 0
+        if self.__slave_okay:
+            options |= _SLAVE_OKAY
+
+        message = struct.pack('<i', options)
+        message += self.__collection.full_name().encode('utf-8') + '\x00'
+        message += struct.pack('<ii', self.__skip, self.__number_to_return())
+        message += BSON.from_dict(spec)
+        if fields:
+            message += BSON.from_dict(fields)
+        self.__send(_OP_QUERY, message)
+
+
+    def __get_more(self):
+        message = struct.pack('<i', 0)
+        message += self.__collection.full_name().encode('utf-8') + '\x00'
+        message += struct.pack('<iq', self.__number_to_return(), self.__id)
+        self.__send(_OP_GET_MORE, message)
+
+
+    def __send(self, operation, message):
+        connection = self.__collection.database().connection()
+        # getmore goes to the connection, which got the query
+        kwargs = {}
+        if self.__connection_id is not None:
+            kwargs['_connection_to_use'] = self.__connection_id
+        response = connection._send_message_with_response(operation, message,
+                                                          **kwargs)
+        if isinstance(response, tuple):
+            self.__connection_id, response = response
+
+        flag = _int32(response, 0)
+        if flag == 1:
+            raise OperationFailure("cursor id '%s' not valid at server" % self.__id)
+        if flag == 2:
+            error = BSON(response[20:]).to_dict()
+            raise OperationFailure('database error: %s' % error['$err'])
+
+        self.__id, returned = struct.unpack('<qxxxxi', response[4:20])
+
+        position = 20
+        while position < len(response):
+            size = _int32(response, position)
+            self.__batch.append(response[position:position + size])
+            position += size
+        self.__retrieved += returned
+
+        limit_reached = self.__limit and \
+                        (self.__limit < 0 or self.__retrieved >= self.__limit)
+        if not self.__id or limit_reached:
+            self.close()
+
+
+    def close(self):
+        """Closes the cursor on the server, when it is still open."""
+        self.__exhausted = True
+        if self.__id:
+            cursor_id, self.__id = self.__id, None
+            self.__collection.database().connection().close_cursor(cursor_id)
+
+
+    def __del__(self):
+        if self.__id:
+            self.close()
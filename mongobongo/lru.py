@@ -0,0 +1,102 @@
+# This code is licensed under the New BSD License
+# 2009, Alexander Artemenko <svetlyak.40wt@gmail.com>
+# For other contacts, visit http://aartemenko.com
+
+"""
+Size bounded mapping with least-recently-used eviction.
+"""
+
+_PREV, _NEXT, _KEY, _VALUE = range(4)
+
+
+class LRUCache(object):
+    """Keeps at most `size` items. When it overflows, the item
+       which was not used for the longest time is thrown away.
+
+       Every `get` is counted either as a hit or as a miss.
+    """
+
+    def __init__(self, size):
+        if size < 1:
+            raise ValueError('size must be positive, not %r' % size)
+
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.__links = {}
+        # root of the circular doubly linked list,
+        # most recently used items are right after it
+        self.__root = root = []
+        root[:] = [root, root, None, None]
+
+
+    def __len__(self):
+        return len(self.__links)
+
+
+    def __contains__(self, key):
+        return key in self.__links
+
+
+    def __unlink(self, link):
+        link[_PREV][_NEXT] = link[_NEXT]
+        link[_NEXT][_PREV] = link[_PREV]
+
+
+    def __push_front(self, link):
+        root = self.__root
+        link[_PREV] = root
+        link[_NEXT] = root[_NEXT]
+        root[_NEXT][_PREV] = link
+        root[_NEXT] = link
+
+
+    def get(self, key, default = None):
+        link = self.__links.get(key)
+        if link is None:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        self.__unlink(link)
+        self.__push_front(link)
+        return link[_VALUE]
+
+
+    def set(self, key, value):
+        link = self.__links.get(key)
+        if link is not None:
+            link[_VALUE] = value
+            self.__unlink(link)
+        else:
+            if len(self.__links) >= self.size:
+                oldest = self.__root[_PREV]
+                self.__unlink(oldest)
+                del self.__links[oldest[_KEY]]
+
+            link = self.__links[key] = [None, None, key, value]
+        self.__push_front(link)
+
+
+    def pop(self, key, default = None):
+        link = self.__links.pop(key, None)
+        if link is None:
+            return default
+        self.__unlink(link)
+        return link[_VALUE]
+
+
+    def keys(self):
+        """Returns keys, most recently used first."""
+        result = []
+        link = self.__root[_NEXT]
+        while link is not self.__root:
+            result.append(link[_KEY])
+            link = link[_NEXT]
+        return result
+
+
+    def clear(self):
+        self.__links.clear()
+        root = self.__root
+        root[:] = [root, root, None, None]
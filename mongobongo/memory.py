@@ -0,0 +1,669 @@
+# This code is licensed under the New BSD License
+# 2009, Alexander Artemenko <svetlyak.40wt@gmail.com>
+# For other contacts, visit http://aartemenko.com
+
+"""
+In-process stand-in for a PyMongo database.
+
+It implements the part of the PyMongo 1.1 API which mongobongo uses,
+so tests and benchmarks can run without a live MongoDB server:
+
+>>> from mongobongo.memory import MemoryDatabase
+>>> Article.objects.db = MemoryDatabase('test')
+
+Documents are stored as deep copies and every read returns fresh
+copies, just like the real driver decodes new dicts from BSON.
+Every collection counts queries and commands on it, which it received,
+in the `_queries` attribute, and the database sums them in `queries`.
+"""
+
+import copy
+import threading
+import types
+
+from pymongo import ASCENDING
+from pymongo.bson import BSON
+from pymongo.dbref import DBRef
+from pymongo.objectid import ObjectId
+
+
+def _lookup(doc, path):
+    """Returns the list of values found by a dotted `path`,
+       descending into the lists on the way."""
+    values = [doc]
+    for part in path.split('.'):
+        found = []
+        for value in values:
+            if isinstance(value, types.DictType):
+                if part in value:
+                    found.append(value[part])
+            elif isinstance(value, types.ListType):
+                if part.isdigit() and int(part) < len(value):
+                    found.append(value[int(part)])
+                else:
+                    for item in value:
+                        if isinstance(item, types.DictType) and part in item:
+                            found.append(item[part])
+        values = found
+    return values
+
+
+def _expand(values):
+    """Array fields match if any of their items match."""
+    result = []
+    for value in values:
+        result.append(value)
+        if isinstance(value, types.ListType):
+            result.extend(value)
+    return result
+
+
+def _match_operator(op, arg, values):
+    expanded = _expand(values)
+
+    if op == '$in':
+        return any(v in arg for v in expanded)
+    if op == '$nin':
+        return not any(v in arg for v in expanded)
+    if op == '$ne':
+        return arg not in expanded
+    if op == '$exists':
+        return bool(values) == bool(arg)
+    if op == '$all':
+        return all(a in expanded for a in arg)
+    if op == '$size':
+        return any(isinstance(v, types.ListType) and len(v) == arg for v in values)
+    if op == '$gt':
+        return any(v is not None and v > arg for v in expanded)
+    if op == '$gte':
+        return any(v is not None and v >= arg for v in expanded)
+    if op == '$lt':
+        return any(v is not None and v < arg for v in expanded)
+    if op == '$lte':
+        return any(v is not None and v <= arg for v in expanded)
+    if op == '$not':
+        return not all(_match_operator(o, a, values) for o, a in arg.iteritems())
+    raise ValueError('unsupported query operator %r' % op)
+
+
+def _match(doc, spec):
+    for key, condition in spec.iteritems():
+        if key == '$or':
+            if not any(_match(doc, sub) for sub in condition):
+                return False
+            continue
+        if key == '$and':
+            if not all(_match(doc, sub) for sub in condition):
+                return False
+            continue
+
+        values = _lookup(doc, key)
+
+        if isinstance(condition, types.DictType) and condition and \
+                all(k.startswith('$') for k in condition):
+            for op, arg in condition.iteritems():
+                if not _match_operator(op, arg, values):
+                    return False
+        else:
+            if condition is None:
+                if values and None not in values:
+                    return False
+            elif condition not in _expand(values):
+                return False
+    return True
+
+
+def _sort(docs, ordering):
+    for name, direction in reversed(ordering):
+        def key(doc, name=name):
+            values = _lookup(doc, name)
+            if values:
+                return (1, values[0])
+            return (0, None)
+        docs.sort(key=key, reverse=(direction != ASCENDING))
+    return docs
+
+
+def _project(doc, fields):
+    if fields is None:
+        return doc
+    if isinstance(fields, (types.ListType, types.TupleType)):
+        fields = dict((name, 1) for name in fields)
+
+    include = [name for name, flag in fields.iteritems() if flag]
+    exclude = [name for name, flag in fields.iteritems() if not flag]
+
+    if include:
+        result = {}
+        if '_id' in doc and fields.get('_id', 1):
+            result['_id'] = doc['_id']
+        for name in include:
+            _copy_path(doc, result, name.split('.'))
+        return result
+
+    result = copy.deepcopy(doc)
+    for name in exclude:
+        _delete_path(result, name.split('.'))
+    return result
+
+
+def _copy_path(source, target, parts):
+    if parts[0] not in source:
+        return
+    value = source[parts[0]]
+    if len(parts) == 1:
+        target[parts[0]] = value
+    elif isinstance(value, types.DictType):
+        _copy_path(value, target.setdefault(parts[0], {}), parts[1:])
+
+
+def _delete_path(doc, parts):
+    for part in parts[:-1]:
+        doc = doc.get(part)
+        if not isinstance(doc, types.DictType):
+            return
+    doc.pop(parts[-1], None)
+
+
+def _set_path(doc, path, value):
+    parts = path.split('.')
+    for part in parts[:-1]:
+        if isinstance(doc, types.ListType):
+            doc = doc[int(part)]
+        else:
+            doc = doc.setdefault(part, {})
+    if isinstance(doc, types.ListType):
+        doc[int(parts[-1])] = value
+    else:
+        doc[parts[-1]] = value
+
+
+def _unset_path(doc, path):
+    parts = path.split('.')
+    for part in parts[:-1]:
+        if isinstance(doc, types.ListType):
+            doc = doc[int(part)]
+        else:
+            doc = doc.get(part)
+        if doc is None:
+            return
+    if isinstance(doc, types.DictType):
+        doc.pop(parts[-1], None)
+
+
+def _apply_update(doc, document):
+    if not [key for key in document if key.startswith('$')]:
+        _id = doc.get('_id')
+        doc.clear()
+        doc.update(copy.deepcopy(document))
+        if _id is not None:
+            doc['_id'] = _id
+        return
+
+    for op, changes in document.iteritems():
+        for path, value in changes.iteritems():
+            if op == '$set':
+                _set_path(doc, path, copy.deepcopy(value))
+            elif op == '$unset':
+                _unset_path(doc, path)
+            elif op == '$inc':
+                current = _lookup(doc, path)
+                _set_path(doc, path, (current and current[0] or 0) + value)
+            elif op == '$push':
+                current = _lookup(doc, path)
+                if current:
+                    current[0].append(copy.deepcopy(value))
+                else:
+                    _set_path(doc, path, [copy.deepcopy(value)])
+            else:
+                raise ValueError('unsupported update operator %r' % op)
+
+
+
+def _evaluate(doc, expression):
+    """Evaluates aggregation expression: '$field.path', dict of
+       expressions, or a constant."""
+    if isinstance(expression, types.StringTypes) and expression.startswith('$'):
+        values = _lookup(doc, expression[1:])
+        if values:
+            return values[0]
+        return None
+    if isinstance(expression, types.DictType):
+        return dict((key, _evaluate(doc, value))
+                    for key, value in expression.iteritems())
+    return expression
+
+
+def _accumulate(operator, values):
+    if operator == '$sum':
+        return sum(v for v in values if isinstance(v, (int, long, float)))
+    if operator == '$avg':
+        numbers = [v for v in values if isinstance(v, (int, long, float))]
+        if not numbers:
+            return None
+        return float(sum(numbers)) / len(numbers)
+    if operator == '$min':
+        return min([v for v in values if v is not None] or [None])
+    if operator == '$max':
+        return max([v for v in values if v is not None] or [None])
+    if operator in ('$first', '$last'):
+        if not values:
+            return None
+        return values[operator == '$first' and 0 or -1]
+    if operator == '$push':
+        return values
+    if operator == '$addToSet':
+        result = []
+        for value in values:
+            if value not in result:
+                result.append(value)
+        return result
+    raise ValueError('unsupported accumulator %r' % operator)
+
+
+def _stage_match(docs, query, database):
+    return [doc for doc in docs if _match(doc, query)]
+
+
+def _stage_project(docs, fields, database):
+    include = dict((name, value) for name, value in fields.iteritems()
+                   if value not in (0, False))
+    if not include:
+        return [_project(doc, fields) for doc in docs]
+
+    result = []
+    for doc in docs:
+        projected = {}
+        if '_id' in doc and fields.get('_id', 1):
+            projected['_id'] = doc['_id']
+        for name, value in include.iteritems():
+            if value in (1, True):
+                _copy_path(doc, projected, name.split('.'))
+            else:
+                projected[name] = _evaluate(doc, value)
+        result.append(projected)
+    return result
+
+
+def _stage_group(docs, group, database):
+    groups = {}
+    order = []
+    for doc in docs:
+        key = _evaluate(doc, group['_id'])
+        frozen = repr(key)
+        if frozen not in groups:
+            groups[frozen] = (key, [])
+            order.append(frozen)
+        groups[frozen][1].append(doc)
+
+    result = []
+    for frozen in order:
+        key, members = groups[frozen]
+        row = {'_id': key}
+        for name, accumulator in group.iteritems():
+            if name == '_id':
+                continue
+            (operator, expression), = accumulator.items()
+            values = [_evaluate(doc, expression) for doc in members]
+            row[name] = _accumulate(operator, values)
+        result.append(row)
+    return result
+
+
+def _stage_sort(docs, ordering, database):
+    return _sort(docs, list(ordering.items()))
+
+
+def _stage_limit(docs, limit, database):
+    return docs[:limit]
+
+
+def _stage_skip(docs, skip, database):
+    return docs[skip:]
+
+
+def _stage_unwind(docs, path, database):
+    result = []
+    for doc in docs:
+        values = _lookup(doc, path[1:])
+        if not values or not isinstance(values[0], types.ListType):
+            continue
+        for value in values[0]:
+            unwound = copy.deepcopy(doc)
+            _set_path(unwound, path[1:], value)
+            result.append(unwound)
+    return result
+
+
+def _stage_lookup(docs, lookup, database):
+    foreign = database[lookup['from']]._documents
+    for doc in docs:
+        local = _expand(_lookup(doc, lookup['localField']))
+        doc[lookup['as']] = [
+            copy.deepcopy(other) for other in foreign
+            if [v for v in _expand(_lookup(other, lookup['foreignField']))
+                if v in local]]
+    return docs
+
+
+_STAGES = {
+    '$match': _stage_match,
+    '$project': _stage_project,
+    '$group': _stage_group,
+    '$sort': _stage_sort,
+    '$limit': _stage_limit,
+    '$skip': _stage_skip,
+    '$unwind': _stage_unwind,
+    '$lookup': _stage_lookup,
+}
+
+
+
+class MemoryCursor(object):
+    """Mimics `pymongo.cursor.Cursor`."""
+
+    def __init__(self, collection, spec, fields=None, skip=0, limit=0):
+        self.__collection = collection
+        self.__spec = spec
+        self.__fields = fields
+        self.__skip = skip
+        self.__limit = limit
+        self.__ordering = None
+        self.__batch_size = 0
+        self.__results = None
+
+    @property
+    def collection(self):
+        return self.__collection
+
+    def __execute(self):
+        if self.__results is None:
+            collection = self.__collection
+            collection._lock.acquire()
+            try:
+                collection._queries += 1
+                docs = [doc for doc in collection._documents
+                        if _match(doc, self.__spec)]
+                if self.__ordering:
+                    _sort(docs, self.__ordering)
+                docs = docs[self.__skip:]
+                if self.__limit:
+                    docs = docs[:abs(self.__limit)]
+                self.__results = [_project(copy.deepcopy(doc), self.__fields)
+                                  for doc in docs]
+            finally:
+                collection._lock.release()
+        return self.__results
+
+    def rewind(self):
+        self.__results = None
+        return self
+
+    def clone(self):
+        cursor = MemoryCursor(self.__collection, self.__spec, self.__fields,
+                              self.__skip, self.__limit)
+        cursor.__ordering = self.__ordering
+        cursor.__batch_size = self.__batch_size
+        return cursor
+
+    def sort(self, key_or_list, direction=None):
+        if isinstance(key_or_list, types.StringTypes):
+            key_or_list = [(key_or_list, direction or ASCENDING)]
+        self.__ordering = list(key_or_list)
+        return self
+
+    def limit(self, limit):
+        self.__limit = limit
+        return self
+
+    def skip(self, skip):
+        self.__skip = skip
+        return self
+
+    def batch_size(self, batch_size):
+        self.__batch_size = batch_size
+        return self
+
+    def count(self, with_limit_and_skip=False):
+        collection = self.__collection
+        collection._lock.acquire()
+        try:
+            collection._queries += 1
+            n = len([doc for doc in collection._documents
+                     if _match(doc, self.__spec)])
+        finally:
+            collection._lock.release()
+
+        if with_limit_and_skip:
+            n = max(n - self.__skip, 0)
+            if self.__limit:
+                n = min(n, abs(self.__limit))
+        return n
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            self.__skip = index.start or 0
+            if index.stop is not None:
+                self.__limit = index.stop - self.__skip
+            return self
+
+        cursor = self.clone()
+        cursor.__skip = self.__skip + index
+        cursor.__limit = -1
+        for doc in cursor:
+            return doc
+        raise IndexError('no such item for Cursor instance')
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        results = self.__execute()
+        if results:
+            return results.pop(0)
+        raise StopIteration
+
+
+
+class MemoryCollection(object):
+    """Mimics `pymongo.collection.Collection`."""
+
+    def __init__(self, database, name):
+        self.__database = database
+        self.__name = name
+        self._documents = []
+        self._indexes = {}
+        self._index_options = {}
+        self._queries = 0
+        self._lock = threading.RLock()
+
+    def name(self):
+        return self.__name
+
+    def full_name(self):
+        return '%s.%s' % (self.__database.name(), self.__name)
+
+    def database(self):
+        return self.__database
+
+    def find(self, spec=None, fields=None, skip=0, limit=0, **kwargs):
+        if fields is not None and not isinstance(fields, types.ListType):
+            # as the driver does
+            raise TypeError('fields must be an instance of list')
+        return MemoryCursor(self, spec or {}, fields, skip, limit)
+
+    def find_one(self, spec_or_object_id=None, fields=None, **kwargs):
+        spec = spec_or_object_id
+        if isinstance(spec, ObjectId):
+            spec = {'_id': spec}
+        for doc in self.find(spec, fields, limit=-1, **kwargs):
+            return doc
+        return None
+
+    def find_bson(self, spec, fields=None, skip=0, limit=0, sort=None):
+        """Returns matching documents, encoded into BSON,
+           for mongobongo.lazybson.LazyCursor."""
+        cursor = self.find(spec, None, skip, limit)
+        if sort:
+            cursor.sort(sort)
+        # fields are given as a dict, as in the wire protocol
+        return [BSON.from_dict(_project(doc, fields)) for doc in cursor]
+
+    def count(self):
+        return len(self._documents)
+
+    def aggregate(self, pipeline):
+        self._lock.acquire()
+        try:
+            self._queries += 1
+            docs = copy.deepcopy(self._documents)
+        finally:
+            self._lock.release()
+
+        for stage in pipeline:
+            (operator, argument), = stage.items()
+            docs = _STAGES[operator](docs, argument, self.__database)
+        return docs
+
+    def insert(self, doc_or_docs, manipulate=True, safe=False, **kwargs):
+        docs = doc_or_docs
+        if isinstance(docs, types.DictType):
+            docs = [docs]
+
+        self._lock.acquire()
+        try:
+            self._queries += 1
+            for doc in docs:
+                if '_id' not in doc:
+                    doc['_id'] = ObjectId()
+                self._documents.append(copy.deepcopy(doc))
+        finally:
+            self._lock.release()
+
+        ids = [doc['_id'] for doc in docs]
+        return len(ids) == 1 and ids[0] or ids
+
+    def save(self, to_save, manipulate=True, safe=False):
+        if '_id' not in to_save:
+            return self.insert(to_save, manipulate, safe)
+        self.update({'_id': to_save['_id']}, to_save, True)
+        return to_save['_id']
+
+    def update(self, spec, document, upsert=False, manipulate=False,
+               safe=False, multi=False):
+        self._lock.acquire()
+        try:
+            self._queries += 1
+            matched = False
+            for doc in self._documents:
+                if _match(doc, spec):
+                    _apply_update(doc, document)
+                    matched = True
+                    if not multi:
+                        break
+
+            if not matched and upsert:
+                doc = dict((key, copy.deepcopy(value))
+                           for key, value in spec.iteritems()
+                           if not key.startswith('$'))
+                _apply_update(doc, document)
+                if '_id' not in doc:
+                    doc['_id'] = ObjectId()
+                self._documents.append(doc)
+        finally:
+            self._lock.release()
+
+    def remove(self, spec_or_object_id=None, safe=False):
+        spec = spec_or_object_id or {}
+        if isinstance(spec, ObjectId):
+            spec = {'_id': spec}
+
+        self._lock.acquire()
+        try:
+            self._queries += 1
+            self._documents = [doc for doc in self._documents
+                               if not _match(doc, spec)]
+        finally:
+            self._lock.release()
+
+    def ensure_index(self, key_or_list, direction=None, unique=False,
+                     ttl=300, **kwargs):
+        if isinstance(key_or_list, types.StringTypes):
+            key_or_list = [(key_or_list, direction or ASCENDING)]
+        name = '_'.join('%s_%s' % (key, value) for key, value in key_or_list)
+        self._indexes[name] = list(key_or_list)
+        self._index_options[name] = dict(kwargs, unique=unique)
+        return name
+    create_index = ensure_index
+
+    def drop_indexes(self):
+        self._indexes = {}
+        self._index_options = {}
+
+    def index_information(self):
+        info = {'_id_': [('_id', ASCENDING)]}
+        info.update(self._indexes)
+        return info
+
+
+
+class MemoryDatabase(object):
+    """Mimics `pymongo.database.Database`."""
+
+    def __init__(self, name='test'):
+        self.__name = name
+        self.__collections = {}
+
+    def name(self):
+        return self.__name
+
+    def connection(self):
+        return None
+
+    def __getitem__(self, name):
+        try:
+            return self.__collections[name]
+        except KeyError:
+            collection = self.__collections[name] = MemoryCollection(self, name)
+            return collection
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
+
+    def collection_names(self):
+        return self.__collections.keys()
+
+    def drop_collection(self, name):
+        self.__collections.pop(name, None)
+
+    def command(self, command, check=True, allowable_errors=[]):
+        """Supports only `collstats` and `aggregate` commands."""
+        if 'collstats' in command:
+            name = command['collstats']
+            collection = self[name]
+            collection._lock.acquire()
+            try:
+                collection._queries += 1
+                count = len(collection._documents)
+            finally:
+                collection._lock.release()
+            return {'ns': '%s.%s' % (self.__name, name),
+                    'count': count,
+                    'ok': 1.0}
+        if 'aggregate' in command:
+            collection = self[command['aggregate']]
+            return {'result': collection.aggregate(command['pipeline']),
+                    'ok': 1.0}
+        raise NotImplementedError('command %r' % command)
+
+    def dereference(self, dbref):
+        if not isinstance(dbref, DBRef):
+            raise TypeError('cannot dereference a %s' % type(dbref))
+        return self[dbref.collection].find_one({'_id': dbref.id})
+
+    @property
+    def queries(self):
+        """Total number of queries sent to all collections."""
+        return sum(c._queries for c in self.__collections.values())
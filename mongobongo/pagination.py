@@ -0,0 +1,136 @@
+# This code is licensed under the New BSD License
+# 2009, Alexander Artemenko <svetlyak.40wt@gmail.com>
+# For other contacts, visit http://aartemenko.com
+
+"""
+Keyset pagination.
+
+Skipping to the page makes the server walk through all documents
+before it. Instead, the page asks for documents, which go after the
+last one of the previous page in the sort order:
+
+>>> page = Article.objects.find({'published': True}).paginate(per_page = 20)
+>>> while True:
+...     for article in page:
+...         print article.title
+...     if not page.has_next:
+...         break
+...     page = Article.objects.find({'published': True}) \\
+...                   .paginate(after = page.next_token, per_page = 20)
+
+The order is the cursor's sort or `Meta.ordering`, with `_id` added
+as the tie-breaker, so every document has a single place in it. With
+an index on the sort keys and `_id`, deep pages cost as much as the
+first one. Documents should have all the sort keys, documents without
+them are skipped.
+
+The token is opaque: it keeps the sort keys and values of the last
+document, and is rejected for the cursor with another order.
+"""
+
+import base64
+import types
+
+from pymongo import ASCENDING
+from pymongo.bson import BSON
+
+
+class Page(object):
+    """Documents of one page, and the token of the next one."""
+
+    def __init__(self, items, next_token):
+        self.items = items
+        self.next_token = next_token
+
+
+    def _get_has_next(self):
+        return self.next_token is not None
+    has_next = property(_get_has_next)
+
+
+    def __iter__(self):
+        return iter(self.items)
+
+
+    def __len__(self):
+        return len(self.items)
+
+
+    def __getitem__(self, index):
+        return self.items[index]
+
+
+    def __repr__(self):
+        return '<Page of %d, next %r>' % (len(self.items), self.next_token)
+
+
+
+def ordering(sort):
+    """Makes list of (key, direction) pairs from the (args, kwargs) of
+       the cursor's `sort` call, and adds `_id` as the tie-breaker."""
+    keys = []
+    if sort:
+        args, kwargs = sort
+        key_or_list = args and args[0] or kwargs.get('key_or_list')
+        if isinstance(key_or_list, types.StringTypes):
+            if len(args) > 1:
+                direction = args[1]
+            else:
+                direction = kwargs.get('direction', ASCENDING)
+            keys = [(key_or_list, direction)]
+        elif key_or_list:
+            # pairs could be given as lists
+            keys = [(key, direction) for key, direction in key_or_list]
+
+    if '_id' not in [key for key, direction in keys]:
+        keys.append(('_id', ASCENDING))
+    return keys
+
+
+def encode_token(keys, values):
+    data = BSON.from_dict({'k': [[key, direction] for key, direction in keys],
+                           'v': values})
+    return base64.urlsafe_b64encode(data).rstrip('=')
+
+
+def decode_token(token, keys):
+    """Returns values of the sort keys, kept in the token."""
+    try:
+        token = str(token)
+        data = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        data = BSON(data).to_dict()
+        token_keys = [tuple(pair) for pair in data['k']]
+        values = data['v']
+    except (TypeError, ValueError, KeyError, IndexError):
+        raise ValueError('invalid pagination token %r' % token)
+
+    if token_keys != list(keys) or len(values) != len(keys):
+        raise ValueError('pagination token was made for another order')
+    return values
+
+
+def seek(spec, keys, values):
+    """Adds the condition for documents after the `values`
+       in the order of `keys` to the query."""
+    branches = []
+    for position, (key, direction) in enumerate(keys):
+        branch = dict((previous, value) for (previous, _), value
+                      in zip(keys[:position], values))
+        if direction == ASCENDING:
+            branch[key] = {'$gt': values[position]}
+        else:
+            branch[key] = {'$lt': values[position]}
+        branches.append(branch)
+
+    if len(branches) == 1:
+        condition = branches[0]
+    else:
+        condition = {'$or': branches}
+
+    if not spec:
+        return condition
+    if [key for key in condition if key in spec]:
+        return {'$and': [spec, condition]}
+    result = dict(spec)
+    result.update(condition)
+    return result
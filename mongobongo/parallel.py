@@ -0,0 +1,147 @@
+# This code is licensed under the New BSD License
+# 2009, Alexander Artemenko <svetlyak.40wt@gmail.com>
+# For other contacts, visit http://aartemenko.com
+
+"""
+Parallel processing of query results in a pool of processes.
+
+>>> def word_count(article):
+...     return article._id, len(article.text.split())
+>>> for _id, words in Article.objects.find({'lang': 'en'}).parallel_map(
+...         word_count, workers = 4):
+...     print _id, words
+
+The query is split into ranges of `_id`, and every range is read and
+processed by a worker process with its own connection to the
+database. Workers rebuild documents through the same class, which
+should be defined on the module level, and send back results of
+`func`, so `func` and its results must be picklable too.
+
+Results are returned in the order of `_id`, or as soon as they are
+ready, when `ordered` is False.
+
+By default, workers connect to the same host and database as the
+class uses, with the same `slave_okay` setting. The driver doesn't
+keep credentials, so pass `auth`, a (user, password) pair, for the
+database, which needs authentication. For other setups, pass
+`connect`, a picklable function, which returns the database.
+In-process databases, like MemoryDatabase, are inherited by forked
+workers.
+
+Workers query documents in the order of `_id` with all their fields,
+so cursors with `sort`, `only`, `defer`, `raw`, `lazy` or `prefetch`
+can't be processed in parallel.
+
+Requires the `multiprocessing` module, which comes with Python 2.6.
+"""
+
+import sys
+
+from pymongo import ASCENDING
+from pymongo.errors import InvalidOperation, OperationFailure
+
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+
+DEFAULT_WORKERS = 4
+
+# every worker gets this number of ranges on average,
+# so fast workers take over the work of slow ones
+RANGES_PER_WORKER = 4
+
+
+def split_by_id(collection, spec, ranges):
+    """Returns list of queries, which split results of `spec` into
+       at most `ranges` parts of the same size, by `_id`."""
+    if '_id' in spec:
+        raise InvalidOperation('query is split by _id, so it '
+                               'cannot have a condition on _id')
+
+    count = collection.find(spec).count()
+    ranges = max(min(ranges, count), 1)
+
+    boundaries = []
+    for i in xrange(1, ranges):
+        cursor = collection.find(spec, fields = ['_id'],
+                                 skip = i * count / ranges, limit = -1)
+        for value in cursor.sort('_id', ASCENDING):
+            boundaries.append(value['_id'])
+
+    queries = []
+    lower = None
+    for upper in boundaries + [None]:
+        condition = {}
+        if lower is not None:
+            condition['$gte'] = lower
+        if upper is not None:
+            condition['$lt'] = upper
+
+        query = dict(spec)
+        if condition:
+            query['_id'] = condition
+        queries.append(query)
+        lower = upper
+    return queries
+
+
+
+# Document class of the worker process
+_doc_class = None
+
+def _init_worker(module, name, connect, auth):
+    global _doc_class
+
+    __import__(module)
+    _doc_class = getattr(sys.modules[module], name)
+
+    if connect is not None:
+        db = connect()
+    else:
+        db = _doc_class.objects.db
+        connection = db.connection()
+        if connection is None:
+            # in-process database, copied by fork
+            return
+        from pymongo.connection import Connection
+        db = Connection(connection.host(), connection.port(),
+                        slave_okay = connection.slave_okay)[db.name()]
+        if auth is not None and not db.authenticate(*auth):
+            raise OperationFailure('authentication failed')
+    _doc_class.objects.bind(db)
+
+
+def _map_range(args):
+    query, func = args
+    return [func(doc) for doc in _doc_class.objects.find(query).sort('_id', ASCENDING)]
+
+
+def parallel_map(doc_class, spec, func, workers = DEFAULT_WORKERS,
+                 ordered = True, connect = None, auth = None):
+    """Yields `func(doc)` for every document of `doc_class`,
+       matching `spec`, processing them in `workers` processes."""
+    if multiprocessing is None:
+        raise NotImplementedError('parallel_map requires the '
+                                  'multiprocessing module')
+
+    manager = doc_class.objects
+    queries = split_by_id(manager._collection, spec,
+                          workers * RANGES_PER_WORKER)
+
+    pool = multiprocessing.Pool(workers, _init_worker,
+                                (doc_class.__module__,
+                                 doc_class.__name__,
+                                 connect, auth))
+    try:
+        tasks = [(query, func) for query in queries]
+        if ordered:
+            results = pool.imap(_map_range, tasks)
+        else:
+            results = pool.imap_unordered(_map_range, tasks)
+
+        for chunk in results:
+            for result in chunk:
+                yield result
+    finally:
+        pool.terminate()
@@ -0,0 +1,318 @@
+# This code is licensed under the New BSD License
+# 2009, Alexander Artemenko <svetlyak.40wt@gmail.com>
+# For other contacts, visit http://aartemenko.com
+
+"""
+Lazy, chainable querysets.
+
+>>> articles = Article.objects.filter(tags = 'python', votes__gte = 10)
+>>> articles = articles.exclude(status = 'draft').order_by('-created')
+>>> for article in articles.limit(10):
+...     print article.title
+
+Every method returns a new QuerySet, and the database is queried only
+on iteration, `len`, `count`, `exists`, `first` or indexing.
+
+Lookups are field names with optional operator, separated by double
+underscores. Double underscores inside the name go into nested fields:
+`meta__views__gt = 10` means `{'meta.views': {'$gt': 10}}`. Operators
+are `ne`, `gt`, `gte`, `lt`, `lte`, `in`, `nin`, `all`, `size` and
+`exists`.
+
+Lookups of one `exclude` are negated one by one, so `exclude(author =
+'bob', votes = 1)` means "author is not bob AND votes are not 1", and
+not the negation of both conditions at once.
+
+All lookups of the chain should match, even when they are given for
+the same field again: `exclude(status = 'draft').exclude(status =
+'deleted')` becomes `$nin`, and the narrowest of the repeated ranges
+and `$in` lists is kept. Other repeated conditions, which can't be
+combined into one query, raise ValueError.
+
+`order_by` takes field names, with '-' for descending order. Fields
+of `Meta.ordering`, which are not mentioned, are added after them,
+so there is always one sort for the query.
+
+Parsed lookups are cached per set of lookup names, and the compiled
+query is cached in the QuerySet, so querysets, which are built again
+and again with the same shape, don't parse lookups every time.
+"""
+
+import threading
+
+from pymongo import ASCENDING, DESCENDING
+from mongobongo.lru import LRUCache
+
+OPERATORS = ('ne', 'gt', 'gte', 'lt', 'lte', 'in', 'nin', 'all', 'size', 'exists')
+
+# operators, used for exclude, where the negation is known
+_NEGATIONS = {
+    None: '$ne',
+    'ne': None,
+    'in': '$nin',
+    'nin': '$in',
+}
+
+# parsed lookups: (names of filters, names of excludes) ->
+#                 list of (path, operator, negated)
+_compiled_shapes = LRUCache(256)
+_compiled_shapes_lock = threading.Lock()
+
+
+def _parse_lookup(name):
+    parts = name.split('__')
+    operator = None
+    if len(parts) > 1 and parts[-1] in OPERATORS:
+        operator = parts.pop()
+    return '.'.join(parts), operator
+
+
+def _compile_shape(filters, excludes):
+    instructions = []
+    for names, negated in ((filters, False), (excludes, True)):
+        for name in names:
+            path, operator = _parse_lookup(name)
+            instructions.append((path, operator, negated))
+    return instructions
+
+
+def _pairs(lookups):
+    """List of (name, value) pairs from the dict or the sequence."""
+    if isinstance(lookups, dict):
+        return sorted(lookups.iteritems())
+    return list(lookups)
+
+
+def _merge(path, operator, old, new):
+    """Value of the `operator`, which matches both `old` and `new`
+       values of the repeated condition."""
+    if operator in ('$gt', '$gte'):
+        return max(old, new)
+    if operator in ('$lt', '$lte'):
+        return min(old, new)
+    if operator == '$in':
+        return [value for value in old if value in new]
+    if operator in ('$nin', '$all'):
+        return list(old) + [value for value in new if value not in old]
+    if old == new:
+        return old
+    raise ValueError('conflicting conditions on %r' % path)
+
+
+def _condition(operator, negated, value):
+    """Returns (operator or None for equality, value)."""
+    if not negated:
+        if operator is None:
+            return None, value
+        return '$' + operator, value
+
+    if operator == 'exists':
+        return '$exists', not value
+    if operator in _NEGATIONS:
+        negation = _NEGATIONS[operator]
+        return negation, value
+
+    # gt, lt, all, size...
+    return '$not', {'$' + operator: value}
+
+
+def compile_query(filters, excludes):
+    """Builds the query from dicts or lists of (name, value) pairs
+       of lookups."""
+    filters, excludes = _pairs(filters), _pairs(excludes)
+    shape = (tuple(name for name, value in filters),
+             tuple(name for name, value in excludes))
+    _compiled_shapes_lock.acquire()
+    try:
+        instructions = _compiled_shapes.get(shape)
+        if instructions is None:
+            instructions = _compile_shape(*shape)
+            _compiled_shapes.set(shape, instructions)
+    finally:
+        _compiled_shapes_lock.release()
+
+    values = [value for name, value in filters + excludes]
+    query = {}
+    for (path, operator, negated), value in zip(instructions, values):
+        operator, value = _condition(operator, negated, value)
+
+        if operator is None:
+            if path in query and query[path] != value:
+                raise ValueError('conflicting conditions on %r' % path)
+            query[path] = value
+            continue
+
+        conditions = query.setdefault(path, {})
+        if not isinstance(conditions, dict):
+            raise ValueError('conflicting conditions on %r' % path)
+        if operator == '$ne' and ('$ne' in conditions or '$nin' in conditions):
+            # several negated equalities
+            operator, value = '$nin', [value]
+        if operator == '$nin' and '$ne' in conditions:
+            conditions['$nin'] = [conditions.pop('$ne')]
+        if operator in conditions:
+            value = _merge(path, operator, conditions[operator], value)
+        conditions[operator] = value
+    return query
+
+
+def _parse_ordering(names):
+    ordering = []
+    for name in names:
+        if name.startswith('-'):
+            ordering.append((name[1:].replace('__', '.'), DESCENDING))
+        else:
+            ordering.append((name.lstrip('+').replace('__', '.'), ASCENDING))
+    return ordering
+
+
+
+class QuerySet(object):
+    def __init__(self, manager):
+        self._manager = manager
+        # (name, value) pairs of lookups, in the order of calls
+        self._filters = ()
+        self._excludes = ()
+        self._ordering = []
+        self._skip = 0
+        self._limit = 0
+        self._only = None
+        self._query = None
+        self._count = None
+        # slice past the limit, which matches nothing
+        self._empty = False
+
+
+    def _clone(self, **changes):
+        clone = QuerySet(self._manager)
+        clone._filters = self._filters
+        clone._excludes = self._excludes
+        clone._ordering = self._ordering
+        clone._skip = self._skip
+        clone._limit = self._limit
+        clone._only = self._only
+        clone._empty = self._empty
+        # compiled query is the same, when filters don't change
+        clone._query = self._query
+        clone.__dict__.update(changes)
+        return clone
+
+
+    def filter(self, **lookups):
+        return self._clone(_filters = self._filters + tuple(_pairs(lookups)),
+                           _query = None)
+
+
+    def exclude(self, **lookups):
+        """Excludes documents, matching any of the lookups."""
+        return self._clone(_excludes = self._excludes + tuple(_pairs(lookups)),
+                           _query = None)
+
+
+    def order_by(self, *names):
+        return self._clone(_ordering = _parse_ordering(names))
+
+
+    def skip(self, skip):
+        return self._clone(_skip = skip)
+
+
+    def limit(self, limit):
+        return self._clone(_limit = limit)
+
+
+    def only(self, *names):
+        return self._clone(_only = tuple(self._only or ()) + names)
+
+
+    def query(self):
+        """Compiled query dict."""
+        if self._query is None:
+            self._query = compile_query(self._filters, self._excludes)
+        return self._query
+
+
+    def ordering(self):
+        """List of (key, direction) pairs: `order_by` fields,
+           then fields of Meta.ordering, which were not mentioned."""
+        ordering = list(self._ordering)
+        default = self._manager._document_class._meta.ordering
+        if isinstance(default, basestring):
+            default = [(default, ASCENDING)]
+        keys = set(key for key, direction in ordering)
+        ordering.extend((key, direction) for key, direction in default or ()
+                        if key not in keys)
+        return ordering
+
+
+    def cursor(self):
+        """Returns new CursorProxy, which runs the query."""
+        query = self.query()
+        if self._empty:
+            query = {'_id': {'$in': []}}
+        cursor = self._manager.find(query)
+        ordering = self.ordering()
+        if ordering:
+            cursor.sort(ordering)
+        if self._skip:
+            cursor.skip(self._skip)
+        if self._limit:
+            cursor.limit(self._limit)
+        if self._only is not None:
+            cursor.only(*self._only)
+        return cursor
+
+
+    def __iter__(self):
+        return self.cursor()
+
+
+    def __len__(self):
+        if self._count is None:
+            self._count = len(self.cursor())
+        return self._count
+    count = __len__
+
+
+    def exists(self):
+        return self.cursor().exists()
+
+
+    def paginate(self, after = None, per_page = 20):
+        """Keyset pagination, see mongobongo.pagination."""
+        return self.cursor().paginate(after, per_page)
+
+
+    def first(self):
+        for doc in self.limit(1):
+            return doc
+        return None
+
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            if index.step is not None:
+                raise IndexError('QuerySet does not support slice steps')
+            start = index.start or 0
+            stop = index.stop
+            if self._limit and (stop is None or stop > self._limit):
+                stop = self._limit
+            clone = self.skip(self._skip + start)
+            if stop is not None:
+                if stop <= start:
+                    return clone._clone(_empty = True)
+                clone = clone.limit(stop - start)
+            return clone
+
+        if index < 0:
+            raise IndexError('QuerySet does not support negative indices')
+        if self._empty or self._limit and index >= self._limit:
+            raise IndexError('no such item in QuerySet')
+        doc = self.skip(self._skip + index).first()
+        if doc is None:
+            raise IndexError('no such item in QuerySet')
+        return doc
+
+
+    def __repr__(self):
+        return '<QuerySet %s %r>' % (self._manager.collection_name, self.query())
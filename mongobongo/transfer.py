@@ -0,0 +1,225 @@
+# This code is licensed under the New BSD License
+# 2009, Alexander Artemenko <svetlyak.40wt@gmail.com>
+# For other contacts, visit http://aartemenko.com
+
+"""
+Streaming export and import of the collections.
+
+>>> stats = Article.objects.export('articles.jsonl.gz')
+>>> print stats
+10000 documents, 4.2 MB in 1.37 s (7299 documents/s)
+>>> Article.objects.import_('articles.jsonl.gz')
+
+Documents are read and written one by one, so memory doesn't grow
+with the size of the collection. Imports are sent with batched
+inserts.
+
+Two formats are supported:
+
+  * `jsonl` - one document per line, in MongoDB Extended JSON.
+    ObjectId, DBRef and datetime values are kept, as
+    {"$oid": ...}, {"$ref": ..., "$id": ...} and {"$date": ...}.
+    Requires Python 2.6 or simplejson.
+  * `bson` - documents in BSON, one after another, like mongodump
+    writes them. All BSON types are kept.
+
+Format and compression are taken from the file name, when they are
+not given: 'articles.bson', 'articles.jsonl.gz'.
+
+Documents keep their `_id` values, and references are written as
+collection name and id, so they point to the same documents, when
+referenced collections are imported as well.
+"""
+
+import datetime
+import gzip
+import struct
+import time
+
+try:
+    import json
+except ImportError:
+    try:
+        import simplejson as json
+    except ImportError:
+        json = None
+
+from pymongo import json_util
+from pymongo.bson import BSON
+
+JSONL = 'jsonl'
+BSON_FORMAT = 'bson'
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+class TransferStats(object):
+    """Number of documents and bytes, transferred by export or import."""
+
+    def __init__(self):
+        self.documents = 0
+        self.bytes = 0
+        self.started = time.time()
+        self.seconds = 0.0
+
+
+    def _update(self, documents, bytes):
+        self.documents += documents
+        self.bytes += bytes
+        self.seconds = time.time() - self.started
+
+
+    def _get_rate(self):
+        """Documents per second."""
+        if not self.seconds:
+            return 0.0
+        return self.documents / self.seconds
+    rate = property(_get_rate)
+
+
+    def __str__(self):
+        return '%d documents, %.1f MB in %.2f s (%.0f documents/s)' % (
+            self.documents, self.bytes / 1048576.0, self.seconds, self.rate)
+
+
+
+def _default(value):
+    if isinstance(value, datetime.datetime):
+        delta = value - _EPOCH
+        return {'$date': (delta.days * 86400 + delta.seconds) * 1000 +
+                         delta.microseconds / 1000}
+    return json_util.default(value)
+
+
+def _object_hook(value):
+    if '$date' in value:
+        return _EPOCH + datetime.timedelta(milliseconds = value['$date'])
+    return json_util.object_hook(value)
+
+
+def _guess(path, format, compress):
+    name = path
+    if name.endswith('.gz'):
+        name = name[:-3]
+        if compress is None:
+            compress = True
+
+    if format is None:
+        if name.endswith('.bson'):
+            format = BSON_FORMAT
+        else:
+            format = JSONL
+
+    if format not in (JSONL, BSON_FORMAT):
+        raise ValueError('unknown format %r' % format)
+    if format == JSONL and json is None:
+        raise NotImplementedError('jsonl format requires the json '
+                                  'module or simplejson')
+    return format, bool(compress)
+
+
+def _open(path, mode, compress):
+    if compress:
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+def _encode_jsonl(data):
+    return json.dumps(data, default = _default, separators = (',', ':')) + '\n'
+
+
+def _read_jsonl(file):
+    for line in file:
+        if line.strip():
+            yield len(line), json.loads(line, object_hook = _object_hook)
+
+
+def _read_bson(file):
+    while True:
+        header = file.read(4)
+        if not header:
+            break
+        if len(header) < 4:
+            raise ValueError('truncated BSON file')
+
+        size = struct.unpack('<i', header)[0]
+        body = file.read(size - 4)
+        if len(body) < size - 4:
+            raise ValueError('truncated BSON file')
+        yield size, BSON(header + body).to_dict()
+
+
+def export(manager, path, query, format, compress, progress, batch_size):
+    """Writes documents of the manager's collection, matching the
+       `query`, into the file. `progress(stats)` is called after
+       every `batch_size` documents and after the last ones.
+       Returns TransferStats."""
+    format, compress = _guess(path, format, compress)
+    if format == JSONL:
+        encode = _encode_jsonl
+    else:
+        encode = BSON.from_dict
+
+    stats = TransferStats()
+    file = _open(path, 'wb', compress)
+    try:
+        documents = bytes = 0
+        # driver's cursor, which doesn't keep or cache results
+        for data in manager._collection.find(query):
+            chunk = encode(data)
+            file.write(chunk)
+            documents += 1
+            bytes += len(chunk)
+
+            if documents >= batch_size:
+                stats._update(documents, bytes)
+                documents = bytes = 0
+                if progress is not None:
+                    progress(stats)
+        stats._update(documents, bytes)
+        if documents and progress is not None:
+            progress(stats)
+    finally:
+        file.close()
+    return stats
+
+
+def import_(manager, path, format, compress, progress, batch_size):
+    """Inserts documents from the file into the manager's collection,
+       with one insert per `batch_size` documents. `progress(stats)`
+       is called after every batch. Returns TransferStats."""
+    format, compress = _guess(path, format, compress)
+    if format == JSONL:
+        read = _read_jsonl
+    else:
+        read = _read_bson
+
+    stats = TransferStats()
+    file = _open(path, 'rb', compress)
+    try:
+        batch = []
+        bytes = 0
+        for size, data in read(file):
+            batch.append(data)
+            bytes += size
+
+            if len(batch) >= batch_size:
+                manager._instrumented('insert', None,
+                                      manager._collection.insert, batch)
+                stats._update(len(batch), bytes)
+                batch = []
+                bytes = 0
+                if progress is not None:
+                    progress(stats)
+
+        if batch:
+            manager._instrumented('insert', None,
+                                  manager._collection.insert, batch)
+        stats._update(len(batch), bytes)
+        if batch and progress is not None:
+            progress(stats)
+    finally:
+        file.close()
+
+    manager.invalidate()
+    return stats
@@ -0,0 +1,199 @@
+# This code is licensed under the New BSD License
+# 2009, Alexander Artemenko <svetlyak.40wt@gmail.com>
+# For other contacts, visit http://aartemenko.com
+
+"""
+Unit of work for buffered writes.
+
+Inside the `session` block, `save` and `remove` of documents don't go
+to the database. They are queued and sent together, when the block
+exits or when `size` documents are queued:
+
+>>> import mongobongo
+>>> with mongobongo.session() as s:
+...     for article in Article.objects.find({'author': 'bob'}):
+...         article.views += 1
+...         article.save()
+...     Comment(article = article, text = 'Hi').save()
+
+Several saves of the same document become one write, with fields of
+all of them. Writes are grouped per collection manager, so classes,
+which share the collection name, but are bound to different databases,
+write into their own ones: new documents are sent
+with one batched insert, removes with one `$in` query, and changes of
+loaded documents with one update per document. Ids for new documents
+are generated when they are queued, so they could be referenced
+before the flush.
+
+`find_one({'_id': id})` returns the queued document, or None for the
+removed one, so handlers read their own writes. Other queries go to
+the database and don't see queued writes.
+
+When the block exits with an exception, queued writes are discarded,
+and queued documents are left unsaved, as they were before `save`.
+The session queues writes of the thread, which entered it.
+Manager's methods, like `Article.objects.save(data)`, are not queued,
+except `save_many`, which queues dicts as documents of the class.
+"""
+
+from pymongo.objectid import ObjectId
+from mongobongo.context import thread_state
+
+DEFAULT_SIZE = 1000
+
+_INSERT, _SAVE, _UPDATE, _REMOVE = 'insert', 'save', 'update', 'remove'
+
+
+class Session(object):
+    """Queue of writes, keyed by (collection manager, _id). Writes
+       are flushed when `size` documents are queued."""
+
+    def __init__(self, size = DEFAULT_SIZE):
+        self.size = size
+        # (manager, _id) -> [document, operation, changed paths]
+        self._entries = {}
+        # keys in the order of queueing, could have dropped ones
+        self._order = []
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+    def _queue(self, key, doc, operation, paths = None):
+        self._entries[key] = [doc, operation, paths]
+        self._order.append(key)
+        if len(self._entries) >= self.size:
+            self.flush()
+
+
+    def save(self, doc):
+        """Queues the document, merging it with queued writes.
+           Should be called before the document is marked as saved."""
+        data = doc._data
+        if '_id' not in data:
+            data['_id'] = ObjectId()
+            self._queue((doc.objects, data['_id']), doc, _INSERT)
+            return
+
+        key = (doc.objects, data['_id'])
+        entry = self._entries.get(key)
+        if entry is None:
+            if not doc._persisted:
+                self._queue(key, doc, _SAVE)
+            elif doc._changed:
+                self._queue(key, doc, _UPDATE, set(doc._changed))
+            return
+
+        entry[0] = doc
+        if entry[1] == _REMOVE:
+            entry[1] = _SAVE
+        elif entry[1] == _UPDATE:
+            entry[2].update(doc._changed)
+
+
+    def remove(self, doc):
+        """Queues removal of the document, which has an `_id`."""
+        key = (doc.objects, doc._data['_id'])
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] == _INSERT:
+            # id was generated here, so it is not in the database
+            del self._entries[key]
+            doc.__dict__['_persisted'] = False
+        elif entry is not None:
+            entry[0:3] = [doc, _REMOVE, None]
+        else:
+            self._queue(key, doc, _REMOVE)
+
+
+    def get(self, manager, id):
+        """Returns (found, document) for the document, queued through
+           the collection manager. Document is None, when it is queued
+           for removal."""
+        entry = self._entries.get((manager, id))
+        if entry is None:
+            return False, None
+        if entry[1] == _REMOVE:
+            return True, None
+        return True, entry[0]
+
+
+    def flush(self):
+        """Sends all queued writes."""
+        from mongobongo.document import transform_docs_to_dbrefs
+
+        # unsaved documents, referenced by the flushed ones,
+        # are queued again while they are sent
+        while self._entries:
+            entries, order = self._entries, self._order
+            self._entries, self._order = {}, []
+
+            managers = []
+            operations = {}
+            for key in order:
+                entry = entries.pop(key, None)
+                if entry is None:
+                    continue
+                manager = key[0]
+                if manager not in operations:
+                    managers.append(manager)
+                    operations[manager] = {}
+                operations[manager].setdefault(entry[1], []).append(entry)
+
+            for manager in managers:
+                queued = operations[manager]
+                if _REMOVE in queued:
+                    manager.remove({'_id': {'$in': [doc._data['_id']
+                                                    for doc, operation, paths
+                                                    in queued[_REMOVE]]}})
+                if _INSERT in queued:
+                    batch = [transform_docs_to_dbrefs(doc._data)
+                             for doc, operation, paths in queued[_INSERT]]
+                    manager.insert(batch)
+                for doc, operation, paths in queued.get(_SAVE, ()):
+                    manager.save(doc._data)
+                for doc, operation, paths in queued.get(_UPDATE, ()):
+                    manager.save_changes(doc._data, paths)
+
+
+    def clear(self):
+        """Discards queued writes. Documents, which were queued for
+           saving, become unsaved again, so their next `save` sends
+           them."""
+        for doc, operation, paths in self._entries.itervalues():
+            if operation in (_INSERT, _SAVE):
+                doc.__dict__['_persisted'] = False
+            elif operation == _UPDATE:
+                doc._changed.update(paths)
+        self._entries.clear()
+        del self._order[:]
+
+
+    def __enter__(self):
+        thread_state.sessions.append(self)
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.flush()
+            else:
+                self.clear()
+        finally:
+            thread_state.sessions.remove(self)
+
+
+
+def session(size = DEFAULT_SIZE):
+    """Creates a new Session, to be used in the `with` statement."""
+    return Session(size)
+
+
+def get_session():
+    """Returns the innermost Session, active in the current
+       thread, or None."""
+    sessions = thread_state.sessions
+    if sessions:
+        return sessions[-1]
+    return None
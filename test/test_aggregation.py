@@ -0,0 +1,92 @@
+# This code is licensed under the New BSD License
+# 2009, Alexander Artemenko <svetlyak.40wt@gmail.com>
+# For other contacts, visit http://aartemenko.com
+
+import unittest
+
+from pymongo import DESCENDING
+from mongobongo import Document
+from mongobongo.aggregation import Pipeline
+from mongobongo.memory import MemoryDatabase
+
+
+class AggregatedArticle(Document):
+    collection = 'aggregated_articles'
+
+
+class AggregatedAuthor(Document):
+    collection = 'aggregated_authors'
+
+
+class AuthorStats(Document):
+    collection = 'author_stats'
+
+
+class AggregationTests(unittest.TestCase):
+    def setUp(self):
+        db = MemoryDatabase('test')
+        for cls in (AggregatedArticle, AggregatedAuthor, AuthorStats):
+            cls.objects.bind(db)
+
+        AggregatedAuthor(_id = 'bob', name = 'Bob').save()
+        AggregatedAuthor(_id = 'joe', name = 'Joe').save()
+        AggregatedArticle.objects.save_many([
+            dict(author = 'bob', votes = 3, tags = ['a', 'b'], published = True),
+            dict(author = 'bob', votes = 5, tags = ['b'], published = True),
+            dict(author = 'joe', votes = 1, tags = ['a'], published = True),
+            dict(author = 'joe', votes = 7, tags = [], published = False),
+        ])
+
+
+    def test_builder(self):
+        pipeline = Pipeline().match({'published': True}) \
+                             .group('$author', total = {'$sum': '$votes'}) \
+                             .sort('total', DESCENDING) \
+                             .limit(1)
+
+        self.assertEqual([{'$match': {'published': True}},
+                          {'$group': {'_id': '$author', 'total': {'$sum': '$votes'}}},
+                          {'$sort': {'total': DESCENDING}},
+                          {'$limit': 1}],
+                         pipeline.stages)
+        self.assertEqual([{'_id': 'bob', 'total': 8}],
+                         list(AggregatedArticle.objects.aggregate(pipeline)))
+
+
+    def test_output_class(self):
+        stats = list(AggregatedArticle.objects.pipeline(AuthorStats)
+                     .group('$author', articles = {'$sum': 1},
+                            best = {'$max': '$votes'})
+                     .sort('_id'))
+
+        self.assert_(isinstance(stats[0], AuthorStats))
+        self.assertEqual(['bob', 'joe'], [s._id for s in stats])
+        self.assertEqual([2, 2], [s.articles for s in stats])
+        self.assertEqual([5, 7], [s.best for s in stats])
+
+
+    def test_unwind_and_project(self):
+        tags = AggregatedArticle.objects.aggregate([
+            {'$unwind': '$tags'},
+            {'$group': {'_id': '$tags', 'count': {'$sum': 1}}},
+            {'$sort': {'_id': 1}},
+            {'$project': {'_id': 0, 'tag': '$_id', 'count': 1}},
+        ])
+        self.assertEqual([{'tag': 'a', 'count': 2}, {'tag': 'b', 'count': 2}],
+                         list(tags))
+
+
+    def test_lookup_returns_documents(self):
+        articles = list(AggregatedArticle.objects.pipeline()
+                        .match({'votes': {'$gt': 4}})
+                        .lookup(AggregatedAuthor, 'author', '_id', 'authors')
+                        .sort('votes'))
+
+        self.assertEqual(2, len(articles))
+        authors = articles[0]['authors']
+        self.assert_(isinstance(authors[0], AggregatedAuthor))
+        self.assertEqual(['Bob', 'Joe'], [a['authors'][0].name for a in articles])
+
+
+    def test_unbound_pipeline_is_not_iterable(self):
+        self.assertRaises(TypeError, iter, Pipeline().match({}))
@@ -0,0 +1,140 @@
+# This code is licensed under the New BSD License
+# 2009, Alexander Artemenko <svetlyak.40wt@gmail.com>
+# For other contacts, visit http://aartemenko.com
+
+import logging
+import threading
+import unittest
+
+from pymongo import ASCENDING
+from mongobongo import Document
+from mongobongo.asynchronous import Future, Executor, log
+from mongobongo.memory import MemoryDatabase
+
+
+class AsyncArticle(Document):
+    collection = 'async_articles'
+
+
+class AsyncAuthor(Document):
+    collection = 'async_authors'
+
+
+class FutureTests(unittest.TestCase):
+    def test_returns_result_and_calls_callbacks(self):
+        executor = Executor(workers = 1)
+        called = []
+
+        try:
+            future = executor.submit(lambda a, b: a + b, 1, b = 2)
+            self.assertEqual(3, future.result(timeout = 5))
+
+            future.add_done_callback(lambda f: called.append(f.result()))
+            self.assertEqual([3], called)
+        finally:
+            executor.shutdown()
+
+
+    def test_reraises_exception(self):
+        executor = Executor(workers = 1)
+        try:
+            future = executor.submit(lambda: {}['missing'])
+
+            self.assertRaises(KeyError, future.result, 5)
+            self.assert_(isinstance(future.exception(), KeyError))
+        finally:
+            executor.shutdown()
+
+
+    def test_callbacks_are_called_on_completion(self):
+        event = threading.Event()
+        future = Future()
+        future.add_done_callback(lambda f: event.set())
+
+        self.failIf(event.isSet())
+        future._complete(1)
+        self.assert_(event.isSet())
+
+
+    def test_callback_exceptions_are_logged(self):
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        log.addHandler(handler)
+
+        executor = Executor(workers = 1)
+        called = []
+        try:
+            gate = threading.Event()
+            future = executor.submit(gate.wait)
+            future.add_done_callback(lambda f: {}['missing'])
+            future.add_done_callback(lambda f: called.append(1))
+            gate.set()
+            future.result(5)
+
+            # the worker is still alive
+            self.assertEqual(2, executor.submit(lambda: 2).result(5))
+            future.add_done_callback(lambda f: {}['missing'])
+        finally:
+            executor.shutdown()
+            log.removeHandler(handler)
+
+        self.assertEqual([1], called)
+        self.assertEqual(2, len(records))
+        self.assertEqual(KeyError, records[0].exc_info[0])
+
+
+
+class AsyncManagerTests(unittest.TestCase):
+    def setUp(self):
+        AsyncArticle.objects.db = MemoryDatabase('test')
+
+
+    def test_save_and_find_one(self):
+        article = AsyncArticle(title = 'First')
+
+        self.assert_(article is AsyncArticle.async_objects.save(article).result(5))
+        self.assert_(article._id is not None)
+
+        found = AsyncArticle.async_objects.find_one({'title': 'First'}).result(5)
+        self.assertEqual(AsyncArticle, type(found))
+        self.assertEqual(article._id, found._id)
+
+
+    def test_cursor_to_list_and_each(self):
+        for title in ('c', 'a', 'b'):
+            AsyncArticle(title = title).save()
+
+        cursor = AsyncArticle.async_objects.all().sort('title', ASCENDING)
+        titles = [a.title for a in cursor.to_list().result(5)]
+        self.assertEqual(['a', 'b', 'c'], titles)
+
+        titles = []
+        AsyncArticle.async_objects.find({'title': {'$gt': 'a'}}) \
+            .each(lambda a: titles.append(a.title)).result(5)
+        self.assertEqual(['b', 'c'], sorted(titles))
+
+        self.assertEqual(3, AsyncArticle.async_objects.all().count().result(5))
+        self.assertEqual(2, len(AsyncArticle.async_objects.all().to_list(2).result(5)))
+
+
+    def test_load_reference(self):
+        author = AsyncAuthor(name = 'Alexander')
+        AsyncArticle(title = 'First', author = author).save()
+
+        article = AsyncArticle.objects.find_one()
+        AsyncArticle.async_objects.load_reference(article, 'author').result(5)
+
+        self.assert_(isinstance(article._data['author'], AsyncAuthor))
+        self.assertEqual('Alexander', article.author.name)
+
+
+    def test_remove(self):
+        article = AsyncArticle(title = 'First').save()
+        AsyncArticle(title = 'Second').save()
+
+        AsyncArticle.async_objects.remove(article).result(5)
+        self.assertEqual(1, AsyncArticle.objects.count())
+
+        AsyncArticle.async_objects.remove({}).result(5)
+        self.assertEqual(0, AsyncArticle.objects.count())
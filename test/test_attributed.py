@@ -53,6 +53,27 @@ class AttrDictTests(unittest.TestCase):
         self.assertEqual(2, a.iteritems().next()[1].b)
 
 
+    def test_inner_wrappers_are_cached(self):
+        d = {'meta': {'stats': {'views': 1}}}
+        a = AttributedDict(d)
+
+        self.assert_(a.meta is a.meta)
+        self.assert_(a.meta.stats is a.meta.stats)
+
+        stats = a.meta.stats
+        a.meta.stats = {'views': 2}
+        self.assert_(stats is not a.meta.stats)
+        self.assertEqual(2, a.meta.stats.views)
+
+        d['meta'] = {'stats': {'views': 3}}
+        self.assertEqual(3, a.meta.stats.views)
+
+
+    def test_has_no_instance_dict(self):
+        a = AttributedDict({})
+        self.failIf(hasattr(a, '__dict__'))
+
+
 class AttrListTests(unittest.TestCase):
     def test_attr_list_just_a_proxy(self):
         l = [{'b': 2}]
@@ -79,9 +100,52 @@ class AttrListTests(unittest.TestCase):
         self.assertEqual(l, al)
 
 
+    def test_inner_wrappers_are_cached(self):
+        l = [{'b': 2}, [1]]
+        al = AttributedList(l)
+
+        self.assert_(al[0] is al[0])
+        self.assert_(al[0] is al[-2])
+        self.assert_(al[1] is al[1])
+
+        first = al[0]
+        al[0] = {'b': 3}
+        self.assert_(first is not al[0])
+        self.assertEqual(3, al[0].b)
+
+
     def test_supports_iteration(self):
         l = [{'b': 2}]
         al = AttributedList(l)
 
         self.assertEqual(2, iter(al).next().b)
 
+
+
+class ChangeTrackingTests(unittest.TestCase):
+    def setUp(self):
+        self.changed = []
+
+    def test_reports_changed_paths(self):
+        d = {'a': {'b': {'c': 1}}, 'l': [{'x': 1}, {'x': 2}]}
+        a = AttributedDict(d, self.changed.append)
+
+        a.a.b.c = 2
+        a.l[1].x = 3
+        a.l[0] = {'y': 4}
+        del a.a.b
+        a.n = 5
+
+        self.assertEqual(['a.b.c', 'l.1.x', 'l.0', 'a.b', 'n'], self.changed)
+
+    def test_reports_unicode_paths(self):
+        name = u'\u0442\u0435\u0433\u0438'
+        a = AttributedDict({name: {'a': 1}}, self.changed.append)
+        for key, value in a.iteritems():
+            value.a = 2
+        self.assertEqual([name + u'.a'], self.changed)
+
+    def test_negative_list_indexes_are_normalized(self):
+        al = AttributedList([1, 2, 3], self.changed.append, 'l')
+        al[-1] = 4
+        self.assertEqual(['l.2'], self.changed)
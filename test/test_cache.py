@@ -0,0 +1,159 @@
+# This code is licensed under the New BSD License
+# 2009, Alexander Artemenko <svetlyak.40wt@gmail.com>
+# For other contacts, visit http://aartemenko.com
+
+from __future__ import with_statement
+
+import time
+import unittest
+
+from pymongo.errors import InvalidOperation
+from mongobongo import Document, using
+from mongobongo.cache import QueryCache
+from mongobongo.lazybson import LazyBSON
+from mongobongo.memory import MemoryDatabase
+
+
+class CachedArticle(Document):
+    collection = 'cached_articles'
+
+    class Meta:
+        cache_ttl = 60
+        cache_size = 2
+
+
+class CachedArticleView(Document):
+    collection = 'cached_articles'
+
+
+class QueryCacheTests(unittest.TestCase):
+    def test_key_does_not_depend_on_order_of_keys(self):
+        cache = QueryCache('test_cache', 60)
+        db = MemoryDatabase('test')
+        first = cache.make_key(db, {'a': 1, 'b': [1, {'c': 2, 'd': 3}]}, None, None, 0, 0)
+        second = cache.make_key(db, {'b': [1, {'d': 3, 'c': 2}], 'a': 1}, None, None, 0, 0)
+
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, cache.make_key(db, {'a': 1}, None, None, 0, 1))
+        self.assertNotEqual(first, cache.make_key(MemoryDatabase('test'),
+                                                  {'a': 1, 'b': [1, {'c': 2, 'd': 3}]},
+                                                  None, None, 0, 0))
+        self.assertNotEqual(first, cache.make_key(db, {'a': 1, 'b': [1, {'c': 2, 'd': 3}]},
+                                                  None, None, 0, 0, True))
+
+
+    def test_results_expire(self):
+        cache = QueryCache('test_cache', 0.01)
+        cache.set('key', [1])
+
+        self.assertEqual([1], cache.get('key'))
+        time.sleep(0.02)
+        self.assertEqual(None, cache.get('key'))
+
+
+
+class CachedQueriesTests(unittest.TestCase):
+    def setUp(self):
+        self.db = MemoryDatabase('test')
+        CachedArticle.objects.db = self.db
+        CachedArticle.objects.save_many(
+            dict(title = 'Article %d' % i, rank = i) for i in xrange(3))
+
+
+    def tearDown(self):
+        CachedArticle.objects.invalidate()
+
+
+    def titles(self, cursor):
+        return [article.title for article in cursor]
+
+
+    def test_same_query_is_sent_once(self):
+        queries = self.db.queries
+        hits = CachedArticle.objects.cache.hits
+        self.assertEqual(['Article 1'], self.titles(CachedArticle.objects.find({'rank': 1})))
+        self.assertEqual(['Article 1'], self.titles(CachedArticle.objects.find({'rank': 1})))
+        self.assertEqual('Article 1', CachedArticle.objects.find_one({'rank': 1}).title)
+
+        self.assertEqual(queries + 2, self.db.queries)
+        self.assertEqual(hits + 1, CachedArticle.objects.cache.hits)
+
+
+    def test_lazy_queries_are_cached_apart(self):
+        self.assertEqual(['Article 1'], self.titles(CachedArticle.objects.find({'rank': 1})))
+        articles = list(CachedArticle.objects.find({'rank': 1}).lazy())
+        self.assert_(isinstance(articles[0]._data, LazyBSON))
+        self.assertEqual('Article 1', articles[0].title)
+
+        articles = list(CachedArticle.objects.find({'rank': 1}))
+        self.failIf(isinstance(articles[0]._data, LazyBSON))
+
+
+    def test_databases_are_cached_apart(self):
+        CachedArticle.objects.db = None
+        first, second = MemoryDatabase('site1'), MemoryDatabase('site2')
+        with using(first):
+            CachedArticle(title = 'Site 1').save()
+        with using(second):
+            CachedArticle(title = 'Site 2').save()
+
+        for db, title in ((first, 'Site 1'), (second, 'Site 2'), (first, 'Site 1')):
+            with using(db):
+                self.assertEqual([title], self.titles(CachedArticle.objects.all()))
+
+
+    def test_sort_and_limit_are_part_of_the_key(self):
+        self.assertEqual(['Article 0', 'Article 1'],
+                         self.titles(CachedArticle.objects.all().sort('rank').limit(2)))
+        self.assertEqual(['Article 2', 'Article 1'],
+                         self.titles(CachedArticle.objects.all().sort('rank', -1).limit(2)))
+        self.assertEqual(3, len(CachedArticle.objects.all().sort('rank')))
+
+
+    def test_changes_of_documents_do_not_change_cache(self):
+        article = CachedArticle.objects.find_one({'rank': 1})
+        article.title = 'Changed'
+
+        self.assertEqual('Article 1', CachedArticle.objects.find_one({'rank': 1}).title)
+
+
+    def test_save_and_remove_invalidate_cache(self):
+        article = CachedArticle.objects.find_one({'rank': 1})
+        article.title = 'Changed'
+        article.save()
+        self.assertEqual('Changed', CachedArticle.objects.find_one({'rank': 1}).title)
+
+        article.remove()
+        self.assertEqual(None, CachedArticle.objects.find_one({'rank': 1}))
+
+
+    def test_update_and_insert_invalidate_cache(self):
+        self.assertEqual('Article 1', CachedArticle.objects.find_one({'rank': 1}).title)
+        CachedArticle.objects.update({'rank': 1}, {'$set': {'title': 'Changed'}})
+        self.assertEqual('Changed', CachedArticle.objects.find_one({'rank': 1}).title)
+
+        self.assertEqual(3, len(CachedArticle.objects.all()))
+        CachedArticle.objects.insert(dict(title = 'Article 3', rank = 3))
+        self.assertEqual(4, len(CachedArticle.objects.all()))
+
+
+    def test_writes_through_other_class_invalidate_cache(self):
+        self.assertEqual(3, len(CachedArticle.objects.all()))
+        CachedArticleView(title = 'Article 3', rank = 3).save()
+
+        self.assertEqual(4, len(CachedArticle.objects.all()))
+
+
+    def test_explicit_invalidation(self):
+        self.assertEqual(3, len(CachedArticle.objects.all()))
+        self.db[CachedArticle.objects.collection_name].remove({})
+        self.assertEqual(3, len(CachedArticle.objects.all()))
+
+        CachedArticle.objects.invalidate()
+        self.assertEqual(0, len(CachedArticle.objects.all()))
+
+
+    def test_cursor_options_cannot_change_after_query(self):
+        cursor = CachedArticle.objects.all()
+        cursor.next()
+        self.assertRaises(InvalidOperation, cursor.limit, 1)
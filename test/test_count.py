@@ -0,0 +1,91 @@
+# This code is licensed under the New BSD License
+# 2009, Alexander Artemenko <svetlyak.40wt@gmail.com>
+# For other contacts, visit http://aartemenko.com
+
+import unittest
+
+from mongobongo import Document
+from mongobongo.instrumentation import add_listener, remove_listener
+from mongobongo.memory import MemoryDatabase
+
+
+class CountedArticle(Document):
+    collection = 'counted_articles'
+
+
+class EstimatedArticle(Document):
+    collection = 'estimated_articles'
+
+    class Meta:
+        estimated_count = True
+
+
+class CountTests(unittest.TestCase):
+    def setUp(self):
+        self.db = MemoryDatabase('test')
+        CountedArticle.objects.db = self.db
+        CountedArticle.objects.save_many(dict(rank = i) for i in xrange(5))
+        EstimatedArticle.objects.save_many(dict(rank = i) for i in xrange(5))
+
+
+    def test_length_is_counted_once(self):
+        cursor = CountedArticle.objects.find({'rank': {'$gt': 1}})
+        queries = self.db.queries
+
+        self.assertEqual(3, len(cursor))
+        self.assertEqual(3, len(cursor))
+        self.assertEqual(queries + 1, self.db.queries)
+
+
+    def test_limit_and_skip_reset_length(self):
+        cursor = CountedArticle.objects.all()
+        self.assertEqual(5, len(cursor))
+        self.assertEqual(2, len(cursor.limit(2)))
+        self.assertEqual(1, len(cursor.skip(4)))
+
+
+    def test_estimated_count_of_unfiltered_cursor(self):
+        events = []
+        add_listener(events.append)
+        try:
+            queries = self.db.queries
+            self.assertEqual(5, len(EstimatedArticle.objects.all()))
+            self.assertEqual(queries + 1, self.db.queries)
+
+            self.assertEqual(2, len(EstimatedArticle.objects.find({'rank': {'$lt': 2}})))
+            self.assertEqual(queries + 2, self.db.queries)
+            self.assertEqual(5, CountedArticle.objects.estimated_count())
+        finally:
+            remove_listener(events.append)
+
+        self.assertEqual([{'collstats': 'estimated_articles'},
+                          {'rank': {'$lt': 2}},
+                          {'collstats': 'counted_articles'}],
+                         [event.query for event in events])
+
+
+    def test_exists(self):
+        self.assert_(CountedArticle.objects.exists({'rank': 3}))
+        self.failIf(CountedArticle.objects.exists({'rank': 10}))
+        self.assert_(CountedArticle.objects.all().exists())
+        self.failIf(CountedArticle.objects.all().skip(5).exists())
+
+        cursor = CountedArticle.objects.all()
+        len(cursor)
+        queries = self.db.queries
+        self.assert_(cursor.exists())
+        self.assertEqual(queries, self.db.queries)
+
+
+    def test_slices_reset_length(self):
+        cursor = CountedArticle.objects.all()
+        self.assertEqual(5, len(cursor))
+        self.assertEqual(3, len(cursor[0:3]))
+        self.assertEqual(2, len(CountedArticle.objects.all()[3:]))
+        self.assertEqual(3, len(EstimatedArticle.objects.all()[0:3]))
+        self.assertRaises(IndexError, lambda: CountedArticle.objects.all()[3:1])
+
+
+    def test_exists_of_slices(self):
+        self.assert_(CountedArticle.objects.all()[4:].exists())
+        self.failIf(CountedArticle.objects.all()[20:].exists())
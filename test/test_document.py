@@ -1,3 +1,5 @@
+from __future__ import with_statement
+
 import os
 import unittest
 
@@ -5,9 +7,14 @@ from pdb import set_trace
 from pymongo import DESCENDING, ASCENDING
 from pymongo.connection import Connection
 from pymongo.database import Database
+from pymongo.errors import InvalidOperation
 
-from mongobongo.document import Document, get_doc_class_for_collection
+from mongobongo.document import Document, get_doc_class_for_collection, \
+                                _collapse_paths
 from mongobongo.attributed import AttributedDict
+from mongobongo.identity import identity_map
+from mongobongo.instrumentation import add_listener, remove_listener
+from mongobongo.fields import Field, Reference, Embedded
 
 
 
@@ -24,6 +31,11 @@ class TestDoc(Document):
         return 'http://svetlyak.ru'
 
 
+class DeclaredDoc(Document):
+    collection = 'test_docs'
+    fields = ('user', Embedded('meta'), Reference('author'))
+
+
 class OrderedDoc(Document):
     collection = 'test_docs'
     class Meta:
@@ -170,6 +182,232 @@ class Documents(unittest.TestCase):
 
         self.assertEqual('alex', OrderedDoc.objects.find_one().user)
 
+    def test_save_many(self):
+        existing = TestDoc(user = 'olga').save()
+        existing.user = 'olga k.'
+
+        docs = [TestDoc(user = 'vasily'), {'user': 'alex'}, existing, TestDoc(user = 'zuger')]
+        ids = TestDoc.objects.save_many(docs, batch_size = 2)
+
+        self.assertEqual(4, len(ids))
+        self.assertEqual(docs[0]._id, ids[0])
+        self.assertEqual(docs[1]['_id'], ids[1])
+        self.assertEqual(existing._id, ids[2])
+        self.assertEqual(docs[3]._id, ids[3])
+
+        self.assertEqual(4, TestDoc.objects.count())
+        self.assertEqual('olga k.', TestDoc.objects.find_one({'_id': existing._id}).user)
+
+    def test_partial_update_of_changed_fields(self):
+        doc = TestDoc(author = dict(name = 'Alexander', city = 'Moscow'),
+                      tags = ['one'], views = 1).save()
+        doc = TestDoc.objects.find_one()
+
+        # somebody else changes the document meanwhile
+        TestDoc.objects.update({'_id': doc._id}, {'$set': {'views': 100}})
+
+        doc.author.city = 'Berlin'
+        doc.tags.append('two')
+        del doc.author.name
+        doc.save()
+
+        doc = TestDoc.objects.find_one()
+        self.assertEqual(dict(city = 'Berlin'), doc.author)
+        self.assertEqual(['one', 'two'], doc.tags)
+        self.assertEqual(100, doc.views)
+
+    def test_save_without_changes_is_skipped(self):
+        doc = TestDoc(views = 1).save()
+        TestDoc.objects.update({'_id': doc._id}, {'$set': {'views': 100}})
+
+        doc.save()
+        self.assertEqual(100, TestDoc.objects.find_one().views)
+
+        doc.update({'views': 2})
+        doc.save()
+        self.assertEqual(2, TestDoc.objects.find_one().views)
+
+    def test_changed_paths_are_collapsed(self):
+        doc = TestDoc(author = dict(name = 'Alexander'))
+        doc.author.name = 'Alex'
+        doc.author = dict(nick = 'art')
+
+        self.assertEqual(set(['author', 'author.name']), doc._changed)
+        self.assertEqual(['author'], _collapse_paths(doc._changed))
+
+
+    def test_only_fetches_given_fields(self):
+        TestDoc(user = 'alex', body = 'Long text', tags = ['one']).save()
+        TestDoc(user = 'olga', body = 'Another text', tags = ['two']).save()
+
+        docs = list(TestDoc.objects.only('user').sort('user', ASCENDING))
+
+        self.assertEqual('alex', docs[0].user)
+        self.assert_('body' not in docs[0]._data)
+        self.assert_('body' not in docs[1]._data)
+
+        # deferred field is loaded for the whole batch at once
+        self.assertEqual('Long text', docs[0].body)
+        self.assertEqual('Another text', docs[1]._data['body'])
+        self.assertEqual(['two'], docs[1]['tags'])
+
+    def test_find_one_with_only(self):
+        TestDoc(user = 'alex', body = 'Long text').save()
+
+        doc = TestDoc.objects.find_one({'user': 'alex'}, only = ['user'])
+        self.assertEqual(set(['_id', 'user']), set(doc._data))
+        self.assertEqual(None, doc.missing)
+        self.assertEqual('Long text', doc.body)
+
+    def test_save_of_partially_loaded_document_keeps_other_fields(self):
+        TestDoc(user = 'alex', body = 'Long text').save()
+
+        doc = TestDoc.objects.only('user')[0]
+        doc.user = 'alexander'
+        doc.save()
+
+        doc = TestDoc.objects.find_one()
+        self.assertEqual('alexander', doc.user)
+        self.assertEqual('Long text', doc.body)
+
+
+    def test_partially_fetched_subdocument_is_not_overwritten(self):
+        TestDoc(author = dict(name = 'Alexander', city = 'Moscow'),
+                tags = ['one']).save()
+
+        doc = TestDoc.objects.only('author.name')[0]
+        self.assertEqual(dict(name = 'Alexander'), doc._data['author'])
+        doc.author.name = 'Alex'
+        doc.save()
+
+        doc['author']
+        self.assertRaises(InvalidOperation, doc.save)
+        self.assertRaises(InvalidOperation, TestDoc.objects.save_many, [doc])
+
+        doc = TestDoc.objects.find_one()
+        self.assertEqual(dict(name = 'Alex', city = 'Moscow'), doc.author)
+
+        doc = TestDoc.objects.only('author.name')[0]
+        doc.author = dict(name = 'Art')
+        doc.save()
+        self.assertEqual(dict(name = 'Art'), TestDoc.objects.find_one().author)
+        self.assertEqual(['one'], TestDoc.objects.find_one().tags)
+
+
+    def test_assigned_deferred_field_is_not_overwritten_by_batch_load(self):
+        TestDoc(user = 'alex', body = 'Long text').save()
+        TestDoc(user = 'olga', body = 'Another text').save()
+
+        docs = list(TestDoc.objects.only('user').sort('user', ASCENDING))
+        docs[0].body = 'edited'
+        del docs[1].tags
+        docs[0].update(dict(tags = ['new']))
+
+        # loads `body` for the batch, except the assigned one
+        self.assertEqual('Another text', docs[1].body)
+        self.assertEqual('edited', docs[0].body)
+        self.assertEqual(['new'], docs[0]._data['tags'])
+        docs[0].save()
+
+        doc = TestDoc.objects.find_one({'user': 'alex'})
+        self.assertEqual('edited', doc.body)
+        self.assertEqual(['new'], doc.tags)
+
+
+    def test_declared_fields(self):
+        self.assert_(isinstance(DeclaredDoc._meta.fields['meta'], Embedded))
+        self.assert_(isinstance(DeclaredDoc.__dict__['user'], property))
+
+        DeclaredDoc(user = 'alex', meta = dict(views = 1), other = dict(a = 1)).save()
+        doc = DeclaredDoc.objects.find_one()
+
+        self.assertEqual('alex', doc.user)
+        self.assertEqual(1, doc.meta.views)
+        self.assertEqual(1, doc.other.a)
+        self.assertEqual(None, doc.author)
+        self.assertEqual(None, doc.missing)
+
+        doc.meta.views = 2
+        doc.user = 'alexander'
+        self.assertEqual(set(['meta.views', 'user']), doc._changed)
+        doc.save()
+
+        doc = DeclaredDoc.objects.find_one()
+        self.assertEqual('alexander', doc.user)
+        self.assertEqual(2, doc.meta.views)
+
+    def test_declared_fields_track_lists_and_dicts(self):
+        DeclaredDoc(user = ['a'], meta = dict(views = 1)).save()
+
+        doc = DeclaredDoc.objects.find_one()
+        doc.user.append('b')
+        self.assertEqual(set(['user']), doc._changed)
+        doc.save()
+        self.assertEqual(['a', 'b'], DeclaredDoc.objects.find_one().user)
+
+        DeclaredDoc.objects.remove()
+        DeclaredDoc(user = dict(name = 'alex')).save()
+        doc = DeclaredDoc.objects.find_one()
+        doc.user['name'] = 'alexander'
+        doc.save()
+        self.assertEqual(dict(name = 'alexander'),
+                         DeclaredDoc.objects.find_one().user)
+
+    def test_declared_fields_can_be_deferred(self):
+        DeclaredDoc(user = 'alex', meta = dict(views = 1)).save()
+
+        doc = DeclaredDoc.objects.find_one(only = ['meta'])
+        self.assert_('user' not in doc._data)
+        self.assertEqual('alex', doc.user)
+
+    def test_defer_fetches_declared_fields(self):
+        DeclaredDoc(user = 'alex', meta = dict(views = 1), other = 'text').save()
+
+        doc = DeclaredDoc.objects.find_one(defer = ['meta'])
+        self.assertEqual(set(['_id', 'user']), set(doc._data))
+        self.assertEqual(1, doc.meta.views)
+        self.assertEqual('text', doc.other)
+
+        self.assertRaises(InvalidOperation, TestDoc.objects.find_one,
+                          defer = ['body'])
+        self.assertRaises(InvalidOperation, DeclaredDoc.objects.defer, 'meta.views')
+
+    def test_driver_takes_only_list_of_fields(self):
+        self.assertRaises(TypeError, TestDoc.objects._collection.find,
+                          {}, {'body': 0})
+
+
+    def test_iter_batches(self):
+        TestDoc.objects.save_many(TestDoc(n = i) for i in range(5))
+
+        cursor = TestDoc.objects.all().sort('n', ASCENDING).batch_size(2)
+        batches = [[doc.n for doc in batch] for batch in cursor.iter_batches()]
+        self.assertEqual([[0, 1], [2, 3], [4]], batches)
+
+        batches = list(TestDoc.objects.all().iter_batches(3))
+        self.assertEqual([3, 2], [len(batch) for batch in batches])
+        self.assertEqual(TestDoc, type(batches[1][0]))
+
+
+    def test_raw_cursor_returns_dicts(self):
+        for name in ['vasily', 'alex', 'olga']:
+            OrderedDoc(user = name).save()
+
+        docs = list(OrderedDoc.objects.all().raw())
+        self.assertEqual(dict, type(docs[0]))
+        self.assertEqual(['alex', 'olga', 'vasily'], [doc['user'] for doc in docs])
+
+        self.assertEqual(dict, type(OrderedDoc.objects.find(as_dict = True)[0]))
+
+        doc = OrderedDoc.objects.find_one({'user': 'olga'}, as_dict = True)
+        self.assertEqual(dict, type(doc))
+        self.assertEqual('olga', doc['user'])
+
+        batches = list(OrderedDoc.objects.all().raw().only('user').iter_batches(2))
+        self.assertEqual(dict, type(batches[0][0]))
+        self.assertEqual('vasily', batches[1][0]['user'])
+
+
 
 
 
@@ -181,6 +419,11 @@ class Author(Document):
     collection = 'authors'
 
 
+class Comment(Document):
+    collection = 'comments'
+    fields = ('text', Reference('author'))
+
+
 class References(unittest.TestCase):
     def setUp(self):
         db = Database(get_connection(), "pymongo_test")
@@ -188,6 +431,7 @@ class References(unittest.TestCase):
         Article.objects.db = db
         Article.objects.remove()
         Author.objects.remove()
+        Comment.objects.remove()
 
     def testDocClassAutoregistration(self):
         self.assertEqual(Article, get_doc_class_for_collection('articles'))
@@ -215,3 +459,139 @@ class References(unittest.TestCase):
         article.save()
         self.assert_(author._id is not None)
 
+
+
+    def testSaveDoesNotChangeCallersData(self):
+        author = Author(name = 'Alexander')
+        meta = {'editor': author, 'tags': [author]}
+        article = Article(title = 'Life is miracle', meta = meta)
+        article.save()
+
+        self.assert_(article._data['meta'] is meta)
+        self.assert_(meta['editor'] is author)
+        self.assert_(meta['tags'][0] is author)
+
+        data = Article.objects.find_one(as_dict = True)
+        self.assertEqual(author._id, data['meta']['editor'].id)
+        self.assertEqual(author._id, data['meta']['tags'][0].id)
+
+
+    def testSaveSharedAndCyclicReferences(self):
+        alex = Author(name = 'Alexander')
+        olga = Author(name = 'Olga', friend = alex)
+        alex.friend = olga
+        article = Article(title = 'Life is miracle',
+                          authors = [alex, olga], editor = alex)
+
+        events = []
+        add_listener(events.append)
+        try:
+            article.save()
+        finally:
+            remove_listener(events.append)
+
+        self.assertEqual([('insert', 'authors'), ('save', 'articles')],
+                         [(event.operation, event.collection) for event in events])
+        self.assertEqual(2, len([author for author in Author.objects.all()]))
+
+        article = Article.objects.find_one()
+        self.assertEqual('Olga', article.editor.friend.name)
+        olga = Article.objects.dereference(article.authors[1])
+        self.assertEqual('Alexander', olga.friend.name)
+
+
+    def testSaveInsertsReferencedDocumentsFirst(self):
+        # authors -> articles -> authors
+        editor = Author(name = 'Olga')
+        review = Article(title = 'Review', editor = editor)
+        author = Author(name = 'Alexander', review = review)
+        article = Article(title = 'Life is miracle', author = author)
+
+        events = []
+        add_listener(events.append)
+        try:
+            article.save()
+        finally:
+            remove_listener(events.append)
+
+        self.assertEqual([('insert', 'authors'), ('insert', 'articles'),
+                          ('insert', 'authors'), ('save', 'articles')],
+                         [(event.operation, event.collection) for event in events])
+        self.assertEqual('Olga', Article.objects.find_one({'title': 'Life is miracle'})
+                                        .author.review.editor.name)
+
+
+    def testSaveCycleThroughRoot(self):
+        author = Author(name = 'Alexander')
+        article = Article(title = 'Life is miracle', author = author)
+        author.favorite = article
+        article.save()
+
+        self.assertEqual(1, len([article for article in Article.objects.all()]))
+        author = Author.objects.find_one()
+        self.assertEqual('Life is miracle', author.favorite.title)
+
+
+    def testPrefetchReferences(self):
+        alex = Author(name = 'Alexander').save()
+        olga = Author(name = 'Olga').save()
+
+        Article(title = 'First', author = alex).save()
+        Article(title = 'Second', author = olga).save()
+        Article(title = 'Third', author = alex).save()
+
+        articles = list(Article.objects.all().sort('title', ASCENDING).prefetch('author'))
+
+        self.assertEqual(3, len(articles))
+        for article in articles:
+            self.assert_(isinstance(article._data['author'], Author))
+        self.assertEqual('Alexander', articles[0].author.name)
+        self.assertEqual('Olga', articles[1].author.name)
+
+
+    def testPrefetchNestedReferences(self):
+        alex = Author(name = 'Alexander').save()
+        olga = Author(name = 'Olga').save()
+
+        Article(title = 'First', comments = [
+            dict(text = 'Great!', user = alex),
+            dict(text = 'Indeed', user = olga),
+        ]).save()
+
+        article = Article.objects.all().prefetch('comments.user')[0]
+        comments = article._data['comments']
+
+        self.assert_(isinstance(comments[0]['user'], Author))
+        self.assertEqual('Olga', comments[1]['user'].name)
+
+
+    def testIdentityMapReusesDereferencedDocuments(self):
+        author = Author(name = 'Alexander').save()
+        Article(title = 'First', author = author).save()
+        Article(title = 'Second', author = author).save()
+
+        with identity_map() as imap:
+            first, second = [a.author for a in Article.objects.all()]
+
+        self.assert_(first is second)
+        self.assertEqual(1, imap.hits)
+        self.assertEqual(1, imap.misses)
+
+
+    def testDeclaredReferenceField(self):
+        Comment(text = 'First', author = Author(name = 'Alexander')).save()
+        comment = Comment.objects.find_one()
+
+        self.assertEqual(Author, type(comment.author))
+        self.assertEqual('Alexander', comment.author.name)
+
+
+    def testIterBatchesPrefetchesReferences(self):
+        author = Author(name = 'Alexander').save()
+        for title in ('First', 'Second', 'Third'):
+            Article(title = title, author = author).save()
+
+        cursor = Article.objects.all().prefetch('author')
+        for batch in cursor.iter_batches(2):
+            for article in batch:
+                self.assert_(isinstance(article._data['author'], Author))
@@ -0,0 +1,79 @@
+# This code is licensed under the New BSD License
+# 2009, Alexander Artemenko <svetlyak.40wt@gmail.com>
+# For other contacts, visit http://aartemenko.com
+
+from __future__ import with_statement
+
+import unittest
+from mongobongo.lru import LRUCache
+from mongobongo.identity import identity_map, get_identity_map
+
+
+class Doc(object):
+    def __init__(self, _id):
+        self._id = _id
+
+
+class LRUCacheTests(unittest.TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assert_('a' in cache)
+        self.assert_('b' not in cache)
+        self.assert_('c' in cache)
+        self.assertEqual(2, len(cache))
+
+
+    def test_counts_hits_and_misses(self):
+        cache = LRUCache(10)
+        cache.set('a', 1)
+
+        self.assertEqual(1, cache.get('a'))
+        self.assertEqual(None, cache.get('b'))
+        self.assertEqual(1, cache.hits)
+        self.assertEqual(1, cache.misses)
+
+
+    def test_keys_are_ordered_by_usage(self):
+        cache = LRUCache(10)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.set('c', 3)
+        cache.get('a')
+
+        self.assertEqual(['a', 'c', 'b'], cache.keys())
+
+        cache.pop('c')
+        self.assertEqual(['a', 'b'], cache.keys())
+
+
+class IdentityMapTests(unittest.TestCase):
+    def test_is_active_only_inside_the_block(self):
+        self.assertEqual(None, get_identity_map())
+
+        with identity_map() as outer:
+            self.assertEqual(outer, get_identity_map())
+            with identity_map() as inner:
+                self.assertEqual(inner, get_identity_map())
+            self.assertEqual(outer, get_identity_map())
+
+        self.assertEqual(None, get_identity_map())
+
+
+    def test_returns_same_instance(self):
+        doc = Doc(1)
+
+        with identity_map(size = 1) as imap:
+            imap.add('docs', doc)
+            self.assert_(imap.get('docs', 1) is doc)
+            self.assertEqual(None, imap.get('other', 1))
+
+            imap.add('docs', Doc(2))
+            self.assertEqual(None, imap.get('docs', 1))
+
+        self.assertEqual(1, imap.hits)
+        self.assertEqual(2, imap.misses)
@@ -0,0 +1,120 @@
+# This code is licensed under the New BSD License
+# 2009, Alexander Artemenko <svetlyak.40wt@gmail.com>
+# For other contacts, visit http://aartemenko.com
+
+from __future__ import with_statement
+
+import unittest
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import ConfigurationError
+from mongobongo import Document, Index, indexes
+from mongobongo.indexes import advise_indexes, query_shape, is_supported
+from mongobongo.memory import MemoryDatabase
+
+
+class IndexedArticle(Document):
+    collection = 'indexed_articles'
+
+    class Meta:
+        ordering = [('created', DESCENDING)]
+        indexes = ('author',
+                   [('tags', ASCENDING), ('created', DESCENDING)],
+                   Index('slug', unique = True),
+                   Index('expires'))
+
+
+class UnindexedArticle(Document):
+    collection = 'unindexed_articles'
+
+
+class IndexTests(unittest.TestCase):
+    def setUp(self):
+        self.db = MemoryDatabase('test')
+        IndexedArticle.objects.bind(self.db)
+        UnindexedArticle.objects.bind(self.db)
+        UnindexedArticle(_id = 1, title = 'first', rank = 1).save()
+
+
+    def test_indexes_are_parsed(self):
+        indexes = IndexedArticle._meta.indexes
+        self.assertEqual([[('author', ASCENDING)],
+                          [('tags', ASCENDING), ('created', DESCENDING)],
+                          [('slug', ASCENDING)],
+                          [('expires', ASCENDING)]],
+                         [index.keys for index in indexes])
+        self.assertEqual([], UnindexedArticle._meta.indexes)
+
+
+    def test_indexes_are_ensured_on_first_use(self):
+        collection = self.db[IndexedArticle.objects.collection_name]
+        self.assertEqual(['_id_'], collection.index_information().keys())
+
+        IndexedArticle(slug = 'first').save()
+
+        self.assertEqual(5, len(collection.index_information()))
+        self.assertEqual(dict(unique = True), collection._index_options['slug_1'])
+        self.assertEqual(dict(unique = False), collection._index_options['expires_1'])
+
+
+    def test_index_options_depend_on_driver(self):
+        if indexes._INDEX_OPTIONS_SUPPORTED:
+            index = Index('expires', sparse = True, ttl = 3600)
+            self.assertEqual(dict(unique = False, sparse = True,
+                                  expireAfterSeconds = 3600),
+                             index.options())
+        else:
+            self.assertRaises(ConfigurationError, Index, 'expires', ttl = 3600)
+            self.assertRaises(ConfigurationError, Index, 'expires', sparse = True)
+
+
+    def test_indexes_are_ensured_once_per_database(self):
+        IndexedArticle(slug = 'first').save()
+        collection = self.db[IndexedArticle.objects.collection_name]
+        collection.drop_indexes()
+
+        IndexedArticle.objects.find_one()
+        self.assertEqual(['_id_'], collection.index_information().keys())
+
+        other = MemoryDatabase('other')
+        IndexedArticle.objects.bind(other)
+        IndexedArticle.objects.find_one()
+        self.assertEqual(5, len(other[IndexedArticle.objects.collection_name]
+                                .index_information()))
+
+
+    def test_query_shape(self):
+        self.assertEqual((('author', 'tags'), ('created',), ('title',)),
+                         query_shape({'author': 'bob',
+                                      'tags': {'$in': ['a']},
+                                      'created': {'$gt': 1},
+                                      '$or': [{'a': 1}]},
+                                     (([('title', ASCENDING)],), {})))
+        self.assertEqual(((), (), ('rank',)), query_shape({}, (('rank', -1), {})))
+
+
+    def test_is_supported(self):
+        self.assert_(is_supported((('author',), (), ()), ['author', 'created']))
+        self.failIf(is_supported((('author',), (), ()), ['created', 'author']))
+        self.assert_(is_supported(((), (), ('created',)), ['created']))
+        self.failIf(is_supported((('author',), (), ('created',)), ['created']))
+
+
+    def test_advisor(self):
+        with advise_indexes() as advisor:
+            IndexedArticle.objects.find_one({'author': 'bob'})
+            IndexedArticle.objects.find_one({'title': 'first'})
+            IndexedArticle.objects.find_one({'title': 'second'})
+            len(IndexedArticle.objects.all())
+            UnindexedArticle.objects.find_one({'_id': 1})
+            UnindexedArticle.objects.all().sort('rank').next()
+        UnindexedArticle.objects.find_one({'title': 'after'})
+
+        missing = [(cls, shape, count) for cls, shape, count in advisor.missing()]
+        self.assertEqual(
+            sorted([(IndexedArticle, (('title',), (), ('created',)), 2),
+                    (IndexedArticle, ((), (), ('created',)), 1),
+                    (UnindexedArticle, ((), (), ('rank',)), 1)]),
+            sorted(missing))
+        self.assert_('IndexedArticle: 2 queries without index, '
+                     'fields title, ranges -, sorted by created' in advisor.report())
@@ -0,0 +1,133 @@
+# This code is licensed under the New BSD License
+# 2009, Alexander Artemenko <svetlyak.40wt@gmail.com>
+# For other contacts, visit http://aartemenko.com
+
+from __future__ import with_statement
+
+import threading
+import unittest
+import warnings
+
+from mongobongo import Document
+from mongobongo.instrumentation import add_listener, remove_listener, \
+                                       QueryStats, NPlusOneWarning, \
+                                       track_dereferences
+from mongobongo.memory import MemoryDatabase
+
+
+class InstrumentedArticle(Document):
+    collection = 'instrumented_articles'
+
+
+class InstrumentedAuthor(Document):
+    collection = 'instrumented_authors'
+
+
+class InstrumentationTests(unittest.TestCase):
+    def setUp(self):
+        InstrumentedArticle.objects.db = MemoryDatabase('test')
+        self.events = []
+        add_listener(self.events.append)
+
+
+    def tearDown(self):
+        remove_listener(self.events.append)
+
+
+    def operations(self):
+        return [event.operation for event in self.events]
+
+
+    def test_reports_manager_queries(self):
+        article = InstrumentedArticle(title = 'first').save()
+        article.title = 'changed'
+        article.save()
+        InstrumentedArticle.objects.find_one({'title': 'changed'})
+        [a for a in InstrumentedArticle.objects.find({'title': 'changed'})]
+        len(InstrumentedArticle.objects.all())
+        InstrumentedArticle.objects.remove({'title': 'changed'})
+
+        self.assertEqual(['save', 'update', 'find_one', 'find', 'count', 'remove'],
+                         self.operations())
+
+        event = self.events[2]
+        self.assertEqual(InstrumentedArticle, event.doc_class)
+        self.assertEqual('instrumented_articles', event.collection)
+        self.assertEqual({'title': 'changed'}, event.query)
+        self.assert_(event.duration >= 0)
+
+
+    def test_query_stats(self):
+        stats = QueryStats()
+        add_listener(stats)
+        try:
+            InstrumentedArticle.objects.save_many(dict(title = str(i)) for i in xrange(3))
+            [a for a in InstrumentedArticle.objects.all()]
+            [a for a in InstrumentedArticle.objects.all()]
+        finally:
+            remove_listener(stats)
+
+        self.assertEqual(2, stats.counts[('InstrumentedArticle', 'find')])
+        self.assertEqual(1, stats.counts[('InstrumentedArticle', 'insert')])
+        self.assert_('InstrumentedArticle' in stats.report())
+
+
+    def test_lazy_dereferences_are_marked(self):
+        author = InstrumentedAuthor(name = 'bob').save()
+        InstrumentedArticle(title = 'first', author = author).save()
+        del self.events[:]
+
+        article = InstrumentedArticle.objects.find_one()
+        self.assertEqual('bob', article.author.name)
+
+        event = self.events[-1]
+        self.assertEqual('dereference', event.operation)
+        self.assertEqual('instrumented_authors', event.collection)
+        self.assertEqual('author', event.field)
+        self.assert_(event.lazy)
+
+
+    def test_detects_n_plus_one(self):
+        author = InstrumentedAuthor(name = 'bob').save()
+        InstrumentedArticle.objects.save_many(
+            dict(title = str(i), author = author) for i in xrange(5))
+
+        caught = []
+        def showwarning(message, category, filename, *args, **kwargs):
+            caught.append((category, filename))
+
+        original_showwarning = warnings.showwarning
+        original_filters = warnings.filters[:]
+        warnings.showwarning = showwarning
+        warnings.simplefilter('always')
+        try:
+            with track_dereferences(threshold = 3) as tracker:
+                for article in InstrumentedArticle.objects.all():
+                    article.author.name
+
+                # dereferences of other threads are not counted
+                thread = threading.Thread(target = lambda:
+                    [article.author for article in InstrumentedArticle.objects.all()])
+                thread.start()
+                thread.join()
+
+            with track_dereferences(threshold = 3) as prefetched:
+                for article in InstrumentedArticle.objects.all().prefetch('author'):
+                    article.author.name
+        finally:
+            warnings.showwarning = original_showwarning
+            warnings.filters[:] = original_filters
+
+        self.assertEqual(5, tracker.count)
+        self.assertEqual({('InstrumentedArticle', 'author'): 5}, tracker.by_field)
+        self.assertEqual([(NPlusOneWarning, __file__.replace('.pyc', '.py'))],
+                         caught)
+        self.assertEqual(0, prefetched.count)
+
+
+    def test_listeners_are_not_called_after_removal(self):
+        remove_listener(self.events.append)
+        InstrumentedArticle(title = 'first').save()
+        add_listener(self.events.append)
+
+        self.assertEqual([], self.events)
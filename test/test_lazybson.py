@@ -0,0 +1,215 @@
+# This code is licensed under the New BSD License
+# 2009, Alexander Artemenko <svetlyak.40wt@gmail.com>
+# For other contacts, visit http://aartemenko.com
+
+import datetime
+import re
+import struct
+import unittest
+
+from pymongo.binary import Binary
+from pymongo.bson import BSON
+from pymongo.code import Code
+from pymongo.dbref import DBRef
+from pymongo.objectid import ObjectId
+from mongobongo import Document
+from mongobongo.lazybson import LazyBSON, LazyCursor
+from mongobongo.memory import MemoryDatabase
+
+
+class LazyArticle(Document):
+    collection = 'lazy_articles'
+
+
+class LazyAuthor(Document):
+    collection = 'lazy_authors'
+
+
+class LazyBSONTests(unittest.TestCase):
+    def setUp(self):
+        self.data = dict(_id = ObjectId(),
+                         title = u'Title',
+                         rank = 3,
+                         big = 2 ** 40,
+                         rating = 4.5,
+                         published = True,
+                         nothing = None,
+                         created = datetime.datetime(2009, 11, 1, 12, 30),
+                         pattern = re.compile('^a'),
+                         binary = Binary('\x00\x01'),
+                         code = Code('function () {}'),
+                         author = DBRef('authors', ObjectId()),
+                         tags = ['a', 'b'],
+                         meta = dict(views = 10, votes = [1, 2]))
+        self.bson = BSON.from_dict(self.data)
+
+
+    def test_decodes_every_type(self):
+        lazy = LazyBSON(self.bson)
+        expected = BSON(self.bson).to_dict()
+
+        for name in reversed(expected.keys()):
+            self.assertEqual(expected[name], lazy[name])
+        self.assertEqual(sorted(expected.keys()), sorted(lazy.keys()))
+        self.assertEqual(expected, lazy.to_dict())
+
+
+    def test_changes(self):
+        lazy = LazyBSON(self.bson)
+        lazy['title'] = u'Changed'
+        lazy['new'] = 1
+        del lazy['rank']
+
+        self.assertEqual(u'Changed', lazy['title'])
+        self.failIf('rank' in lazy)
+        self.assertRaises(KeyError, lazy.__getitem__, 'rank')
+        self.assertEqual(1, lazy.get('new'))
+        self.assertEqual(None, lazy.get('missing'))
+
+        data = lazy.to_dict()
+        self.assertEqual(u'Changed', data['title'])
+        self.failIf('rank' in data)
+        self.assertEqual(len(self.data), len(lazy))
+
+
+
+class Response(object):
+    """Fake connection, which returns given documents in batches."""
+
+    def __init__(self, docs, batch):
+        self.docs = [BSON.from_dict(doc) for doc in docs]
+        self.batch = batch
+        self.messages = []
+        self.closed = []
+
+    def _send_message_with_response(self, operation, message):
+        self.messages.append((operation, message))
+        docs, self.docs = self.docs[:self.batch], self.docs[self.batch:]
+        cursor_id = self.docs and 42 or 0
+        header = struct.pack('<iqii', 0, cursor_id, 0, len(docs))
+        return header + ''.join(docs)
+
+    def close_cursor(self, cursor_id):
+        self.closed.append(cursor_id)
+
+
+class MasterSlaveResponse(Response):
+    """Fake master-slave connection, which returns id of the
+       connection, which got the message."""
+
+    def __init__(self, docs, batch):
+        Response.__init__(self, docs, batch)
+        self.connections = []
+
+    def _send_message_with_response(self, operation, message,
+                                    _connection_to_use = None):
+        self.connections.append(_connection_to_use)
+        response = Response._send_message_with_response(self, operation, message)
+        return _connection_to_use or 3, response
+
+
+class FakeCollection(object):
+    def __init__(self, connection):
+        self.__connection = connection
+
+    def full_name(self):
+        return u'test.fake'
+
+    def database(self):
+        return self
+
+    def connection(self):
+        return self.__connection
+
+
+class ManipulatedCollection(FakeCollection):
+    def _fix_outgoing(self, son, collection):
+        return dict(son, fixed = True)
+
+
+
+class LazyCursorTests(unittest.TestCase):
+    def test_wire_protocol(self):
+        connection = Response([dict(rank = i) for i in xrange(5)], 2)
+        cursor = LazyCursor(FakeCollection(connection), {'rank': {'$gt': 0}},
+                            fields = ['rank'], batch_size = 2)
+
+        self.assertEqual(range(5), [doc['rank'] for doc in cursor])
+        self.assertEqual([2004, 2005, 2005], [op for op, message in connection.messages])
+        self.assert_('test.fake\x00' in connection.messages[0][1])
+
+
+    def test_closes_cursor_at_limit(self):
+        connection = Response([dict(rank = i) for i in xrange(5)], 2)
+        cursor = LazyCursor(FakeCollection(connection), {}, limit = 2)
+
+        self.assertEqual([0, 1], [doc['rank'] for doc in cursor])
+        self.assertEqual([42], connection.closed)
+
+
+    def test_getmore_goes_to_connection_of_query(self):
+        connection = MasterSlaveResponse([dict(rank = i) for i in xrange(5)], 2)
+        cursor = LazyCursor(FakeCollection(connection), {}, batch_size = 2)
+
+        self.assertEqual(range(5), [doc['rank'] for doc in cursor])
+        self.assertEqual([None, 3, 3], connection.connections)
+
+
+    def test_applies_outgoing_manipulators(self):
+        connection = Response([dict(rank = 1)], 2)
+        docs = list(LazyCursor(ManipulatedCollection(connection), {}))
+        self.assertEqual([dict(rank = 1, fixed = True)], docs)
+
+        docs = list(LazyCursor(FakeCollection(Response([dict(rank = 1)], 2)), {}))
+        self.assert_(isinstance(docs[0], LazyBSON))
+
+
+
+class LazyDocumentsTests(unittest.TestCase):
+    def setUp(self):
+        db = MemoryDatabase('test')
+        LazyArticle.objects.bind(db)
+        LazyAuthor.objects.bind(db)
+
+        self.author = LazyAuthor(name = 'bob').save()
+        LazyArticle.objects.save_many(
+            dict(title = 'Article %d' % i, rank = i, author = self.author,
+                 meta = dict(views = i))
+            for i in xrange(5))
+
+
+    def test_reads_fields(self):
+        articles = list(LazyArticle.objects.all().sort('rank').lazy())
+
+        self.assert_(isinstance(articles[0]._data, LazyBSON))
+        self.assertEqual(['Article %d' % i for i in xrange(5)],
+                         [article.title for article in articles])
+        self.assertEqual(3, articles[3].meta.views)
+        self.assertEqual('bob', articles[0].author.name)
+
+
+    def test_saves_changes(self):
+        article = LazyArticle.objects.find({'rank': 1}).lazy().next()
+        article.title = 'Changed'
+        article.meta.views = 100
+        article.save()
+
+        article = LazyArticle.objects.find_one({'rank': 1})
+        self.assertEqual('Changed', article.title)
+        self.assertEqual(100, article.meta.views)
+
+        article = LazyArticle.objects.find({'rank': 1}).lazy().next()
+        article.remove()
+        self.assertEqual(4, len(LazyArticle.objects.all()))
+
+
+    def test_cursor_options(self):
+        cursor = LazyArticle.objects.all().sort('rank', -1).lazy()
+        self.assertEqual(5, len(cursor))
+        self.assertEqual(4, cursor[0].rank)
+        self.assertEqual([3, 2], [a.rank for a in cursor.skip(1).limit(2)])
+
+        cursor = LazyArticle.objects.all().only('rank').prefetch('author').lazy()
+        article = cursor.next()
+        self.failIf('title' in article._data)
+        self.assertEqual('bob', article.author._data['name'])
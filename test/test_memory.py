@@ -0,0 +1,65 @@
+# This code is licensed under the New BSD License
+# 2009, Alexander Artemenko <svetlyak.40wt@gmail.com>
+# For other contacts, visit http://aartemenko.com
+
+import unittest
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.dbref import DBRef
+from mongobongo.memory import MemoryDatabase
+
+
+class MemoryDatabaseTests(unittest.TestCase):
+    def setUp(self):
+        self.db = MemoryDatabase('test')
+        self.collection = self.db['docs']
+        for name, age in (('vasily', 30), ('alex', 25), ('olga', 35)):
+            self.collection.insert({'name': name, 'age': age, 'tags': [name[0]]})
+
+
+    def names(self, cursor):
+        return [doc['name'] for doc in cursor]
+
+
+    def test_query_operators(self):
+        find = self.collection.find
+        self.assertEqual(['vasily', 'olga'], self.names(find({'age': {'$gt': 25}})))
+        self.assertEqual(['alex'], self.names(find({'name': {'$in': ['alex', 'bob']}})))
+        self.assertEqual(['olga'], self.names(find({'tags': 'o'})))
+        self.assertEqual(['alex', 'olga'], self.names(
+            find({'$or': [{'age': 25}, {'name': 'olga'}]})))
+
+
+    def test_sort_skip_limit_and_count(self):
+        cursor = self.collection.find().sort([('age', DESCENDING)]).skip(1).limit(1)
+        self.assertEqual(['vasily'], self.names(cursor))
+        self.assertEqual(1, cursor.count(with_limit_and_skip = True))
+        self.assertEqual(3, cursor.count())
+
+        self.assertEqual('alex', self.collection.find().sort('age', ASCENDING)[0]['name'])
+
+
+    def test_returns_copies(self):
+        doc = self.collection.find_one({'name': 'alex'})
+        doc['tags'].append('changed')
+        self.assertEqual(['a'], self.collection.find_one({'name': 'alex'})['tags'])
+
+
+    def test_update_modifiers(self):
+        self.collection.update({'name': 'alex'},
+                               {'$set': {'address.city': 'Moscow'},
+                                '$unset': {'tags': 1},
+                                '$inc': {'age': 1}})
+        doc = self.collection.find_one({'name': 'alex'})
+        self.assertEqual({'city': 'Moscow'}, doc['address'])
+        self.assertEqual(26, doc['age'])
+        self.assert_('tags' not in doc)
+
+
+    def test_projection_and_dereference(self):
+        doc = self.collection.find_one({'name': 'olga'}, fields = ['age'])
+        self.assertEqual(set(['_id', 'age']), set(doc))
+
+        ref = DBRef('docs', doc['_id'])
+        self.assertEqual('olga', self.db.dereference(ref)['name'])
+        self.assertEqual(5, self.db.queries)
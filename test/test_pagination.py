@@ -0,0 +1,134 @@
+# This code is licensed under the New BSD License
+# 2009, Alexander Artemenko <svetlyak.40wt@gmail.com>
+# For other contacts, visit http://aartemenko.com
+
+import unittest
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import InvalidOperation
+from mongobongo import Document
+from mongobongo.instrumentation import add_listener, remove_listener
+from mongobongo.memory import MemoryDatabase
+from mongobongo.pagination import ordering, seek
+
+
+class PagedArticle(Document):
+    collection = 'paged_articles'
+
+    class Meta:
+        ordering = [('votes', DESCENDING)]
+
+
+class SeekTests(unittest.TestCase):
+    def testOrdering(self):
+        self.assertEqual([('_id', ASCENDING)], ordering(None))
+        self.assertEqual([('votes', DESCENDING), ('_id', ASCENDING)],
+                         ordering((('votes', DESCENDING), {})))
+        self.assertEqual([('_id', DESCENDING)],
+                         ordering((([('_id', DESCENDING)],), {})))
+        self.assertEqual([('votes', DESCENDING), ('_id', ASCENDING)],
+                         ordering((([['votes', DESCENDING]],), {})))
+
+    def testSeek(self):
+        keys = [('votes', DESCENDING), ('_id', ASCENDING)]
+        self.assertEqual(
+            {'author': 'bob',
+             '$or': [{'votes': {'$lt': 5}},
+                     {'votes': 5, '_id': {'$gt': 3}}]},
+            seek({'author': 'bob'}, keys, [5, 3]))
+        self.assertEqual({'$and': [{'_id': {'$ne': 1}}, {'_id': {'$gt': 3}}]},
+                         seek({'_id': {'$ne': 1}}, [('_id', ASCENDING)], [3]))
+
+
+class PaginationTests(unittest.TestCase):
+    def setUp(self):
+        PagedArticle.objects.bind(MemoryDatabase('test'))
+        PagedArticle.objects.save_many([
+            dict(_id = number, votes = number % 3, published = number != 4)
+            for number in range(10)])
+
+    def tearDown(self):
+        PagedArticle.objects.bind(None)
+
+    def ids(self, page):
+        return [article._id for article in page]
+
+    def testWalk(self):
+        pages = []
+        token = None
+        while True:
+            page = PagedArticle.objects.find({'published': True}) \
+                               .paginate(after = token, per_page = 3)
+            pages.append(self.ids(page))
+            if not page.has_next:
+                break
+            token = page.next_token
+
+        self.assertEqual([[2, 5, 8], [1, 7, 0], [3, 6, 9]], pages)
+
+    def testDeepPageIsOneQuery(self):
+        first = PagedArticle.objects.all().paginate(per_page = 5)
+        events = []
+        add_listener(events.append)
+        try:
+            page = PagedArticle.objects.all().paginate(after = first.next_token,
+                                                      per_page = 5)
+        finally:
+            remove_listener(events.append)
+
+        self.assertEqual([7, 0, 3, 6, 9], self.ids(page))
+        self.assertEqual(False, page.has_next)
+        self.assertEqual(['find'], [event.operation for event in events])
+        self.assertTrue('$or' in events[0].query)
+
+    def testLastPage(self):
+        page = PagedArticle.objects.all().paginate(per_page = 10)
+        self.assertEqual(10, len(page))
+        self.assertEqual(False, page.has_next)
+        self.assertEqual(None, page.next_token)
+
+    def testCursorSort(self):
+        page = PagedArticle.objects.all().sort('_id', DESCENDING) \
+                           .paginate(per_page = 4)
+        self.assertEqual([9, 8, 7, 6], self.ids(page))
+        page = PagedArticle.objects.all().sort('_id', DESCENDING) \
+                           .paginate(after = page.next_token, per_page = 4)
+        self.assertEqual([5, 4, 3, 2], self.ids(page))
+
+    def testSortByListOfLists(self):
+        page = PagedArticle.objects.all().sort([['_id', DESCENDING]]) \
+                           .paginate(per_page = 4)
+        page = PagedArticle.objects.all().sort([['_id', DESCENDING]]) \
+                           .paginate(after = page.next_token, per_page = 4)
+        self.assertEqual([5, 4, 3, 2], self.ids(page))
+
+    def testRaw(self):
+        page = PagedArticle.objects.find(as_dict = True).paginate(per_page = 2)
+        page = PagedArticle.objects.find(as_dict = True) \
+                           .paginate(after = page.next_token, per_page = 2)
+        self.assertEqual([8, 1], [data['_id'] for data in page])
+
+    def testQuerySet(self):
+        page = PagedArticle.objects.filter(votes = 1).paginate(per_page = 2)
+        self.assertEqual([1, 4], self.ids(page))
+        page = PagedArticle.objects.filter(votes = 1) \
+                           .paginate(after = page.next_token, per_page = 2)
+        self.assertEqual([7], self.ids(page))
+
+    def testOnlyKeepsSortKeys(self):
+        first = PagedArticle.objects.all().only('published').paginate(per_page = 1)
+        page = PagedArticle.objects.all().paginate(after = first.next_token,
+                                                   per_page = 1)
+        self.assertEqual([5], self.ids(page))
+
+    def testInvalidToken(self):
+        self.assertRaises(ValueError, PagedArticle.objects.all().paginate,
+                          after = 'garbage!')
+        token = PagedArticle.objects.all().paginate(per_page = 1).next_token
+        self.assertRaises(ValueError,
+                          PagedArticle.objects.all().sort('_id').paginate,
+                          after = token)
+
+    def testSkip(self):
+        self.assertRaises(InvalidOperation,
+                          PagedArticle.objects.all().skip(10).paginate)
@@ -0,0 +1,83 @@
+# This code is licensed under the New BSD License
+# 2009, Alexander Artemenko <svetlyak.40wt@gmail.com>
+# For other contacts, visit http://aartemenko.com
+
+import os
+import unittest
+
+from pymongo import DESCENDING
+from pymongo.errors import InvalidOperation
+from mongobongo import Document
+from mongobongo.memory import MemoryDatabase
+from mongobongo.parallel import split_by_id, multiprocessing
+
+
+class ParallelArticle(Document):
+    collection = 'parallel_articles'
+
+
+class ParallelArticleView(Document):
+    # registered for the same collection after ParallelArticle
+    collection = 'parallel_articles'
+
+
+def rank_and_pid(article):
+    return article.rank, os.getpid(), isinstance(article, ParallelArticle)
+
+
+class ParallelTests(unittest.TestCase):
+    def setUp(self):
+        db = MemoryDatabase('test')
+        ParallelArticle.objects.bind(db)
+        ParallelArticle.objects.save_many(
+            dict(rank = i, even = i % 2 == 0) for i in xrange(50))
+
+
+    def test_split_by_id(self):
+        collection = ParallelArticle.objects._collection
+        queries = split_by_id(collection, {'even': True}, 4)
+
+        self.assertEqual(4, len(queries))
+        self.failIf('$gte' in queries[0]['_id'])
+        self.failIf('$lt' in queries[-1]['_id'])
+
+        counts = [collection.find(query).count() for query in queries]
+        self.assertEqual(25, sum(counts))
+        self.assert_(max(counts) - min(counts) <= 1)
+
+
+    def test_split_small_result(self):
+        collection = ParallelArticle.objects._collection
+        self.assertEqual([{'rank': 1}], split_by_id(collection, {'rank': 1}, 4))
+        self.assertRaises(InvalidOperation, split_by_id, collection, {'_id': 1}, 4)
+
+
+    if multiprocessing is not None:
+        def test_parallel_map(self):
+            results = list(ParallelArticle.objects.find({'even': True}) \
+                           .parallel_map(rank_and_pid, workers = 2))
+
+            self.assertEqual(range(0, 50, 2), [rank for rank, pid, doc in results])
+            self.failIf(os.getpid() in [pid for rank, pid, doc in results])
+            self.assert_(all(doc for rank, pid, doc in results))
+
+
+        def test_unordered_parallel_map(self):
+            results = ParallelArticle.objects.all() \
+                          .parallel_map(rank_and_pid, workers = 3, ordered = False)
+
+            self.assertEqual(range(50), sorted(rank for rank, pid, doc in results))
+
+
+    def test_parallel_map_with_limit(self):
+        cursor = ParallelArticle.objects.all().limit(10)
+        self.assertRaises(InvalidOperation, cursor.parallel_map, rank_and_pid)
+
+
+    def test_parallel_map_with_unsupported_options(self):
+        objects = ParallelArticle.objects
+        for cursor in (objects.all().sort('rank', DESCENDING),
+                       objects.only('rank'),
+                       objects.all().raw(),
+                       objects.all().prefetch('author')):
+            self.assertRaises(InvalidOperation, cursor.parallel_map, rank_and_pid)
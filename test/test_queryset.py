@@ -0,0 +1,160 @@
+# This code is licensed under the New BSD License
+# 2009, Alexander Artemenko <svetlyak.40wt@gmail.com>
+# For other contacts, visit http://aartemenko.com
+
+import unittest
+
+from pymongo import ASCENDING, DESCENDING
+from mongobongo import Document
+from mongobongo.instrumentation import add_listener, remove_listener
+from mongobongo.memory import MemoryDatabase
+from mongobongo.queryset import compile_query
+
+
+class QueriedArticle(Document):
+    collection = 'queried_articles'
+
+    class Meta:
+        ordering = [('votes', DESCENDING)]
+
+
+class CompileTests(unittest.TestCase):
+    def testLookups(self):
+        self.assertEqual(
+            {'author': 'bob', 'votes': {'$gte': 3, '$lt': 10},
+             'meta.views': {'$gt': 100}, 'tags': {'$in': ['a', 'b']}},
+            compile_query(dict(author = 'bob', votes__gte = 3, votes__lt = 10,
+                               meta__views__gt = 100, tags__in = ['a', 'b']), {}))
+
+    def testExcludes(self):
+        self.assertEqual(
+            {'author': {'$ne': 'bob'}, 'tags': {'$nin': ['a']},
+             'votes': {'$not': {'$gt': 5}}, 'draft': {'$exists': False}},
+            compile_query({}, dict(author = 'bob', tags__in = ['a'],
+                                   votes__gt = 5, draft__exists = True)))
+
+    def testConflict(self):
+        self.assertRaises(ValueError, compile_query,
+                          dict(author = 'bob'), dict(author = 'joe'))
+
+    def testRepeatedLookups(self):
+        self.assertEqual(
+            {'status': {'$nin': ['draft', 'deleted', 'spam']},
+             'votes': {'$gte': 5, '$lt': 8}, 'tags': {'$in': ['b']}},
+            compile_query([('votes__gte', 5), ('votes__gte', 1),
+                           ('votes__lt', 8), ('votes__lt', 10),
+                           ('tags__in', ['a', 'b']), ('tags__in', ['b', 'c'])],
+                          [('status', 'draft'), ('status', 'deleted'),
+                           ('status', 'spam')]))
+        self.assertEqual({'author': 'bob'},
+                         compile_query([('author', 'bob'), ('author', 'bob')], []))
+        self.assertRaises(ValueError, compile_query,
+                          [('author', 'bob'), ('author', 'joe')], [])
+        self.assertRaises(ValueError, compile_query,
+                          [('tags__size', 1), ('tags__size', 2)], [])
+
+    def testShapeIsReused(self):
+        first = compile_query(dict(votes__gte = 1), {})
+        second = compile_query(dict(votes__gte = 2), {})
+        self.assertEqual({'votes': {'$gte': 1}}, first)
+        self.assertEqual({'votes': {'$gte': 2}}, second)
+
+
+class QuerySetTests(unittest.TestCase):
+    def setUp(self):
+        QueriedArticle.objects.bind(MemoryDatabase('test'))
+        QueriedArticle.objects.save_many([
+            dict(title = 'one', author = 'bob', votes = 3, tags = ['a']),
+            dict(title = 'two', author = 'bob', votes = 5, tags = ['a', 'b']),
+            dict(title = 'three', author = 'joe', votes = 1, tags = []),
+            dict(title = 'four', author = 'joe', votes = 7, tags = ['b']),
+        ])
+
+    def tearDown(self):
+        QueriedArticle.objects.bind(None)
+
+    def titles(self, queryset):
+        return [article.title for article in queryset]
+
+    def testLazy(self):
+        events = []
+        add_listener(events.append)
+        try:
+            queryset = QueriedArticle.objects.filter(author = 'bob') \
+                                             .exclude(votes__lt = 4) \
+                                             .order_by('title').limit(5)
+            self.assertEqual([], events)
+            self.assertEqual(['two'], self.titles(queryset))
+            self.assertEqual(['find'], [event.operation for event in events])
+            self.assertEqual((([('title', ASCENDING), ('votes', DESCENDING)],), {}),
+                             events[0].sort)
+        finally:
+            remove_listener(events.append)
+
+    def testChainsDontChangeOriginal(self):
+        bob = QueriedArticle.objects.filter(author = 'bob')
+        bob.filter(votes__gt = 4)
+        bob.exclude(title = 'one')
+        self.assertEqual(['two', 'one'], self.titles(bob))
+        self.assertEqual(2, len(bob))
+
+    def testDefaultOrdering(self):
+        self.assertEqual(['four', 'two', 'one', 'three'],
+                         self.titles(QueriedArticle.objects.filter()))
+
+    def testOrderingIsMerged(self):
+        queryset = QueriedArticle.objects.order_by('author')
+        self.assertEqual([('author', ASCENDING), ('votes', DESCENDING)],
+                         queryset.ordering())
+        self.assertEqual(['two', 'one', 'four', 'three'], self.titles(queryset))
+
+        queryset = QueriedArticle.objects.order_by('-author', 'votes')
+        self.assertEqual([('author', DESCENDING), ('votes', ASCENDING)],
+                         queryset.ordering())
+        self.assertEqual(['three', 'four', 'one', 'two'], self.titles(queryset))
+
+    def testSlicing(self):
+        queryset = QueriedArticle.objects.filter()
+        self.assertEqual(['two', 'one'], self.titles(queryset[1:3]))
+        self.assertEqual('one', queryset[2].title)
+        self.assertEqual('one', queryset.skip(1)[1].title)
+        self.assertRaises(IndexError, lambda: queryset[10])
+
+    def testSlicingKeepsLimit(self):
+        queryset = QueriedArticle.objects.filter().limit(3)
+        self.assertEqual(['two', 'one'], self.titles(queryset[1:10]))
+        self.assertEqual(['one'], self.titles(queryset[2:]))
+        self.assertEqual([], self.titles(queryset[3:]))
+        self.assertEqual(0, len(queryset[5:7]))
+        self.assertEqual([], self.titles(queryset[1:3][2:]))
+        self.assertRaises(IndexError, lambda: queryset[3])
+
+    def testExcludeNegatesEachLookup(self):
+        queryset = QueriedArticle.objects.exclude(author = 'bob', votes = 1)
+        self.assertEqual(['four'], self.titles(queryset))
+
+    def testOnly(self):
+        article = QueriedArticle.objects.filter(title = 'one').only('title').first()
+        self.assertEqual('one', article.title)
+        self.assertEqual(3, article.votes)
+
+    def testRepeatedFilterAndExclude(self):
+        queryset = QueriedArticle.objects.filter(votes__gte = 5).filter(votes__gte = 1)
+        self.assertEqual(['four', 'two'], self.titles(queryset))
+
+        queryset = QueriedArticle.objects.exclude(title = 'one').exclude(title = 'two')
+        self.assertEqual(['four', 'three'], self.titles(queryset))
+        self.assertEqual(['four'], self.titles(queryset.exclude(title = 'three')))
+
+    def testCountAndExists(self):
+        self.assertEqual(2, QueriedArticle.objects.filter(tags = 'b').count())
+        self.assertEqual(True, QueriedArticle.objects.exclude(tags__size = 0)
+                                                     .filter(author = 'joe').exists())
+        self.assertEqual(False, QueriedArticle.objects.filter(votes__gt = 10).exists())
+        self.assertEqual(None, QueriedArticle.objects.filter(votes__gt = 10).first())
+
+    def testCompiledQueryIsKept(self):
+        queryset = QueriedArticle.objects.filter(author = 'bob')
+        query = queryset.query()
+        self.assertTrue(query is queryset.order_by('title').limit(1).query())
+        self.assertFalse(query is queryset.filter(votes = 3).query())
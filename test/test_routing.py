@@ -0,0 +1,138 @@
+# This code is licensed under the New BSD License
+# 2009, Alexander Artemenko <svetlyak.40wt@gmail.com>
+# For other contacts, visit http://aartemenko.com
+
+import unittest
+
+from pymongo.dbref import DBRef
+from pymongo.errors import InvalidOperation
+from mongobongo import Document, PRIMARY, SECONDARY
+from mongobongo.memory import MemoryDatabase
+
+hot_db = MemoryDatabase('hot')
+replica_db = MemoryDatabase('replica')
+
+
+class RoutedArticle(Document):
+    collection = 'routed_articles'
+
+
+class HotCounter(Document):
+    collection = 'hot_counters'
+
+    class Meta:
+        database = lambda: hot_db
+        read_database = lambda: replica_db
+
+
+class SecondaryCounter(Document):
+    collection = 'secondary_counters'
+
+    class Meta:
+        database = hot_db
+        read_database = replica_db
+        read_preference = SECONDARY
+
+
+class RoutingTests(unittest.TestCase):
+    def setUp(self):
+        self.default_db = MemoryDatabase('default')
+        RoutedArticle.objects.db = self.default_db
+        for db in (hot_db, replica_db):
+            for name in db.collection_names():
+                db.drop_collection(name)
+
+
+    def test_default_db_does_not_rebind_bound_classes(self):
+        self.assert_(RoutedArticle.objects.db is self.default_db)
+        self.assert_(HotCounter.objects.db is hot_db)
+
+        HotCounter(name = 'visits').save()
+        self.assertEqual(1, hot_db.hot_counters.count())
+        self.failIf('hot_counters' in self.default_db.collection_names())
+
+
+    def test_bind(self):
+        db = MemoryDatabase('bound')
+        class BoundArticle(Document):
+            collection = 'bound_articles'
+        BoundArticle.objects.bind(db)
+
+        BoundArticle(title = 'first').save()
+        RoutedArticle.objects.db = MemoryDatabase('other')
+
+        self.assert_(BoundArticle.objects.db is db)
+        self.assertEqual('first', BoundArticle.objects.find_one().title)
+
+
+    def test_secondary_reads_go_to_read_database(self):
+        HotCounter(name = 'visits').save()
+        replica_db.hot_counters.insert(dict(name = 'replicated'))
+
+        self.assertEqual(['visits'], [c.name for c in HotCounter.objects.all()])
+        self.assertEqual(['replicated'],
+                         [c.name for c in HotCounter.objects.all(read_preference = SECONDARY)])
+        self.assertEqual('replicated',
+                         HotCounter.objects.find_one(read_preference = SECONDARY).name)
+
+
+    def test_read_preference_from_meta(self):
+        counter = SecondaryCounter(name = 'visits').save()
+        self.assertEqual(1, hot_db.secondary_counters.count())
+        self.assertEqual(None, SecondaryCounter.objects.find_one())
+
+        replica_db.secondary_counters.insert(dict(_id = counter._id, name = 'replicated'))
+        self.assertEqual('replicated', SecondaryCounter.objects.find_one().name)
+        self.assertEqual('visits',
+                         SecondaryCounter.objects.find_one(read_preference = PRIMARY).name)
+
+
+    def test_dereference_uses_database_of_referenced_class(self):
+        counter = HotCounter(name = 'visits').save()
+        RoutedArticle(title = 'first', counter = counter).save()
+
+        article = RoutedArticle.objects.find_one()
+        self.assertEqual('visits', article.counter.name)
+
+        article = RoutedArticle.objects.all().prefetch('counter').next()
+        self.assertEqual('visits', article.counter._data['name'])
+
+
+    def test_read_preference_cannot_change_after_query(self):
+        cursor = RoutedArticle.objects.all()
+        list(cursor)
+        self.assertRaises(InvalidOperation, cursor.read_preference, SECONDARY)
+
+
+    def test_slave_okay_is_passed_for_secondary_reads_only(self):
+        counter = HotCounter(name = 'visits').save()
+        RoutedArticle(title = 'first', counter = counter).save()
+        calls = []
+
+        def record(db):
+            collection = db.hot_counters
+            find = collection.find
+            def record_find(*args, **kwargs):
+                calls.append((db.name(), kwargs.get('slave_okay')))
+                return find(*args, **kwargs)
+            collection.find = record_find
+
+        record(hot_db)
+        record(replica_db)
+
+        list(HotCounter.objects.all())
+        HotCounter.objects.all().exists()
+        list(HotCounter.objects.all(read_preference = SECONDARY))
+        RoutedArticle.objects.find_one().counter
+        self.assertEqual([('hot', None), ('hot', None), ('replica', True),
+                          ('hot', None)], calls)
+
+
+    def test_dereference_of_collection_without_class(self):
+        self.default_db.raw_counters.insert(dict(name = 'raw'))
+        counter = self.default_db.raw_counters.find_one()
+        RoutedArticle(title = 'first').save()
+        RoutedArticle.objects.update({}, {'$set': {'counter':
+            DBRef('raw_counters', counter['_id'])}})
+
+        self.assertEqual('raw', RoutedArticle.objects.find_one().counter['name'])
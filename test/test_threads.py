@@ -0,0 +1,184 @@
+# This code is licensed under the New BSD License
+# 2009, Alexander Artemenko <svetlyak.40wt@gmail.com>
+# For other contacts, visit http://aartemenko.com
+
+from __future__ import with_statement
+
+import threading
+import time
+import unittest
+
+from mongobongo import Document, Reference, identity_map, session, using
+from mongobongo.asynchronous import AsyncCollectionManager, Executor
+from mongobongo.context import current_database
+from mongobongo.identity import get_identity_map
+from mongobongo.instrumentation import add_listener, remove_listener
+from mongobongo.memory import MemoryDatabase
+from mongobongo.unitofwork import get_session
+
+
+class ThreadedAuthor(Document):
+    collection = 'threaded_authors'
+
+
+class ThreadedArticle(Document):
+    collection = 'threaded_articles'
+    fields = ('title', Reference('author'))
+
+
+def run_threads(target, count = 8):
+    """Runs `target(number)` in threads, which start at once,
+       and returns their results or exceptions."""
+    results = [None] * count
+    start = threading.Event()
+
+    def run(number):
+        start.wait()
+        try:
+            results[number] = target(number)
+        except Exception, e:
+            results[number] = e
+
+    threads = [threading.Thread(target = run, args = (number,))
+               for number in range(count)]
+    for thread in threads:
+        thread.start()
+    start.set()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+class DatabaseBindingTests(unittest.TestCase):
+    def testBindingIsPerThread(self):
+        databases = [MemoryDatabase('site%d' % number) for number in range(4)]
+
+        def work(number):
+            with using(databases[number]):
+                ThreadedAuthor(name = 'author%d' % number).save()
+                time.sleep(0.01)
+                return [author.name for author in ThreadedAuthor.objects.all()]
+
+        self.assertEqual([['author%d' % number] for number in range(4)],
+                         run_threads(work, 4))
+        self.assertEqual(None, current_database())
+
+    def testBindingIsNested(self):
+        first, second = MemoryDatabase('first'), MemoryDatabase('second')
+        with using(first):
+            with using(second):
+                self.assertTrue(ThreadedAuthor.objects.db is second)
+            self.assertTrue(ThreadedAuthor.objects.db is first)
+
+    def testAsyncCallsUseCallersBinding(self):
+        db = MemoryDatabase('async')
+        executor = Executor(2)
+        manager = AsyncCollectionManager(ThreadedAuthor.objects, executor)
+        try:
+            with using(db):
+                ThreadedAuthor(name = 'bob').save()
+                future = manager.find_one({'name': 'bob'})
+            self.assertEqual('bob', future.result(5).name)
+        finally:
+            executor.shutdown()
+
+    def testFactoryIsCalledOnce(self):
+        calls = []
+
+        def connect():
+            calls.append(1)
+            time.sleep(0.01)
+            return MemoryDatabase('lazy')
+
+        class LazyDoc(Document):
+            collection = 'lazy_docs'
+            class Meta:
+                database = connect
+
+        databases = run_threads(lambda number: LazyDoc.objects.db)
+        self.assertEqual(1, len(calls))
+        self.assertEqual(1, len(set(id(db) for db in databases)))
+
+
+class ThreadStateTests(unittest.TestCase):
+    def setUp(self):
+        ThreadedAuthor.objects.bind(MemoryDatabase('test'))
+
+    def tearDown(self):
+        ThreadedAuthor.objects.bind(None)
+
+    def testSessionIsPerThread(self):
+        entered = threading.Event()
+        saved = threading.Event()
+
+        def other():
+            entered.wait()
+            ThreadedAuthor(name = 'joe').save()
+            saved.set()
+
+        thread = threading.Thread(target = other)
+        thread.start()
+        with session() as s:
+            entered.set()
+            saved.wait()
+            self.assertEqual(0, len(s))
+            self.assertEqual(1, len([a for a in ThreadedAuthor.objects.all()]))
+        thread.join()
+
+    def testIdentityMapIsPerThread(self):
+        with identity_map():
+            self.assertEqual([None], run_threads(
+                lambda number: get_identity_map(), 1))
+            self.assertEqual([None], run_threads(
+                lambda number: get_session(), 1))
+
+
+class DereferenceTests(unittest.TestCase):
+    def setUp(self):
+        db = MemoryDatabase('test')
+        ThreadedAuthor.objects.bind(db)
+        ThreadedArticle.objects.bind(db)
+        bob = ThreadedAuthor(name = 'bob')
+        ThreadedArticle(title = 'First', author = bob, editor = bob).save()
+        ThreadedArticle(title = 'Second', text = 'Text', author = ThreadedAuthor(
+            name = 'joe')).save()
+
+        self.fetches = []
+        add_listener(self.slow_listener)
+
+    def tearDown(self):
+        remove_listener(self.slow_listener)
+        ThreadedAuthor.objects.bind(None)
+        ThreadedArticle.objects.bind(None)
+
+    def slow_listener(self, event):
+        # widens the window, in which other threads could fetch too
+        self.fetches.append(event.operation)
+        time.sleep(0.02)
+
+    def testDereferenceIsFetchedOnce(self):
+        article = ThreadedArticle.objects.find_one({'title': 'First'})
+        del self.fetches[:]
+
+        authors = run_threads(lambda number: article.author)
+        self.assertEqual(['dereference'], self.fetches)
+        self.assertEqual(1, len(set(id(author) for author in authors)))
+        self.assertEqual('bob', authors[0].name)
+
+    def testUndeclaredDereferenceIsFetchedOnce(self):
+        article = ThreadedArticle.objects.find_one({'title': 'First'})
+        del self.fetches[:]
+
+        # `editor` is not declared, so it goes through __getattr__
+        authors = run_threads(lambda number: article.editor)
+        self.assertEqual(['dereference'], self.fetches)
+        self.assertEqual(1, len(set(id(author) for author in authors)))
+
+    def testDeferredFieldIsLoadedOnce(self):
+        articles = [article for article in
+                    ThreadedArticle.objects.all().only('title')]
+        del self.fetches[:]
+
+        texts = run_threads(lambda number: articles[number % 2].text)
+        self.assertEqual(['find'], self.fetches)
+        self.assertEqual(set([None, 'Text']), set(texts))
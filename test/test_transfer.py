@@ -0,0 +1,119 @@
+# This code is licensed under the New BSD License
+# 2009, Alexander Artemenko <svetlyak.40wt@gmail.com>
+# For other contacts, visit http://aartemenko.com
+
+import datetime
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+from pymongo.dbref import DBRef
+from mongobongo import Document
+from mongobongo.memory import MemoryDatabase
+
+
+class ExportedArticle(Document):
+    collection = 'exported_articles'
+
+
+class ExportedAuthor(Document):
+    collection = 'exported_authors'
+
+
+class TransferTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.db = MemoryDatabase('test')
+        ExportedArticle.objects.bind(self.db)
+        ExportedAuthor.objects.bind(self.db)
+
+        self.author = ExportedAuthor(name = 'bob').save()
+        ExportedArticle.objects.save_many(
+            dict(title = 'Article %d' % i,
+                 rank = i,
+                 tags = ['a', 'b'],
+                 created = datetime.datetime(2009, 11, 1, 12, 30, i),
+                 author = self.author)
+            for i in xrange(25))
+
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+
+    def reimport(self, name, **kwargs):
+        original = list(self.db.exported_articles.find())
+        ExportedArticle.objects.export(self.path(name), **kwargs)
+        ExportedArticle.objects.remove()
+
+        ExportedArticle.objects.import_(self.path(name), **kwargs)
+        self.assertEqual(original, list(self.db.exported_articles.find()))
+
+
+    def test_jsonl(self):
+        self.reimport('articles.jsonl')
+
+        line = open(self.path('articles.jsonl')).readline()
+        self.assert_('"$ref":"exported_authors"' in line)
+        self.assert_('"$date":' in line)
+
+
+    def test_bson(self):
+        self.reimport('articles.bson')
+
+
+    def test_gzip(self):
+        self.reimport('articles.jsonl.gz')
+        self.reimport('articles.bson.gz')
+        self.reimport('articles.dump', format = 'bson', compress = True)
+
+        gzip.open(self.path('articles.dump')).read()
+
+
+    def test_references_are_relinked(self):
+        self.reimport('articles.bson')
+        article = ExportedArticle.objects.find_one({'rank': 3})
+
+        self.assertEqual(DBRef('exported_authors', self.author._id),
+                         article._data['author'])
+        self.assertEqual('bob', article.author.name)
+
+
+    def test_query_and_stats(self):
+        reported = []
+        stats = ExportedArticle.objects.export(
+            self.path('articles.jsonl'), {'rank': {'$lt': 10}},
+            batch_size = 4, progress = lambda s: reported.append(s.documents))
+
+        self.assertEqual(10, stats.documents)
+        self.assertEqual(os.path.getsize(self.path('articles.jsonl')), stats.bytes)
+        self.assertEqual([4, 8, 10], reported)
+        self.assert_('10 documents' in str(stats))
+
+        reported = []
+        ExportedArticle.objects.remove()
+        stats = ExportedArticle.objects.import_(
+            self.path('articles.jsonl'), batch_size = 4,
+            progress = lambda s: reported.append(s.documents))
+        self.assertEqual(10, stats.documents)
+        self.assertEqual([4, 8, 10], reported)
+        self.assertEqual(10, len(ExportedArticle.objects.all()))
+
+
+    def test_progress_is_not_repeated_after_full_batch(self):
+        reported = []
+        ExportedArticle.objects.export(
+            self.path('articles.jsonl'), {'rank': {'$lt': 8}},
+            batch_size = 4, progress = lambda s: reported.append(s.documents))
+        self.assertEqual([4, 8], reported)
+
+
+    def test_unknown_format(self):
+        self.assertRaises(ValueError, ExportedArticle.objects.export,
+                          self.path('articles.csv'), format = 'csv')
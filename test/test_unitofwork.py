@@ -0,0 +1,226 @@
+# This code is licensed under the New BSD License
+# 2009, Alexander Artemenko <svetlyak.40wt@gmail.com>
+# For other contacts, visit http://aartemenko.com
+
+from __future__ import with_statement
+
+import unittest
+
+from pymongo.dbref import DBRef
+from mongobongo import Document, session
+from mongobongo.instrumentation import add_listener, remove_listener
+from mongobongo.memory import MemoryDatabase
+from mongobongo.unitofwork import get_session
+
+
+class SessionArticle(Document):
+    collection = 'session_articles'
+
+
+class SessionAuthor(Document):
+    collection = 'session_authors'
+
+
+class OtherSessionArticle(Document):
+    collection = 'session_articles'
+
+
+class SessionTests(unittest.TestCase):
+    def setUp(self):
+        db = MemoryDatabase('test')
+        SessionArticle.objects.bind(db)
+        SessionAuthor.objects.bind(db)
+        self.events = []
+        add_listener(self.events.append)
+
+    def tearDown(self):
+        remove_listener(self.events.append)
+        SessionArticle.objects.bind(None)
+        SessionAuthor.objects.bind(None)
+
+    def operations(self):
+        return [(event.operation, event.collection) for event in self.events]
+
+    def count(self, doc_class):
+        return len([doc for doc in doc_class.objects.all()])
+
+    def testInsertsAreBatched(self):
+        with session() as s:
+            self.assertTrue(get_session() is s)
+            for number in range(5):
+                SessionArticle(number = number).save()
+            self.assertEqual(5, len(s))
+            self.assertEqual([], self.events)
+
+        self.assertEqual(None, get_session())
+        self.assertEqual([('insert', 'session_articles')], self.operations())
+        self.assertEqual(5, self.count(SessionArticle))
+
+    def testSavesAreMerged(self):
+        article = SessionArticle(title = 'one', votes = 0)
+        article.save()
+        del self.events[:]
+
+        with session():
+            article.title = 'two'
+            article.save()
+            article.votes = 1
+            article.save()
+
+        self.assertEqual([('update', 'session_articles')], self.operations())
+        loaded = SessionArticle.objects.find_one({'_id': article._id})
+        self.assertEqual('two', loaded.title)
+        self.assertEqual(1, loaded.votes)
+
+    def testNewDocumentSavedTwiceIsOneInsert(self):
+        with session():
+            article = SessionArticle(title = 'one')
+            article.save()
+            article.title = 'two'
+            article.save()
+
+        self.assertEqual([('insert', 'session_articles')], self.operations())
+        self.assertEqual('two', SessionArticle.objects.find_one().title)
+
+    def testRemovesAreGrouped(self):
+        articles = [SessionArticle(number = number).save() for number in range(3)]
+        del self.events[:]
+
+        with session():
+            for article in articles[:2]:
+                article.remove()
+
+        self.assertEqual([('remove', 'session_articles')], self.operations())
+        self.assertEqual(1, self.count(SessionArticle))
+
+    def testRemovedNewDocumentIsNotSent(self):
+        with session():
+            article = SessionArticle(title = 'one').save()
+            article.remove()
+        self.assertEqual([], self.events)
+
+    def testReadYourWrites(self):
+        removed = SessionArticle(title = 'removed').save()
+        with session():
+            article = SessionArticle(title = 'new').save()
+            self.assertTrue(SessionArticle.objects.find_one({'_id': article._id})
+                            is article)
+            self.assertEqual('new', SessionArticle.objects.find_one(
+                {'_id': article._id}, as_dict = True)['title'])
+
+            removed.remove()
+            self.assertEqual(None, SessionArticle.objects.find_one(
+                {'_id': removed._id}))
+            self.assertEqual([], [event for event in self.events
+                                  if event.operation != 'save'])
+
+    def testGroupedPerCollection(self):
+        with session():
+            author = SessionAuthor(name = 'bob').save()
+            for number in range(3):
+                SessionArticle(author = author, number = number).save()
+            SessionAuthor(name = 'joe').save()
+
+        self.assertEqual([('insert', 'session_authors'),
+                          ('insert', 'session_articles')], self.operations())
+        article = SessionArticle.objects.find_one({'number': 0}, as_dict = True)
+        self.assertEqual(DBRef('session_authors', author._id), article['author'])
+
+    def testUnsavedReferenceIsSavedInFlush(self):
+        with session():
+            author = SessionAuthor(name = 'bob')
+            SessionArticle(author = author).save()
+
+        self.assertEqual(1, self.count(SessionAuthor))
+        self.assertEqual('bob', SessionArticle.objects.find_one().author.name)
+
+    def testSizeThreshold(self):
+        with session(size = 2) as s:
+            SessionArticle(number = 1).save()
+            self.assertEqual(0, self.count(SessionArticle))
+            SessionArticle(number = 2).save()
+            self.assertEqual(0, len(s))
+            self.assertEqual(2, self.count(SessionArticle))
+            SessionArticle(number = 3).save()
+        self.assertEqual(3, self.count(SessionArticle))
+
+    def testExceptionDiscardsWrites(self):
+        def fail():
+            with session():
+                SessionArticle(title = 'one').save()
+                raise RuntimeError()
+        self.assertRaises(RuntimeError, fail)
+        self.assertEqual(None, get_session())
+        self.assertEqual(0, self.count(SessionArticle))
+
+    def testDiscardedDocumentsAreSavedLater(self):
+        article = SessionArticle(title = 'one').save()
+
+        def fail():
+            with session():
+                article.title = 'two'
+                article.save()
+                self.new = SessionArticle(title = 'new')
+                self.new.save()
+                raise RuntimeError()
+        self.assertRaises(RuntimeError, fail)
+        self.assertEqual(1, self.count(SessionArticle))
+
+        article.save()
+        self.new.save()
+        self.assertEqual('two', SessionArticle.objects.find_one(
+            {'_id': article._id}).title)
+        self.assertEqual('new', SessionArticle.objects.find_one(
+            {'_id': self.new._id}).title)
+
+    def testSaveManyIsQueued(self):
+        data = dict(title = 'dict')
+        with session() as s:
+            ids = SessionArticle.objects.save_many(
+                [SessionArticle(title = 'one'), data])
+            self.assertEqual(2, len(s))
+            self.assertEqual([], self.events)
+            self.assertEqual(ids[1], data['_id'])
+            self.assertEqual('dict', SessionArticle.objects.find_one(
+                {'_id': ids[1]}).title)
+
+        self.assertEqual([('insert', 'session_articles')], self.operations())
+        self.assertEqual(2, self.count(SessionArticle))
+
+    def testSaveManyKeepsDocumentsUnsavedOnFailure(self):
+        collection = SessionArticle.objects._collection
+        def insert(docs):
+            raise RuntimeError()
+        collection.insert = insert
+
+        article = SessionArticle(title = 'one')
+        try:
+            self.assertRaises(RuntimeError, SessionArticle.objects.save_many,
+                              [article])
+        finally:
+            del collection.insert
+        self.assertEqual(False, article._persisted)
+
+        article.save()
+        self.assertEqual('one', SessionArticle.objects.find_one().title)
+
+    def testSameCollectionNameInDifferentDatabases(self):
+        other = MemoryDatabase('other')
+        OtherSessionArticle.objects.bind(other)
+        try:
+            with session():
+                article = SessionArticle(title = 'one')
+                article.save()
+                copy = OtherSessionArticle(_id = article._id, title = 'two')
+                copy.save()
+                self.assertEqual('one', SessionArticle.objects.find_one(
+                    {'_id': article._id}).title)
+                self.assertEqual('two', OtherSessionArticle.objects.find_one(
+                    {'_id': article._id}).title)
+
+            self.assertEqual(['one'], [doc.title for doc
+                                       in SessionArticle.objects.all()])
+            self.assertEqual(['two'], [doc.title for doc
+                                       in OtherSessionArticle.objects.all()])
+        finally:
+            OtherSessionArticle.objects.bind(None)